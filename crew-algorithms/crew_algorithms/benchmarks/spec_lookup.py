@@ -0,0 +1,128 @@
+"""Microbenchmark for the per-agent read_* helpers of `UnityWrapper`.
+
+Compares the nested composite spec lookups the helpers used to perform on
+every call with the per-agent encoders that are now cached in `_make_specs`.
+Both variants are a real `UnityWrapper` on the in-process mock Unity backend:
+the old helpers are restored in `LegacyUnityWrapper`. Each decodes the same
+Unity steps, once through the read_* helpers only and once through the whole
+per-agent `_get_next_tensordict`.
+
+Example:
+    python -m crew_algorithms.benchmarks.spec_lookup --num-agents 15 \\
+        --obs-shape 3728
+"""
+import argparse
+from time import perf_counter
+
+from crew_algorithms.envs.mock import MockBehavior, MockUnityEnvironment
+from crew_algorithms.envs.unity import UnityWrapper
+
+
+class LegacyUnityWrapper(UnityWrapper):
+    """`UnityWrapper` with the read_* helpers from before the cached encoders."""
+
+    def read_obs(self, agent_id, obs):
+        return self.observation_spec["agents", "observation"][agent_id].encode(
+            {f"obs_{i}": observation for i, observation in enumerate(obs)},
+        )
+
+    def read_reward(self, agent_id, reward):
+        return self.reward_spec[agent_id].encode(reward)
+
+    def read_valid_mask(self, agent_id, valid):
+        return self.valid_mask_spec["agents", "valid_mask"][agent_id].encode(valid)
+
+    def read_done(self, agent_id, done):
+        return self.done_spec["agents", "done"][agent_id].encode(done)
+
+
+def make_env(wrapper_cls, num_agents, obs_shapes, device="cpu"):
+    """Builds a wrapper of a mock environment with one behavior.
+
+    Args:
+        wrapper_cls: `UnityWrapper` or `LegacyUnityWrapper`.
+        num_agents: Number of agents in the environment.
+        obs_shapes: Shape of every observation of an agent.
+        device: The device of the wrapper.
+
+    Returns:
+        The wrapper, reset.
+    """
+    behaviors = {
+        "My Behavior": MockBehavior(
+            [tuple(shape) for shape in obs_shapes],
+            continuous_size=3,
+            num_agents=num_agents,
+        )
+    }
+    env = wrapper_cls(MockUnityEnvironment(behaviors, seed=0), device=device)
+    env.reset()
+    return env
+
+
+def read_steps(env):
+    """Decodes the current Unity steps with the read_* helpers of `env`."""
+    for behavior_name in env.behavior_specs.keys():
+        decision_steps, _ = env.get_steps(behavior_name)
+        for agent_id in decision_steps.agent_id:
+            agent_id = int(agent_id)
+            step = decision_steps[agent_id]
+            env.read_obs(agent_id, step.obs)
+            env.read_reward(agent_id, step.reward)
+            env.read_done(agent_id, False)
+            env.read_valid_mask(agent_id, True)
+
+
+def get_next_tensordict(env):
+    """Decodes the current Unity steps into the step output of `env`."""
+    env._get_next_tensordict(env.batch_size)
+
+
+def time_steps(fn, num_steps, *args):
+    """Returns the mean wall time of `fn` in milliseconds per step."""
+    fn(*args)
+    tic = perf_counter()
+    for _ in range(num_steps):
+        fn(*args)
+    return (perf_counter() - tic) / num_steps * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--num-agents", type=int, default=15)
+    parser.add_argument(
+        "--obs-shape",
+        type=int,
+        nargs="+",
+        action="append",
+        help="Shape of one observation, can be repeated. Defaults to Wildfire.",
+    )
+    parser.add_argument("--num-steps", type=int, default=200)
+    parser.add_argument("--device", type=str, default="cpu")
+    args = parser.parse_args()
+    obs_shapes = args.obs_shape or [[3728]]
+
+    envs = {
+        name: make_env(wrapper_cls, args.num_agents, obs_shapes, args.device)
+        for name, wrapper_cls in (
+            ("before", LegacyUnityWrapper),
+            ("after", UnityWrapper),
+        )
+    }
+    print(f"agents={args.num_agents} obs_shapes={obs_shapes} device={args.device}")
+    for fn in (read_steps, get_next_tensordict):
+        before, after = (
+            time_steps(fn, args.num_steps, envs[name]) for name in ("before", "after")
+        )
+        print(
+            f"{fn.__name__}:\n"
+            f"  before: {before:.3f} ms/step\n"
+            f"  after:  {after:.3f} ms/step\n"
+            f"  speedup: {before / after:.1f}x"
+        )
+    for env in envs.values():
+        env.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,470 @@
+"""End-to-end throughput benchmark for the DDPG, SAC and Deep TAMER trainers.
+
+Runs the collection and update loop of each trainer, assembled from the
+trainer's own `make_*` helpers and configuration, against the in-process mock
+Unity backend for a fixed number of frames. Reports frames per second, learner
+updates per second and the latency of every stage of the loop, and writes them
+as JSON so that results can be compared between releases.
+
+The run happens in a temporary working directory, so the replay buffer memmaps
+and checkpoints written through the relative `../Data` paths of the trainers
+are thrown away afterwards.
+
+Example:
+    python -m crew_algorithms.benchmarks.trainers --algorithms ddpg sac \\
+        --env find_treasure --frames 2000 --output results.json
+"""
+import argparse
+import importlib
+import json
+import os
+import platform
+import tempfile
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from importlib.metadata import PackageNotFoundError, version
+from time import perf_counter
+from typing import Callable, ContextManager
+
+import numpy as np
+import torch
+import torchrl
+from attrs import define, field
+from crew_algorithms.utils.batch_preprocessing import BatchPreprocessor
+from crew_algorithms.utils.embedding_cache import EmbeddingCache
+from crew_algorithms.utils.learner import LossHistory, compile_loss_networks
+from crew_algorithms.utils.prefetch import ReplayBufferPrefetcher
+from crew_algorithms.utils.rl_utils import make_collector
+from hydra import compose, initialize
+from hydra.core.config_store import ConfigStore
+from omegaconf import OmegaConf
+from tensordict import TensorDictBase
+from torchrl.envs import EnvBase
+
+ALGORITHMS = ["ddpg", "sac", "deep_tamer"]
+
+
+class StageTimer:
+    """Accumulates the wall times of the stages of a training loop.
+
+    CUDA kernels run asynchronously, so the device is synchronized around every
+    stage when timing on a GPU.
+
+    Args:
+        device: The device the training loop runs on.
+    """
+
+    def __init__(self, device: str):
+        self.synchronize = torch.device(device).type == "cuda"
+        self.times = defaultdict(list)
+
+    @contextmanager
+    def __call__(self, stage: str):
+        if self.synchronize:
+            torch.cuda.synchronize()
+        tic = perf_counter()
+        try:
+            yield
+        finally:
+            if self.synchronize:
+                torch.cuda.synchronize()
+            self.times[stage].append(perf_counter() - tic)
+
+    def wrap(self, stage: str, fn: Callable) -> Callable:
+        """Returns `fn` with every call timed under `stage`."""
+
+        def timed(*args, **kwargs):
+            with self(stage):
+                return fn(*args, **kwargs)
+
+        return timed
+
+    def summary(self) -> dict[str, dict[str, float]]:
+        """Returns the call count, total and latency percentiles of each stage."""
+        summary = {}
+        for stage, times in self.times.items():
+            if stage.startswith("_"):
+                continue
+            times_ms = np.asarray(times) * 1000
+            summary[stage] = {
+                "count": len(times),
+                "total_s": float(times_ms.sum() / 1000),
+                "mean_ms": float(times_ms.mean()),
+                "p50_ms": float(np.percentile(times_ms, 50)),
+                "p95_ms": float(np.percentile(times_ms, 95)),
+            }
+        return summary
+
+
+@define(auto_attribs=True)
+class Trainer:
+    """The pieces of a trainer that the benchmark loop drives.
+
+    Attributes:
+        env_fn: Creates the transformed environment.
+        actor: The exploration policy used by the collector.
+        model: The networks that are checkpointed.
+        prb: The replay buffer.
+        loss_module: The loss module.
+        optimizer: The optimizer of the loss module.
+        target_net_updater: Updates the target networks after every step.
+        loss_keys: The entries of the loss tensordict that are summed into the
+            optimized loss.
+        grad_params: The parameters whose gradient norm is clipped.
+        max_grad_norm: The maximum gradient norm.
+        updates_per_batch: The number of learner updates after every batch.
+        preprocess: Turns a collected batch into what is stored in `prb`.
+        update_priority: Whether the sampler priorities are updated after
+            every step.
+        embedding_cache: Entered around every call of the loss module.
+    """
+
+    env_fn: Callable[[], EnvBase]
+    actor: torch.nn.Module
+    model: torch.nn.Module
+    prb: object
+    loss_module: torch.nn.Module
+    optimizer: torch.optim.Optimizer
+    target_net_updater: object
+    loss_keys: list[str]
+    grad_params: list[torch.nn.Parameter]
+    max_grad_norm: float
+    updates_per_batch: int
+    preprocess: Callable[[TensorDictBase], TensorDictBase]
+    update_priority: bool = False
+    embedding_cache: ContextManager = field(factory=nullcontext)
+
+
+def make_off_policy_trainer(algorithm: str, cfg, device: str) -> Trainer:
+    """Builds the DDPG or SAC trainer with the helpers of its training script."""
+    utils = importlib.import_module(f"crew_algorithms.{algorithm}.utils")
+
+    def env_fn():
+        return utils.make_env(cfg.envs, None, False, device)
+
+    proof_env = env_fn()
+    model, actor, _ = utils.make_agent(cfg, proof_env, device)
+    loss_module, target_net_updater = utils.make_loss_module(cfg, proof_env, model)
+    if cfg.optimization.compile_mode != "none":
+        compile_loss_networks(loss_module, mode=cfg.optimization.compile_mode)
+    proof_env.close()
+    prb, _ = utils.make_data_buffer(cfg, "benchmark")
+
+    preprocess = BatchPreprocessor(
+        cfg.envs,
+        device,
+        heuristic_feedback=cfg.heuristic_feedback,
+        human_feedback=cfg.hf,
+        credit_window=cfg.credit_window,
+        history=cfg.history,
+    )
+
+    if algorithm == "ddpg":
+        loss_keys = ["loss_actor", "loss_value"]
+    else:
+        loss_keys = ["loss_actor", "loss_qvalue", "loss_alpha"]
+    return Trainer(
+        env_fn=env_fn,
+        actor=actor,
+        model=model,
+        prb=prb,
+        loss_module=loss_module,
+        optimizer=utils.make_optimizer(cfg, loss_module),
+        target_net_updater=target_net_updater,
+        loss_keys=loss_keys,
+        grad_params=list(model.parameters()),
+        max_grad_norm=cfg.optimization.max_grad_norm,
+        updates_per_batch=int(
+            cfg.collector.frames_per_batch * cfg.optimization.utd_ratio
+        ),
+        preprocess=preprocess,
+        update_priority=True,
+        embedding_cache=(
+            EmbeddingCache(cfg.encode_next_once)
+            if cfg.get("embedding_cache", False)
+            else nullcontext()
+        ),
+    )
+
+
+def make_deep_tamer_trainer(cfg, device: str) -> Trainer:
+    """Builds the Deep TAMER trainer with the helpers of its training script."""
+    from crew_algorithms.deep_tamer.utils import (
+        make_agent,
+        make_data_buffer,
+        make_env,
+        make_loss,
+        make_optim,
+    )
+
+    def env_fn():
+        return make_env(cfg.envs, None, device)
+
+    proof_env = env_fn()
+    model, actor = make_agent(cfg, proof_env, device)
+    proof_env.close()
+    _, replay_buffer = make_data_buffer(cfg, "benchmark")
+    loss_module, target_net_updater = make_loss(
+        model, device, cfg.envs.credit_window_right
+    )
+
+    def preprocess(data):
+        obs = data["agents", "observation", "obs_1"]
+        next_obs = data["next", "agents", "observation", "obs_1"]
+        # The mock backend gives no human feedback, so every frame is given a
+        # random one for the credit assignment and updates to work on.
+        feedback = obs[..., -1, 0:1]
+        data["feedback"] = torch.randint_like(feedback, 0, 2) * 2 - 1
+        data["time"] = torch.cat([obs[..., -1, 1], next_obs[..., -1, 1]], dim=-1)
+        data["feedback_time"] = data["time"][..., -1].clone()
+        return data
+
+    return Trainer(
+        env_fn=env_fn,
+        actor=actor,
+        model=model,
+        prb=replay_buffer,
+        loss_module=loss_module,
+        optimizer=make_optim(cfg, loss_module),
+        target_net_updater=target_net_updater,
+        loss_keys=["loss_actor", "loss_value"],
+        grad_params=list(loss_module.parameters()),
+        max_grad_norm=1.0,
+        updates_per_batch=cfg.collector.frames_per_batch // cfg.buffer_update_interval,
+        preprocess=preprocess,
+    )
+
+
+def load_config(algorithm: str, overrides: list[str]):
+    """Composes the Hydra configuration of a training script.
+
+    Args:
+        algorithm: The name of the training script.
+        overrides: Hydra overrides applied on top of the script's defaults.
+
+    Returns:
+        The composed configuration.
+    """
+    module = importlib.import_module(f"crew_algorithms.{algorithm}.__main__")
+    # Every training script stores its own Config as the base config.
+    ConfigStore.instance().store(name="base_config", node=module.Config)
+    with initialize(version_base=None, config_path="../conf"):
+        return compose(config_name=algorithm, overrides=overrides)
+
+
+def instrument_env(env: EnvBase, timer: StageTimer) -> EnvBase:
+    """Times the simulation and the transforms of every step and reset."""
+    base_env = env.base_env
+    base_env._step = timer.wrap("env_step", base_env._step)
+    base_env._reset = timer.wrap("env_step", base_env._reset)
+    env._step = timer.wrap("_env_total", env._step)
+    env._reset = timer.wrap("_env_total", env._reset)
+    return env
+
+
+def run_trainer(
+    algorithm: str,
+    cfg,
+    device: str,
+    checkpoint_interval: int = 1,
+) -> dict:
+    """Runs the collection and update loop of a trainer on the mock backend.
+
+    Args:
+        algorithm: One of `ALGORITHMS`.
+        cfg: The configuration of the trainer.
+        device: The device to collect and train on.
+        checkpoint_interval: Number of batches between checkpoint writes.
+
+    Returns:
+        The throughput and the per stage latencies of the run.
+    """
+    torch.manual_seed(cfg.get("seed", 0))
+    if algorithm == "deep_tamer":
+        trainer = make_deep_tamer_trainer(cfg, device)
+    else:
+        trainer = make_off_policy_trainer(algorithm, cfg, device)
+
+    timer = StageTimer(device)
+    collector = make_collector(
+        cfg.collector,
+        lambda: instrument_env(trainer.env_fn(), timer),
+        trainer.actor,
+        device,
+        in_process=True,
+    )
+    sampler = ReplayBufferPrefetcher(
+        trainer.prb, device, cfg.get("prefetch_batches", 0)
+    )
+    os.makedirs("checkpoints", exist_ok=True)
+
+    collected_frames, num_updates, num_batches = 0, 0, 0
+    start = perf_counter()
+    batches = iter(collector)
+    while True:
+        tic = perf_counter()
+        data = next(batches, None)
+        if data is None:
+            break
+        timer.times["collect"].append(perf_counter() - tic)
+        collected_frames += data.numel()
+        num_batches += 1
+
+        with timer("preprocess"):
+            data = trainer.preprocess(data)
+        with timer("prb_extend"):
+            trainer.prb.extend(data.cpu())
+
+        loss_history = LossHistory()
+        for _ in range(trainer.updates_per_batch):
+            with timer("prb_sample"):
+                sample = sampler.sample()
+            with timer("loss_forward"), trainer.embedding_cache:
+                loss_td = trainer.loss_module(sample)
+                loss = sum(loss_td[key] for key in trainer.loss_keys)
+            with timer("loss_backward"):
+                trainer.optimizer.zero_grad()
+                loss.backward()
+                torch.nn.utils.clip_grad_norm_(
+                    trainer.grad_params, trainer.max_grad_norm
+                )
+                trainer.optimizer.step()
+                trainer.target_net_updater.step()
+            if trainer.update_priority:
+                with timer("prb_update_priority"):
+                    trainer.prb.update_tensordict_priority(sample)
+            loss_history.append(total_loss=loss.detach())
+            num_updates += 1
+        with timer("loss_readback"):
+            loss_history.means()
+
+        if num_batches % checkpoint_interval == 0:
+            with timer("checkpoint_write"):
+                torch.save(trainer.model.state_dict(), f"checkpoints/{num_batches}.pth")
+    elapsed = perf_counter() - start
+    sampler.shutdown()
+    collector.shutdown()
+
+    # The transforms run around the simulation, within the same calls.
+    timer.times["transform"] = [
+        total - env_step
+        for total, env_step in zip(timer.times["_env_total"], timer.times["env_step"])
+    ]
+    return {
+        "frames": collected_frames,
+        "updates": num_updates,
+        "elapsed_s": elapsed,
+        "frames_per_s": collected_frames / elapsed,
+        "updates_per_s": num_updates / elapsed,
+        "stages": timer.summary(),
+        "config": OmegaConf.to_container(cfg, resolve=True),
+    }
+
+
+def get_metadata(device: str) -> dict:
+    """Describes the software and hardware a benchmark ran on."""
+    try:
+        crew_version = version("crew-algorithms")
+    except PackageNotFoundError:
+        crew_version = None
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "crew_algorithms": crew_version,
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "torchrl": torchrl.__version__,
+        "platform": platform.platform(),
+        "device": device,
+        "device_name": (
+            torch.cuda.get_device_name(device)
+            if torch.device(device).type == "cuda"
+            else platform.processor()
+        ),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--algorithms", type=str, nargs="+", choices=ALGORITHMS, default=ALGORITHMS
+    )
+    parser.add_argument("--env", type=str, default="find_treasure")
+    parser.add_argument("--frames", type=int, default=1000)
+    parser.add_argument("--frames-per-batch", type=int, default=100)
+    parser.add_argument(
+        "--episode-length",
+        type=int,
+        default=100,
+        help="Number of steps in an episode of the mock backend.",
+    )
+    parser.add_argument(
+        "--step-time",
+        type=float,
+        default=0.0,
+        help="Seconds every mock step sleeps for, to emulate the simulation.",
+    )
+    parser.add_argument("--checkpoint-interval", type=int, default=1)
+    parser.add_argument(
+        "--device", type=str, default="cuda" if torch.cuda.is_available() else "cpu"
+    )
+    parser.add_argument(
+        "--output", type=str, default=None, help="Path of the JSON results."
+    )
+    parser.add_argument(
+        "overrides",
+        nargs="*",
+        help="Hydra overrides applied to every trainer, e.g. batch_size=64.",
+    )
+    args = parser.parse_args()
+    output = os.path.abspath(args.output) if args.output else None
+
+    results = {"metadata": get_metadata(args.device), "results": {}}
+    for algorithm in args.algorithms:
+        cfg = load_config(
+            algorithm,
+            [
+                f"envs={args.env}",
+                "envs.mock=true",
+                f"envs.mock_episode_length={args.episode_length}",
+                f"envs.mock_step_time={args.step_time}",
+                f"collector.frames_per_batch={args.frames_per_batch}",
+                f"collector.total_frames={args.frames}",
+                "collector.init_random_frames=0",
+                *args.overrides,
+            ],
+        )
+        if "target_img" in cfg.envs:
+            # The heuristic feedback loads it relative to the working directory.
+            cfg.envs.target_img = os.path.abspath(cfg.envs.target_img)
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # The trainers write to ../Data relative to the working directory.
+            run_dir = os.path.join(tmp_dir, "run")
+            os.makedirs(run_dir)
+            os.chdir(run_dir)
+            try:
+                result = run_trainer(
+                    algorithm, cfg, args.device, args.checkpoint_interval
+                )
+            finally:
+                os.chdir(cwd)
+        results["results"][algorithm] = result
+
+        print(
+            f"{algorithm}: {result['frames_per_s']:.1f} frames/s, "
+            f"{result['updates_per_s']:.1f} updates/s"
+        )
+        for stage, stats in result["stages"].items():
+            print(
+                f"  {stage:<20} {stats['mean_ms']:9.3f} ms mean "
+                f"{stats['p95_ms']:9.3f} ms p95 {stats['total_s']:8.2f} s total"
+            )
+
+    if output is not None:
+        with open(output, "w") as f:
+            json.dump(results, f, indent=2, default=str)
+
+
+if __name__ == "__main__":
+    main()
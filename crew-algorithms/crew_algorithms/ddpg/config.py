@@ -10,6 +10,7 @@ class OptimizationConfig:
     target_update_polyak: float = 0.995
     max_grad_norm: float = 1.0
     exploration_noise: float = 0.1
+    compile_mode: str = "none"
 
 
 @define(auto_attribs=True)
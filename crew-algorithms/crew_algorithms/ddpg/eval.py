@@ -102,7 +102,13 @@ def eval(cfg: Config):
                 model.load_state_dict(weights)
 
             collector = make_collector(
-                cfg.collector, env_fn, model[0], device, cfg.num_envs
+                cfg.collector,
+                env_fn,
+                model[0],
+                device,
+                cfg.num_envs,
+                pipelined=cfg.envs.reuse_env and cfg.num_envs > 1,
+                in_process=cfg.envs.reuse_env,
             )
             collector.set_seed(cfg.seed)
             for data in collector:
@@ -2,6 +2,7 @@ import torch
 import torch.multiprocessing as mp
 import torch.nn as nn
 from crew_algorithms.auto_encoder.model import Encoder
+from crew_algorithms.utils.embedding_cache import encode
 
 
 class ContinuousActorNet(nn.Module):
@@ -55,7 +56,7 @@ class ContinuousActorNet(nn.Module):
                 obs.shape[0], -1, self.num_channels, obs.shape[-2], obs.shape[-1]
             ).view(-1, self.num_channels, obs.shape[-2], obs.shape[-1])
 
-        obs = self.encoder(obs).flatten(1).view(bs, -1)
+        obs = encode(self.encoder, obs).flatten(1).view(bs, -1)
 
         if "step_count" in kwargs:
             step_count = kwargs["step_count"]
@@ -113,7 +114,7 @@ class ContinuousQValueNet(nn.Module):
                 obs.shape[0], -1, self.num_channels, obs.shape[-2], obs.shape[-1]
             ).view(-1, self.num_channels, obs.shape[-2], obs.shape[-1])
 
-        obs = self.encoder(obs).flatten(1).view(bs, -1)
+        obs = encode(self.encoder, obs).flatten(1).view(bs, -1)
         while len(action.shape) > 2:
             action = action.squeeze(1)
         obs_action = torch.cat([obs, action], dim=-1).to(obs.device)
@@ -161,18 +162,18 @@ class FeedbackNet(nn.Module):
                 m.bias.data.fill_(0.01)
 
     def forward(self, obs: torch.Tensor, action: torch.Tensor):
+        bs = obs.shape[0]
         if bs == 1:
             self.mlp.eval()
         else:
             self.mlp.train()
-        bs = obs.shape[0]
         if len(obs.shape) == 5:
             obs = obs.squeeze(1)
         obs = obs.view(
             obs.shape[0], -1, self.num_channels, obs.shape[-2], obs.shape[-1]
         ).view(-1, 3, obs.shape[-2], obs.shape[-1])
 
-        obs = self.encoder(obs).flatten(1).view(bs, -1)
+        obs = encode(self.encoder, obs).flatten(1).view(bs, -1)
         action = action.view(bs, -1)
 
         obs_action = torch.cat([obs, action], dim=-1).to(obs.device)
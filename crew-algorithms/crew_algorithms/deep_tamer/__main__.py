@@ -27,6 +27,8 @@ class Config:
     """Size of the mini batches stored in the Replay Buffer."""
     buffer_storage: int = 15_000
     """Maximium size of the Replay Buffer."""
+    compact_frames: bool = False
+    """Whether to store the image frames once, as uint8, in the Replay Buffer."""
     buffer_update_interval: int = 1
     """Interval by which to update the buffer."""
     learning_rate: float = 1e-4
@@ -192,16 +194,15 @@ def deep_tamer(cfg: Config):
             if single_data_view["feedback"] != 0:
                 current_buffer = []
 
+                # Clear old samples from the sample storage
+                oldest = SortedItem(single_data_view["time"][-1].item() - 10, None)
+                del sample_storage[: sample_storage.bisect_left(oldest)]
+
                 for j in range(len(sample_storage) - 1, -1, -1):
                     sample = sample_storage[j].item.clone(False)
                     sample["feedback_time"] = single_data_view["time"][-1].clone()
                     sample["feedback"] = single_data_view["feedback"].clone()
 
-                    # Clear old samples from the sample storage
-                    if sample["time"][-1].item() < sample["feedback_time"].item() - 10:
-                        sample_storage.pop(j)
-                        continue
-
                     if feedback_applies_to_sample(sample, loss_module):
                         current_buffer.append(sample)
                         replay_buffer.add(sample)
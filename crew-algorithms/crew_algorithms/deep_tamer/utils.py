@@ -12,6 +12,7 @@ from crew_algorithms.deep_tamer.policy import (
 )
 from crew_algorithms.envs.channels import ToggleTimestepChannel
 from crew_algorithms.envs.configs import EnvironmentConfig
+from crew_algorithms.utils.frame_storage import FrameStackStorage
 from crew_algorithms.utils.rl_utils import make_base_env
 from crew_algorithms.utils.transforms import CatUnitySensorsAlongChannelDimTransform
 from sortedcontainers import SortedList
@@ -221,10 +222,20 @@ def make_data_buffer(cfg, exp_name):
         A replay buffer which can be used to store experiences.
     """
     sample_storage = SortedList()
+    scratch_dir = "../Data/Buffer/prb_dptm_%s_" % exp_name
+    if cfg.compact_frames:
+        # Samples are added as feedback arrives, not in trajectory order.
+        storage = FrameStackStorage(
+            cfg.buffer_storage,
+            cfg.envs.num_channels,
+            cfg.envs.num_stacks,
+            link_frames=False,
+            scratch_dir=scratch_dir,
+        )
+    else:
+        storage = LazyMemmapStorage(cfg.buffer_storage, scratch_dir=scratch_dir)
     replay_buffer = TensorDictReplayBuffer(
-        storage=LazyMemmapStorage(
-            cfg.buffer_storage, scratch_dir="../Data/Buffer/prb_dptm_%s_" % exp_name
-        ),
+        storage=storage,
         sampler=RandomSampler(),
         batch_size=cfg.mini_batch_size,
     )
@@ -10,11 +10,25 @@ from mlagents_envs.side_channel.side_channel import (
 class ToggleTimestepChannel(SideChannel):
     def __init__(self, id: uuid) -> None:
         super().__init__(id)
+        self._replicas = []
 
     def on_message_received(self, msg: IncomingMessage) -> None:
         pass
 
+    def replicate(self) -> "ToggleTimestepChannel":
+        """Returns a channel with its own id for another Unity server.
+
+        A side channel is registered with a single server, whose next step
+        consumes its queued messages. Every toggle sent on this channel is
+        also sent on its replicas, so that all the servers are toggled.
+        """
+        replica = ToggleTimestepChannel(uuid.uuid4())
+        self._replicas.append(replica)
+        return replica
+
     def send_toogle_timestep(self) -> None:
         msg = OutgoingMessage()
         msg.write_string("Toggle Timestep")
         super().queue_message_to_send(msg)
+        for replica in self._replicas:
+            replica.send_toogle_timestep()
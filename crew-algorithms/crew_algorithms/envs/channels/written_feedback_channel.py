@@ -26,3 +26,15 @@ class WrittenFeedbackChannel(SideChannel):
         if self.on_written_feedback:
             print("CALLING")
             self.on_written_feedback(written_feedback)
+
+    def replicate(self) -> "WrittenFeedbackChannel":
+        """Returns a channel with its own id for another Unity server.
+
+        The written feedback received on the replica is handled by
+        `on_written_feedback` of this channel.
+        """
+        return WrittenFeedbackChannel(uuid.uuid4(), self._forward)
+
+    def _forward(self, written_feedback: WrittenFeedbackMessage) -> None:
+        if self.on_written_feedback:
+            self.on_written_feedback(written_feedback)
@@ -30,6 +30,14 @@ class EnvironmentConfig:
     shift_reward: float = 0.0
     dense_reward_scale: float = 1.0
     credit_window_right: float = 4.0
+    batched_decode: bool = False  # decode all agents of a behavior at once
+    batched_actions: bool = False  # submit one ActionTuple per behavior
+    buffered: bool = False  # reuse pinned staging TensorDicts, not outputs (CUDA)
+    num_instances: int = 1  # Unity builds stepped together by one UnityVecEnv
+    reuse_env: bool = False  # keep Unity servers alive in a pool between uses
+    mock: bool = False  # run on MockUnityEnvironment instead of a Unity build
+    mock_episode_length: int = 100
+    mock_step_time: float = 0.0  # seconds each mock step sleeps for
 
 
 @define(auto_attribs=True)
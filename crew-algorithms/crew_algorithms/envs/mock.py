@@ -0,0 +1,305 @@
+import time
+from typing import Callable
+
+import numpy as np
+from attrs import define, field
+from crew_algorithms.envs.configs import EnvironmentConfig
+from mlagents_envs.base_env import (
+    ActionSpec,
+    ActionTuple,
+    BaseEnv,
+    BehaviorMapping,
+    BehaviorSpec,
+    DecisionSteps,
+    DimensionProperty,
+    ObservationSpec,
+    ObservationType,
+    TerminalSteps,
+)
+
+__all__ = ["MockBehavior", "MockUnityEnvironment", "make_mock_behaviors"]
+
+
+@define(auto_attribs=True)
+class MockBehavior:
+    """Describes the agents of one behavior of a `MockUnityEnvironment`.
+
+    Attributes:
+        observation_shapes: The shape of every observation of an agent. Three
+            dimensional shapes are treated as (height, width, channels) images.
+        continuous_size: The number of continuous actions.
+        discrete_branches: The number of choices of every discrete action.
+        num_agents: The number of agents with this behavior.
+        crew_vector_layout: Whether the last observation follows the CREW layout
+            of [feedback, time, trajectory id, imitation learning, ...], in which
+            case those entries are filled in instead of being random.
+    """
+
+    observation_shapes: list[tuple[int, ...]]
+    continuous_size: int = 0
+    discrete_branches: tuple[int, ...] = field(default=(), converter=tuple)
+    num_agents: int = 1
+    crew_vector_layout: bool = False
+
+    @property
+    def behavior_spec(self) -> BehaviorSpec:
+        observation_specs = []
+        for i, shape in enumerate(self.observation_shapes):
+            if len(shape) == 3:
+                dimension_property = (
+                    DimensionProperty.TRANSLATIONAL_EQUIVARIANCE,
+                    DimensionProperty.TRANSLATIONAL_EQUIVARIANCE,
+                    DimensionProperty.NONE,
+                )
+            else:
+                dimension_property = (DimensionProperty.NONE,) * len(shape)
+            observation_specs.append(
+                ObservationSpec(
+                    shape=tuple(shape),
+                    dimension_property=dimension_property,
+                    observation_type=ObservationType.DEFAULT,
+                    name=f"obs_{i}",
+                )
+            )
+        return BehaviorSpec(
+            observation_specs=observation_specs,
+            action_spec=ActionSpec(self.continuous_size, self.discrete_branches),
+        )
+
+
+def make_mock_behaviors(env_cfg: EnvironmentConfig) -> dict[str, MockBehavior]:
+    """Builds behaviors matching the Unity build of an environment configuration.
+
+    Args:
+        env_cfg: The environment configuration.
+
+    Returns:
+        The behaviors of the environment, keyed on their behavior name.
+    """
+    num_agents = getattr(env_cfg, "num_agents", 1)
+    if env_cfg.name == "bowling":
+        return {
+            "Bowling": MockBehavior(
+                [(128, 128, 1), (36,)],
+                continuous_size=3,
+                num_agents=num_agents,
+                crew_vector_layout=True,
+            )
+        }
+    if env_cfg.name in ["find_treasure", "hide_and_seek_1v1"]:
+        return {
+            "Player": MockBehavior(
+                [(128, 128, 3), (15,)],
+                continuous_size=2,
+                num_agents=num_agents,
+                crew_vector_layout=True,
+            )
+        }
+    if env_cfg.name == "hide_and_seek":
+        observation_shapes = [(128, 128, 3)] * 3 + [(10,)]
+        return {
+            "Hider": MockBehavior(
+                observation_shapes,
+                continuous_size=2,
+                num_agents=env_cfg.num_hiders,
+                crew_vector_layout=True,
+            ),
+            "Seeker": MockBehavior(
+                observation_shapes,
+                continuous_size=2,
+                num_agents=env_cfg.num_seekers,
+                crew_vector_layout=True,
+            ),
+        }
+    if env_cfg.name == "wildfire":
+        return {
+            "My Behavior": MockBehavior(
+                [(3728,)], continuous_size=3, num_agents=num_agents
+            )
+        }
+    raise ValueError(f"No mock behaviors defined for environment {env_cfg.name}.")
+
+
+class MockUnityEnvironment(BaseEnv):
+    """An in-process stand-in for a Unity build.
+
+    Produces `DecisionSteps` and `TerminalSteps` with the same specs as a real
+    build, so that `UnityWrapper` and everything downstream of it, such as the
+    collectors, replay buffers and training loops, can run and be profiled
+    without Unity. Observations are random unless `obs_fn` is given, rewards
+    are only handed out at the end of an episode unless `reward_fn` is given,
+    and every agent terminates after `episode_length` steps.
+
+    Examples:
+        >>> env = UnityWrapper(
+        ...     MockUnityEnvironment(make_mock_behaviors(env_cfg)),
+        ...     device=device,
+        ... )
+
+    Args:
+        behaviors: The behaviors of the environment, keyed on their name. Agent
+            ids are assigned across behaviors in order, starting at 0.
+        episode_length: The number of steps in an episode.
+        step_time: Seconds each step sleeps for, to emulate the simulation cost.
+        seed: Seed of the random observations and rewards.
+        obs_fn: Optional callable taking the behavior name, the agent ids and the
+            current step, and returning the list of observation arrays.
+        reward_fn: Optional callable taking the behavior name, the agent ids, the
+            current step and whether the episode ended, and returning the
+            rewards.
+    """
+
+    def __init__(
+        self,
+        behaviors: dict[str, MockBehavior],
+        episode_length: int = 100,
+        step_time: float = 0.0,
+        seed: int = 0,
+        obs_fn: Callable[[str, np.ndarray, int], list[np.ndarray]] | None = None,
+        reward_fn: Callable[[str, np.ndarray, int, bool], np.ndarray] | None = None,
+    ):
+        self._behaviors = behaviors
+        self._behavior_specs = BehaviorMapping(
+            {name: behavior.behavior_spec for name, behavior in behaviors.items()}
+        )
+        self._agent_ids = {}
+        offset = 0
+        for name, behavior in behaviors.items():
+            self._agent_ids[name] = np.arange(
+                offset, offset + behavior.num_agents, dtype=np.int32
+            )
+            offset += behavior.num_agents
+
+        self.episode_length = episode_length
+        self.step_time = step_time
+        self._rng = np.random.default_rng(seed)
+        self._obs_fn = obs_fn
+        self._reward_fn = reward_fn
+
+        self._step_count = 0
+        self._episode = 0
+        self._actions = {}
+        self._steps = {}
+        self.reset()
+
+    @property
+    def behavior_specs(self) -> BehaviorMapping:
+        return self._behavior_specs
+
+    def _make_obs(self, behavior_name: str, agent_ids: np.ndarray) -> list:
+        if self._obs_fn is not None:
+            return self._obs_fn(behavior_name, agent_ids, self._step_count)
+        behavior = self._behaviors[behavior_name]
+        obs = [
+            self._rng.random((len(agent_ids), *shape), dtype=np.float32)
+            for shape in behavior.observation_shapes
+        ]
+        if behavior.crew_vector_layout:
+            vector_obs = obs[-1]
+            vector_obs[:, 0] = 0.0
+            vector_obs[:, 1] = self._step_count
+            vector_obs[:, 2] = self._episode
+            vector_obs[:, 3] = 0.0
+        return obs
+
+    def _make_reward(self, behavior_name: str, agent_ids: np.ndarray, done: bool):
+        if self._reward_fn is not None:
+            return np.asarray(
+                self._reward_fn(behavior_name, agent_ids, self._step_count, done),
+                dtype=np.float32,
+            )
+        if not done:
+            return np.zeros(len(agent_ids), dtype=np.float32)
+        return self._rng.integers(0, 2, len(agent_ids)).astype(np.float32)
+
+    def _decision_steps(self, behavior_name: str) -> DecisionSteps:
+        agent_ids = self._agent_ids[behavior_name]
+        return DecisionSteps(
+            obs=self._make_obs(behavior_name, agent_ids),
+            reward=self._make_reward(behavior_name, agent_ids, done=False),
+            agent_id=agent_ids,
+            action_mask=None,
+            group_id=np.zeros(len(agent_ids), dtype=np.int32),
+            group_reward=np.zeros(len(agent_ids), dtype=np.float32),
+        )
+
+    def _terminal_steps(self, behavior_name: str) -> TerminalSteps:
+        agent_ids = self._agent_ids[behavior_name]
+        return TerminalSteps(
+            obs=self._make_obs(behavior_name, agent_ids),
+            reward=self._make_reward(behavior_name, agent_ids, done=True),
+            interrupted=np.zeros(len(agent_ids), dtype=bool),
+            agent_id=agent_ids,
+            group_id=np.zeros(len(agent_ids), dtype=np.int32),
+            group_reward=np.zeros(len(agent_ids), dtype=np.float32),
+        )
+
+    def _empty_terminal_steps(self, behavior_name: str) -> TerminalSteps:
+        # TerminalSteps.empty relies on np.bool, which recent numpy removed.
+        spec = self._behavior_specs[behavior_name]
+        return TerminalSteps(
+            obs=[
+                np.zeros((0, *obs_spec.shape), dtype=np.float32)
+                for obs_spec in spec.observation_specs
+            ],
+            reward=np.zeros(0, dtype=np.float32),
+            interrupted=np.zeros(0, dtype=bool),
+            agent_id=np.zeros(0, dtype=np.int32),
+            group_id=np.zeros(0, dtype=np.int32),
+            group_reward=np.zeros(0, dtype=np.float32),
+        )
+
+    def _start_episode(self) -> dict:
+        self._step_count = 0
+        return {name: self._decision_steps(name) for name in self._behaviors}
+
+    def step(self) -> None:
+        if self.step_time > 0:
+            time.sleep(self.step_time)
+        # The actions are validated when set but do not influence the mock.
+        self._actions.clear()
+        self._step_count += 1
+        if self._step_count < self.episode_length:
+            self._steps = {
+                name: (self._decision_steps(name), self._empty_terminal_steps(name))
+                for name in self._behaviors
+            }
+            return
+        # As in Unity, agents that are done report their last observation in
+        # the terminal steps and start the next episode in the decision steps.
+        terminal_steps = {name: self._terminal_steps(name) for name in self._behaviors}
+        self._episode += 1
+        decision_steps = self._start_episode()
+        self._steps = {
+            name: (decision_steps[name], terminal_steps[name])
+            for name in self._behaviors
+        }
+
+    def reset(self) -> None:
+        self._actions.clear()
+        decision_steps = self._start_episode()
+        self._steps = {
+            name: (decision_steps[name], self._empty_terminal_steps(name))
+            for name in self._behaviors
+        }
+
+    def close(self) -> None:
+        self._steps = {}
+
+    def set_actions(self, behavior_name: str, action: ActionTuple) -> None:
+        action_spec = self._behavior_specs[behavior_name].action_spec
+        num_agents = len(self._agent_ids[behavior_name])
+        self._actions[behavior_name] = action_spec._validate_action(
+            action, num_agents, behavior_name
+        )
+
+    def set_action_for_agent(
+        self, behavior_name: str, agent_id: int, action: ActionTuple
+    ) -> None:
+        action_spec = self._behavior_specs[behavior_name].action_spec
+        self._actions[behavior_name, agent_id] = action_spec._validate_action(
+            action, 1, behavior_name
+        )
+
+    def get_steps(self, behavior_name: str) -> tuple[DecisionSteps, TerminalSteps]:
+        return self._steps[behavior_name]
@@ -0,0 +1,82 @@
+import atexit
+import threading
+from collections import defaultdict
+from typing import TYPE_CHECKING, Callable, Hashable
+
+if TYPE_CHECKING:
+    from mlagents_envs.base_env import BaseEnv
+
+__all__ = ["UnityEnvPool", "unity_env_pool"]
+
+
+class UnityEnvPool:
+    """Keeps Unity servers alive so that later environments can reuse them.
+
+    Launching a Unity build takes several seconds, which adds up when many
+    short-lived environments are created, e.g. one per checkpoint when
+    evaluating a sweep of saved policies. Environments released to the pool
+    stay running and are handed out again, after a reset, to the next request
+    with the same key. The key should identify everything fixed at launch: the
+    build path and the command line arguments.
+
+    Side channels are registered when a server is first launched and stay
+    attached to it, so reused servers keep the channels of that first launch.
+
+    Examples:
+        >>> env = pool.acquire(key, lambda: UnityEnvironment(file_name, ...))
+        >>> ...
+        >>> pool.release(key, env)
+    """
+
+    def __init__(self):
+        self._idle = defaultdict(list)
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def acquire(self, key: Hashable, build_fn: Callable[[], "BaseEnv"]) -> "BaseEnv":
+        """Returns an idle environment for `key`, launching one if there is none.
+
+        Args:
+            key: Identifies the launch configuration of the environment.
+            build_fn: Launches a new environment when none is idle.
+
+        Returns:
+            The environment, reset to the start of an episode.
+        """
+        with self._lock:
+            idle = self._idle[key]
+            env = idle.pop() if idle else None
+        if env is None:
+            return build_fn()
+        env.reset()
+        return env
+
+    def release(self, key: Hashable, env: "BaseEnv") -> None:
+        """Returns an environment to the pool instead of closing it.
+
+        Args:
+            key: The key the environment was acquired with.
+            env: The environment to keep alive.
+        """
+        with self._lock:
+            if not self._closed:
+                self._idle[key].append(env)
+                return
+        env.close()
+
+    def close_all(self) -> None:
+        """Closes every idle environment held by the pool."""
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, defaultdict(list)
+        for envs in idle.values():
+            for env in envs:
+                env.close()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(len(envs) for envs in self._idle.values())
+
+
+unity_env_pool = UnityEnvPool()
+atexit.register(unity_env_pool.close_all)
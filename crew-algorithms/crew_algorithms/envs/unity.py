@@ -1,9 +1,12 @@
 # import os
+from concurrent.futures import ThreadPoolExecutor
 from typing import Tuple
 from warnings import warn
 
 import numpy as np
 import torch
+from crew_algorithms.envs.pool import unity_env_pool
+from crew_algorithms.utils.port_registry import port_registry
 from tensordict.tensordict import TensorDict, TensorDictBase
 from torchrl.data.tensor_specs import (
     BoundedTensorSpec,
@@ -65,6 +68,35 @@ def _unity_to_torchrl_spec_transform(spec, dtype=None, device="cpu"):
         raise TypeError(f"Unknown spec of type {type(spec)} passed")
 
 
+class _LeafEncoder:
+    """Encodes values for a single leaf spec without going through the spec tree.
+
+    The dtype, shape and device of the spec are read once so that values that
+    already match only need a `torch.as_tensor` conversion. Anything else falls
+    back to the full `encode` of the spec.
+
+    Args:
+        spec: The leaf spec to encode values for.
+    """
+
+    __slots__ = ("spec", "dtype", "shape", "numel", "device")
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.dtype = spec.dtype
+        self.shape = spec.shape
+        self.numel = spec.shape.numel()
+        self.device = spec.device
+
+    def encode(self, value):
+        tensor = torch.as_tensor(value, device=self.device)
+        if tensor.dtype != self.dtype or tensor.numel() != self.numel:
+            return self.spec.encode(value)
+        if tensor.shape != self.shape:
+            tensor = tensor.reshape(self.shape)
+        return tensor
+
+
 class UnityWrapper(_EnvWrapper):
     """Unity environment wrapper.
 
@@ -78,14 +110,36 @@ class UnityWrapper(_EnvWrapper):
         ...         device=device,
         ...     )
         ... )
+
+    Args:
+        env: The Unity environment to wrap.
+        batched_decode: Whether to decode all agents of a behavior at once.
+        batched_actions: Whether to submit one ActionTuple per behavior.
+        buffered: Whether to decode the outputs into pinned staging buffers,
+            allocated once and reused, that are copied to the CUDA device
+            asynchronously. Only the staging buffers are reused: every output
+            is a new TensorDict on the device. Ignored, with a warning, on CPU.
     """
 
     git_url = "https://github.com/Unity-Technologies/ml-agents"
     libname = "mlagents_envs"
 
-    def __init__(self, env=None, **kwargs):
+    def __init__(
+        self,
+        env=None,
+        batched_decode: bool = False,
+        batched_actions: bool = False,
+        buffered: bool = False,
+        **kwargs,
+    ):
         if env is not None:
             kwargs["env"] = env
+        # Set before super().__init__ since _make_specs runs during construction.
+        self._batched_decode = batched_decode
+        self._batched_actions = batched_actions
+        self._buffered = buffered
+        self._pending_step = None
+        self._step_executor = None
         super().__init__(**kwargs)
 
     def _init_env(self):
@@ -205,6 +259,95 @@ class UnityWrapper(_EnvWrapper):
 
         self.state_spec = self.observation_spec.clone()
 
+        # Per-agent specs and encoders are kept so that the read_* helpers do
+        # not index the nested composite specs on every call.
+        self._agent_observation_specs = observation_specs
+        self._agent_reward_specs = reward_specs
+        self._agent_done_specs = done_specs
+        self._observation_encoders = [
+            [(key, _LeafEncoder(leaf)) for key, leaf in spec.items()]
+            for spec in observation_specs
+        ]
+        self._reward_encoders = [_LeafEncoder(spec) for spec in reward_specs]
+        self._done_encoders = [_LeafEncoder(spec) for spec in done_specs]
+        self._valid_mask_encoders = [_LeafEncoder(spec) for spec in valid_mask_specs]
+
+        # The batched decode path writes whole behaviors at once, which requires
+        # every agent to share the same observation spec.
+        self._homogeneous_agents = all(
+            spec == observation_specs[0] for spec in observation_specs
+        )
+        if (self._batched_decode or self._buffered) and not self._homogeneous_agents:
+            mode = "The buffered mode" if self._buffered else "Batched decoding"
+            warn(
+                f"{mode} requires all agents to share the same observation spec. "
+                "Falling back to per-agent decoding."
+            )
+            self._batched_decode = False
+            self._buffered = False
+        if self._buffered and self.device.type != "cuda":
+            # Without an asynchronous copy to the device, every output would be
+            # a copy of the staging buffer: decoding into a new TensorDict is
+            # less work.
+            warn(
+                "The buffered mode requires a CUDA device. Falling back to "
+                "unbuffered decoding."
+            )
+            self._buffered = False
+
+        if self._buffered:
+            self._make_output_buffers()
+
+    def _make_output_buffers(self, num_buffers: int = 2):
+        """Allocates the reusable staging TensorDicts of the buffered mode.
+
+        The specs never change after `_make_specs`, so the step and reset
+        outputs are decoded into pinned TensorDicts allocated once and filled
+        in place, then copied to the CUDA device asynchronously. Consecutive
+        steps alternate between `num_buffers` of them so that decoding the next
+        step does not wait for the previous copy. On CPU the buffered mode
+        is disabled.
+
+        Args:
+            num_buffers: Number of buffers to alternate between.
+        """
+        self._output_buffers = {}
+        self._copy_events = {}
+        self._output_buffer_index = {}
+        for is_reset in (False, True):
+            self._output_buffers[is_reset] = [
+                self._make_empty_tensordict(is_reset=is_reset).cpu().pin_memory()
+                for _ in range(num_buffers)
+            ]
+            self._copy_events[is_reset] = [None] * num_buffers
+            self._output_buffer_index[is_reset] = 0
+
+    def _get_buffered_tensordict(self, is_reset=False):
+        """Decodes the Unity steps into the next staging buffer.
+
+        The staging buffer is reused, so the output is always a copy of it on
+        the device: collectors keep every output of a batch alive until they
+        stack them.
+        """
+        index = self._output_buffer_index[is_reset]
+        buffers = self._output_buffers[is_reset]
+        self._output_buffer_index[is_reset] = (index + 1) % len(buffers)
+        staging = buffers[index]
+
+        event = self._copy_events[is_reset][index]
+        if event is not None:
+            # The previous copy out of this buffer must finish before it is
+            # overwritten.
+            event.synchronize()
+        staging.zero_()
+        self._fill_next_tensordict(staging, is_reset=is_reset)
+
+        tensordict_out = staging.to(self.device, non_blocking=True)
+        event = torch.cuda.Event()
+        event.record()
+        self._copy_events[is_reset][index] = event
+        return tensordict_out
+
     def __repr__(self) -> str:
         return (
             f"{self.__class__.__name__}(env={self._env}, batch_size={self.batch_size})"
@@ -226,15 +369,22 @@ class UnityWrapper(_EnvWrapper):
         return self._agent_id_to_behavior_name[agent_id]
 
     def read_obs(self, agent_id, obs):
-        return self.observation_spec["agents", "observation"][agent_id].encode(
-            {f"obs_{i}": observation for i, observation in enumerate(obs)},
+        return TensorDict(
+            source={
+                key: encoder.encode(observation)
+                for (key, encoder), observation in zip(
+                    self._observation_encoders[agent_id], obs
+                )
+            },
+            batch_size=[],
+            device=self.device,
         )
 
     def read_reward(self, agent_id, reward):
-        return self.reward_spec[agent_id].encode(reward)
+        return self._reward_encoders[agent_id].encode(reward)
 
     def read_valid_mask(self, agent_id, valid):
-        return self.valid_mask_spec["agents", "valid_mask"][agent_id].encode(valid)
+        return self._valid_mask_encoders[agent_id].encode(valid)
 
     def read_action(self, action):
         action = self.action_spec.to_numpy(action, safe=False)
@@ -248,20 +398,121 @@ class UnityWrapper(_EnvWrapper):
         else:
             action = np.reshape(action, (1, np.prod(action.shape)))
 
+        return self._make_action_tuple(action)
+
+    def _make_action_tuple(self, action):
+        """Wraps 2D (num_agents, action_size) arrays into an `ActionTuple`."""
         if isinstance(self.action_spec, CompositeSpec):
-            action = ActionTuple(action["continuous"], action["discrete"])
+            return ActionTuple(action["continuous"], action["discrete"])
         elif isinstance(self.action_spec, DiscreteTensorSpec | MultiDiscreteTensorSpec):
-            action = ActionTuple(None, action)
+            return ActionTuple(None, action)
         else:
-            action = ActionTuple(action, None)
-        return action
+            return ActionTuple(action, None)
+
+    def _set_actions_batched(self, actions):
+        """Submits one `ActionTuple` per behavior with `set_actions`.
+
+        Unity expects an action for every agent of a behavior that requested a
+        decision, in the order of `DecisionSteps.agent_id`, so the actions are
+        gathered with a single index per behavior rather than per agent.
+
+        Args:
+            actions: The actions of all agents, with the agent dimension first.
+        """
+        actions = self.action_spec.to_numpy(actions, safe=False)
+        for behavior_name in self._behavior_names:
+            decision_steps, _ = self.get_steps(behavior_name)
+            if not len(decision_steps):
+                continue
+            agent_ids = decision_steps.agent_id
+            if isinstance(actions, dict):
+                action = {
+                    k: np.reshape(v[agent_ids], (len(agent_ids), -1))
+                    for k, v in actions.items()
+                }
+            else:
+                action = np.reshape(actions[agent_ids], (len(agent_ids), -1))
+            self.set_actions(behavior_name, self._make_action_tuple(action))
 
     def read_done(self, agent_id, done):
-        # print(self.done_spec, agent_id, done)
-        return self.done_spec["agents", "done"][agent_id].encode(done)
+        return self._done_encoders[agent_id].encode(done)
+
+    def _make_empty_tensordict(self, is_reset=False):
+        """Creates an agents-batched output TensorDict filled with zeros.
+
+        Agents that are not written to keep a zero observation, a False done
+        flag and a False valid mask, matching the missing agent handling of
+        the per-agent path.
+        """
+        agents_td = TensorDict(
+            source={
+                "observation": self.observation_spec["agents", "observation"].zero(),
+                "done": self.done_spec["agents", "done"].zero(),
+                "valid_mask": self.valid_mask_spec["agents", "valid_mask"].zero(),
+            },
+            batch_size=[self.num_agents],
+            device=self.device,
+        )
+        if not is_reset:
+            agents_td.set("reward", self.reward_spec.zero())
+        return TensorDict(source={"agents": agents_td}, batch_size=[])
+
+    def _fill_next_tensordict(self, tensordict_out, is_reset=False):
+        """Scatters the steps of every behavior into an agents-batched TensorDict.
+
+        Instead of decoding each agent separately, the observations, rewards
+        and done flags of a behavior are read as whole NumPy arrays and
+        written with a single indexed assignment per key.
+
+        Args:
+            tensordict_out: A TensorDict created by `_make_empty_tensordict`.
+            is_reset: Whether the TensorDict is the output of a reset, in
+                which case no reward is written.
+
+        Returns:
+            The filled TensorDict.
+        """
+        agents_td = tensordict_out.get("agents")
+        observation = agents_td.get("observation")
+        done = agents_td.get("done")
+        valid_mask = agents_td.get("valid_mask")
+        reward = None if is_reset else agents_td.get("reward")
+
+        for behavior_name_ in self.behavior_specs.keys():
+            decision_steps, terminal_steps = self.get_steps(behavior_name_)
+            # Terminal steps are written last so that an agent present in both
+            # is reported as done, like in the per-agent path.
+            for is_done, steps in ((False, decision_steps), (True, terminal_steps)):
+                if not len(steps):
+                    continue
+                agent_ids = torch.as_tensor(steps.agent_id, dtype=torch.long)
+                for i, obs in enumerate(steps.obs):
+                    value = observation.get(f"obs_{i}")
+                    value[agent_ids] = (
+                        torch.as_tensor(obs)
+                        .reshape(len(agent_ids), *value.shape[1:])
+                        .to(device=value.device, dtype=value.dtype)
+                    )
+                if reward is not None:
+                    reward[agent_ids] = (
+                        torch.as_tensor(steps.reward)
+                        .reshape(len(agent_ids), *reward.shape[1:])
+                        .to(device=reward.device, dtype=reward.dtype)
+                    )
+                done[agent_ids] = is_done
+                valid_mask[agent_ids] = True
+
+        return tensordict_out
 
     def _get_next_tensordict(self, shape, is_reset=False):
         # print("Collector process: ", os.getpid())
+        if self._buffered:
+            return self._get_buffered_tensordict(is_reset=is_reset)
+        if self._batched_decode:
+            return self._fill_next_tensordict(
+                self._make_empty_tensordict(is_reset=is_reset), is_reset=is_reset
+            )
+
         agent_tds = [None] * self.num_agents
         seen_agent_ids = set()
 
@@ -300,11 +551,9 @@ class UnityWrapper(_EnvWrapper):
             print(self.done_spec, missing_agent)
             agent_td = TensorDict(
                 source={
-                    "observation": self.observation_spec["agents", "observation"][
-                        missing_agent
-                    ].zero(),
-                    "reward": self.reward_spec[missing_agent].zero(),
-                    "done": self.done_spec["agents", "done"][missing_agent].zero(),
+                    "observation": self._agent_observation_specs[missing_agent].zero(),
+                    "reward": self._agent_reward_specs[missing_agent].zero(),
+                    "done": self._agent_done_specs[missing_agent].zero(),
                     "valid_mask": self.read_valid_mask(agent_id, False),
                 },
                 batch_size=[],
@@ -319,9 +568,15 @@ class UnityWrapper(_EnvWrapper):
         # print(tensordict_out["agents", "done"])
         return tensordict_out
 
-    def _step(self, tensordict: TensorDictBase) -> TensorDictBase:
-        # print(tensordict)
-        # print('step')
+    def _set_actions(self, tensordict: TensorDictBase) -> None:
+        if self._batched_actions:
+            try:
+                actions = tensordict["agents", "action"]
+            except KeyError:
+                actions = tensordict["action"]
+            self._set_actions_batched(actions)
+            return
+
         # FIXME: Figure out why tensordict["agents",
         # "valid_mask"] and tensordict["agents", "done"]
         # have different shapes which require us to squeeze.
@@ -343,7 +598,58 @@ class UnityWrapper(_EnvWrapper):
                 agent_id.item(),
                 unity_action,
             )
-        self._env.step()
+
+    def step_async(self, tensordict: TensorDictBase) -> None:
+        """Submits the actions in `tensordict` and starts simulating in the background.
+
+        The call returns as soon as the actions are queued so the caller can do
+        other work, such as running the policy for another environment, while
+        Unity simulates. The step is completed by `step_wait` or by calling
+        `step` with the same tensordict.
+
+        Args:
+            tensordict: The tensordict holding the actions to take.
+        """
+        if self._pending_step is not None:
+            raise RuntimeError(
+                "step_async was called while a previous step is still pending. "
+                "Call step_wait first."
+            )
+        if self._step_executor is None:
+            self._step_executor = ThreadPoolExecutor(max_workers=1)
+        self._set_actions(tensordict)
+        self._pending_step = (
+            self._step_executor.submit(self._env.step),
+            tensordict,
+        )
+
+    def step_wait(self) -> TensorDictBase:
+        """Waits for the step started by `step_async` and returns its result.
+
+        Returns:
+            The tensordict passed to `step_async`, updated with the "next" entry,
+            as returned by `step`.
+        """
+        if self._pending_step is None:
+            raise RuntimeError("step_wait was called without a pending step_async.")
+        _, tensordict = self._pending_step
+        return self.step(tensordict)
+
+    def _wait_pending_step(self) -> bool:
+        if self._pending_step is None:
+            return False
+        future, _ = self._pending_step
+        self._pending_step = None
+        future.result()
+        return True
+
+    def _step(self, tensordict: TensorDictBase) -> TensorDictBase:
+        # print(tensordict)
+        # print('step')
+        # A step started by step_async already holds its actions.
+        if not self._wait_pending_step():
+            self._set_actions(tensordict)
+            self._env.step()
         tensordict_out = self._get_next_tensordict(shape=tensordict.shape)
 
         # out = tensordict_out.set("next", tensordict_outself._get_next_tensordict())
@@ -351,14 +657,32 @@ class UnityWrapper(_EnvWrapper):
         return tensordict_out  # .select().set("next", tensordict_out)
 
     def _reset(self, tensordict: TensorDictBase | None = None, **kwargs):
+        self._wait_pending_step()
         self._env.reset(**kwargs)
         tensordict_out = self._get_next_tensordict(shape=[], is_reset=True)
         return tensordict_out
 
+    def _shutdown_step_executor(self) -> None:
+        self._wait_pending_step()
+        if self._step_executor is not None:
+            self._step_executor.shutdown()
+            self._step_executor = None
+
+    def close(self) -> None:
+        self._shutdown_step_executor()
+        super().close()
+
 
 class UnityEnv(UnityWrapper):
     """Unity environment wrapper.
 
+    Unless `base_port` is given, the port of a launched build is reserved in
+    `port_registry` and released on `close`.
+
+    With `reuse_env=True` the Unity server is taken from `unity_env_pool` when
+    one with the same build and arguments is idle, and is handed back to the
+    pool on `close` instead of being shut down.
+
     Examples:
         >>> env = UnityEnv(
         ...     "<<PATH TO UNITY APP>>",
@@ -377,8 +701,12 @@ class UnityEnv(UnityWrapper):
         timeout_wait: int = 500,
         side_channels: list[SideChannel] | None = None,
         log_folder: str | None = None,
+        reuse_env: bool = False,
         **kwargs,
     ):
+        self._pool_key = None
+        self._reserved_port = None
+        kwargs["reuse_env"] = reuse_env
         kwargs["file_name"] = file_name
         kwargs["seed"] = seed
         kwargs["no_graphics"] = no_graphics
@@ -399,6 +727,7 @@ class UnityEnv(UnityWrapper):
         timeout_wait: int = 500,
         side_channels: list[SideChannel] | None = None,
         log_folder: str | None = None,
+        reuse_env: bool = False,
         **env_kwargs,
     ):
         if not _has_mlagents:
@@ -408,17 +737,57 @@ class UnityEnv(UnityWrapper):
                 f" {self.git_url}"
             )
         self.file_name = file_name
+
+        def build_unity_env():
+            launch_kwargs = dict(env_kwargs)
+            if file_name is not None and launch_kwargs.get("base_port") is None:
+                # Reserve the port on the host so that concurrent launches never
+                # race for it.
+                self._reserved_port = port_registry.reserve()
+                launch_kwargs["base_port"] = self._reserved_port
+            try:
+                return UnityEnvironment(
+                    file_name,
+                    seed=seed,
+                    no_graphics=no_graphics,
+                    timeout_wait=timeout_wait,
+                    side_channels=side_channels,
+                    log_folder=log_folder,
+                    **launch_kwargs,
+                )
+            except Exception:
+                self._release_port()
+                raise
+
+        if not reuse_env:
+            return super()._build_env(build_unity_env())
+        # The port is picked per launch, so it is left out of the key.
+        self._pool_key = (
+            file_name,
+            no_graphics,
+            tuple(env_kwargs.get("additional_args") or ()),
+        )
         return super()._build_env(
-            UnityEnvironment(
-                file_name,
-                seed=seed,
-                no_graphics=no_graphics,
-                timeout_wait=timeout_wait,
-                side_channels=side_channels,
-                log_folder=log_folder,
-                **env_kwargs,
-            )
+            unity_env_pool.acquire(self._pool_key, build_unity_env)
         )
 
+    def _release_port(self) -> None:
+        if self._reserved_port is not None:
+            port_registry.release(self._reserved_port)
+            self._reserved_port = None
+
+    def close(self) -> None:
+        if self._pool_key is None:
+            super().close()
+            self._release_port()
+            return
+        if self.is_closed:
+            return
+        self._shutdown_step_executor()
+        self.is_closed = True
+        # Pooled servers keep their port, the reservation lapses when this
+        # process exits.
+        unity_env_pool.release(self._pool_key, self._env)
+
     def __repr__(self):
         return f"{super().__repr__()}(file_name={self.file_name})"
@@ -0,0 +1,146 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Sequence
+from warnings import warn
+
+import torch
+from crew_algorithms.envs.unity import UnityWrapper
+from tensordict.tensordict import TensorDictBase
+from torchrl.envs.common import EnvBase
+
+__all__ = ["UnityVecEnv"]
+
+
+class UnityVecEnv(EnvBase):
+    """Drives several Unity environments from a single process.
+
+    Every instance is a `UnityWrapper` with its own Unity build and socket. The
+    instances are launched and stepped concurrently on worker threads, as the
+    blocking gRPC exchanges release the GIL, and their outputs are stacked into
+    a single `[num_envs, num_agents]`-batched TensorDict. The policy can then
+    run once per step on the whole batch instead of once per worker process.
+
+    Examples:
+        >>> env = UnityVecEnv(
+        ...     [lambda: UnityEnv("<<PATH TO UNITY APP>>", device=device)] * 4,
+        ...     device=device,
+        ... )
+
+    Args:
+        create_env_fns: One callable per instance, each returning a
+            `UnityWrapper`. All instances must expose the same specs.
+        device: The device to perform environment operations on.
+    """
+
+    def __init__(
+        self,
+        create_env_fns: Sequence[Callable[[], UnityWrapper]],
+        device: str = "cpu",
+    ):
+        num_envs = len(create_env_fns)
+        if num_envs == 0:
+            raise ValueError("UnityVecEnv needs at least one environment.")
+        super().__init__(device=device, batch_size=[num_envs])
+        self.num_envs = num_envs
+        self._pool = ThreadPoolExecutor(max_workers=num_envs)
+        self._envs = list(self._pool.map(lambda fn: fn(), create_env_fns))
+        self.is_closed = False
+        self._pending_tensordict = None
+        self._make_specs(self._envs[0])
+
+    def _make_specs(self, env: UnityWrapper) -> None:
+        self.num_agents = env.num_agents
+        self.observation_spec = env.output_spec["full_observation_spec"].expand(
+            self.num_envs
+        )
+        self.action_spec = env.input_spec["full_action_spec"].expand(self.num_envs)
+        self.reward_spec = env.output_spec["full_reward_spec"].expand(self.num_envs)
+        self.done_spec = env.output_spec["full_done_spec"].expand(self.num_envs)
+        self.state_spec = env.input_spec["full_state_spec"].expand(self.num_envs)
+
+    @property
+    def envs(self) -> list[UnityWrapper]:
+        return self._envs
+
+    def _set_seed(self, seed: int | None):
+        warn(
+            "Seeding through _set_seed has not been implemented. Please set the "
+            "seed when you create the environments."
+        )
+
+    def _stack(self, tensordicts: list[TensorDictBase]) -> TensorDictBase:
+        return torch.stack(tensordicts, dim=0).contiguous()
+
+    def step_async(self, tensordict: TensorDictBase) -> None:
+        """Submits the actions of every instance and starts simulating them.
+
+        See `UnityWrapper.step_async`. The step is completed by `step_wait` or
+        by calling `step` with the same tensordict.
+
+        Args:
+            tensordict: The `[num_envs, ...]` tensordict holding the actions.
+        """
+        for env, env_tensordict in zip(self._envs, tensordict.unbind(0)):
+            env.step_async(env_tensordict)
+        self._pending_tensordict = tensordict
+
+    def step_wait(self) -> TensorDictBase:
+        """Waits for the step started by `step_async` and returns its result."""
+        if self._pending_tensordict is None:
+            raise RuntimeError("step_wait was called without a pending step_async.")
+        return self.step(self._pending_tensordict)
+
+    def _step(self, tensordict: TensorDictBase) -> TensorDictBase:
+        # Every instance steps on its own worker thread; a step started by
+        # step_async already holds its actions.
+        if self._pending_tensordict is None:
+            self.step_async(tensordict)
+        self._pending_tensordict = None
+        return self._stack(
+            [env._step(env_td) for env, env_td in zip(self._envs, tensordict.unbind(0))]
+        )
+
+    def _reset_mask(self, tensordict: TensorDictBase | None) -> list[bool]:
+        """Finds the instances flagged for reset by the "_reset" entries."""
+        if tensordict is None:
+            return [True] * self.num_envs
+        masks = []
+        for done_key in self.done_keys:
+            if isinstance(done_key, tuple):
+                reset_key = (*done_key[:-1], "_reset")
+            else:
+                reset_key = "_reset"
+            reset = tensordict.get(reset_key, None)
+            if reset is not None:
+                masks.append(reset.reshape(self.num_envs, -1).any(-1))
+        if not masks:
+            return [True] * self.num_envs
+        return torch.stack(masks, dim=0).any(0).tolist()
+
+    def _reset(self, tensordict: TensorDictBase | None = None, **kwargs):
+        reset_mask = self._reset_mask(tensordict)
+        self._pending_tensordict = None
+
+        def reset_env(env, reset):
+            env._wait_pending_step()
+            if reset:
+                env._env.reset(**kwargs)
+
+        list(self._pool.map(reset_env, self._envs, reset_mask))
+        # Instances that were not reset report their latest state again, which
+        # Unity keeps until the next step.
+        return self._stack(
+            [env._get_next_tensordict(shape=[], is_reset=True) for env in self._envs]
+        )
+
+    def close(self):
+        if self.is_closed:
+            return
+        self.is_closed = True
+        list(self._pool.map(lambda env: env.close(), self._envs))
+        self._pool.shutdown()
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}(num_envs={self.num_envs}, "
+            f"batch_size={self.batch_size})"
+        )
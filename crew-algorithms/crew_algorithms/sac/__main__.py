@@ -31,8 +31,18 @@ class Config:
     """Batch size to use for training."""
     buffer_size: int = 15_000
     """Size of the replay buffer."""
+    compact_frames: bool = False
+    """Whether to store the image frames once, as uint8, in the replay buffer."""
+    prefetch_batches: int = 0
+    """Number of replay batches sampled ahead of the updates."""
     num_envs: int = 1
     """Number of parallel environments to use."""
+    pipelined_collector: bool = False
+    """Whether to overlap the policy with the simulation of the other envs."""
+    async_learner: bool = False
+    """Whether to run the updates in a background thread, decoupled from collection"""
+    weight_sync_interval: int = 100
+    """Number of background updates between policy weight broadcasts"""
     seed: int = 42
     """Seed to use for reproducibility."""
     from_states: bool = False
@@ -45,6 +55,10 @@ class Config:
     """Whether to use heuristic feedback"""
     hf: bool = False
     """Whether to use human feedback"""
+    credit_window: int = 0
+    """Steps human feedback is spread over by gradient-weighted averaging, 0 for none"""
+    feedback_model: bool = False
+    """Whether to use learned feedback model"""
     history: bool = False
     """Whether to use past transitions to predict human feedback"""
     log_smoothing: int = 100
@@ -59,6 +73,8 @@ class Config:
     """Whether to use written feedback"""
     train_batches: int = 10
     """Train for train_batches x frames_per_batch environment steps"""
+    checkpoint_interval: int = 0
+    """Batches between resumable human-feedback checkpoints, 0 to save at the end"""
     visualize_batches: int = 0
     """Visualize for visualize_batches x frames_per_batch environment steps"""
 
@@ -73,7 +89,8 @@ def sac(cfg: Config):
     import os
     import random
     import uuid
-    from collections import defaultdict, deque
+    from collections import deque
+    from contextlib import nullcontext
 
     import numpy as np
     import torch
@@ -82,23 +99,27 @@ def sac(cfg: Config):
     from crew_algorithms.sac.trajectory_feedback import TrajectoryFeedback
     from crew_algorithms.sac.utils import (
         audio_feedback,
-        combine_feedback_and_rewards,
         feedback_model_train_step,
         get_time,
-        gradient_weighted_average_transform,
-        heuristic_feedback,
-        human_delay_transform,
         load_training,
         make_agent,
         make_data_buffer,
         make_env,
         make_loss_module,
         make_optimizer,
-        override_il_feedback,
         provide_learned_feedback,
         save_training,
         visualize,
     )
+    from crew_algorithms.utils.batch_preprocessing import BatchPreprocessor
+    from crew_algorithms.utils.checkpoint import CheckpointWriter
+    from crew_algorithms.utils.episode_stats import EpisodeStatistics
+    from crew_algorithms.utils.learner import (
+        AsyncLearner,
+        LossHistory,
+        compile_loss_networks,
+    )
+    from crew_algorithms.utils.prefetch import ReplayBufferPrefetcher
     from crew_algorithms.utils.rl_utils import make_collector
     from sortedcontainers import SortedList
     from torchrl.record.loggers import get_logger
@@ -166,28 +187,126 @@ def sac(cfg: Config):
         start_time=global_start_time,
     )
 
-    collector = make_collector(cfg.collector, env_fn, actor, device, cfg.num_envs)
-    collector.set_seed(cfg.seed)
+    if cfg.pipelined_collector and cfg.async_learner:
+        raise ValueError(
+            "The pipelined collector runs the policy in this process, so the "
+            "async learner cannot update its weights during collection."
+        )
 
-    """A short buffer later used for handling human feedback delay"""
-    human_delay_buffer_td = None
+    collector = make_collector(
+        cfg.collector,
+        env_fn,
+        actor,
+        device,
+        cfg.num_envs,
+        pipelined=cfg.pipelined_collector,
+    )
+    collector.set_seed(cfg.seed)
 
-    """Dictionary to store episode rewards"""
-    episode_reward, episode_reward_hf = defaultdict(float), defaultdict(float)
+    """Per-episode rewards and feedback, smoothed over recent episodes"""
+    episode_stats = EpisodeStatistics(["reward", "hf"], window=cfg.log_smoothing)
+    all_rewards = {}
     """List to store human feedback and heuristic feedback values"""
     all_hf, all_heu = [], []
 
-    num_success, num_trajs, last_traj = 0, 0, 0
-    loss = None
-
-    """Heuristic feedback provider"""
-    heuristic = heuristic_feedback(
-        cfg.envs.target_img, 0.95, cfg.collector.frames_per_batch, device
+    num_success, num_trajs = 0, 0
+    loss_history = LossHistory()
+
+    """Turns the collected batches into the transitions of the replay buffer"""
+    preprocess = BatchPreprocessor(
+        cfg.envs,
+        device,
+        heuristic_feedback=cfg.heuristic_feedback,
+        human_feedback=cfg.hf,
+        credit_window=cfg.credit_window,
+        history=cfg.history,
     )
     optimizer = make_optimizer(cfg, loss_module)
+    if cfg.optimization.compile_mode != "none":
+        compile_loss_networks(loss_module, mode=cfg.optimization.compile_mode)
 
     deploy_learned_feedback = False
 
+    """Samplers keeping replay batches in flight to the device"""
+    sample_batch_size = cfg.batch_size // 2 if cfg.use_expert else None
+    prb_sampler = ReplayBufferPrefetcher(
+        prb, device, cfg.prefetch_batches, sample_batch_size
+    )
+    prb_e_sampler = (
+        ReplayBufferPrefetcher(prb_e, device, cfg.prefetch_batches, sample_batch_size)
+        if cfg.use_expert
+        else None
+    )
+
+    def update():
+        """Runs one update on a replay batch and returns its losses."""
+        if cfg.audio_feedback:
+            stream.get_sample()
+
+        if cfg.use_expert:
+            sampled_expert = prb_e_sampler.sample()
+            sampled_new = prb_sampler.sample()
+            sampled_tensordict = torch.cat([sampled_expert, sampled_new], dim=0)
+        else:
+            sampled_tensordict = prb_sampler.sample()
+
+        loss_td = loss_module(sampled_tensordict)
+
+        actor_loss = loss_td["loss_actor"]
+        q_loss = loss_td["loss_qvalue"]
+        alpha_loss = loss_td["loss_alpha"]
+
+        optimizer.zero_grad()
+        loss = actor_loss + q_loss + alpha_loss
+        loss.backward()
+        torch.nn.utils.clip_grad_norm_(
+            model.parameters(), cfg.optimization.max_grad_norm
+        )
+        optimizer.step()
+
+        target_net_updater.step()
+        if cfg.use_expert:
+            sampled_expert = sampled_tensordict[: cfg.batch_size // 2]
+            sampled_new = sampled_tensordict[cfg.batch_size // 2 :]
+            prb_e.update_tensordict_priority(sampled_expert)
+            prb.update_tensordict_priority(sampled_new)
+        else:
+            prb.update_tensordict_priority(sampled_tensordict)
+        return dict(
+            total_loss=loss,
+            actor_loss=actor_loss,
+            q_loss=q_loss,
+            alpha_loss=alpha_loss,
+            alpha=loss_td["alpha"],
+            entropy=loss_td["entropy"],
+        )
+
+    """Writer saving the checkpoints in the background"""
+    checkpoint_writer = CheckpointWriter()
+
+    def checkpoint_training(iteration):
+        """Saves the training status for continual training"""
+        save_training(
+            model,
+            feedback_model,
+            prb,
+            episode_success,
+            all_hf,
+            all_heu,
+            loss_module,
+            f"{cfg.sub_name}/saved_training/{run_name}",
+            iteration,
+            cfg.collector.frames_per_batch,
+            checkpoint_writer=checkpoint_writer,
+        )
+
+    """Learner updating from the replay buffer while the frames are ingested"""
+    learner = (
+        AsyncLearner(update, collector.update_policy_weights_, cfg.weight_sync_interval)
+        if cfg.async_learner
+        else None
+    )
+
     os.makedirs(f"../Data/{cfg.sub_name}/{exp}/{run_name}", exist_ok=True)
     torch.save(model.state_dict(), f"../Data/{cfg.sub_name}/{exp}/{run_name}/0.pth")
 
@@ -207,7 +326,10 @@ def sac(cfg: Config):
             log_time=True,
         )
 
-        collector.update_policy_weights_()
+        if learner is None:
+            collector.update_policy_weights_()
+        # One stream per environment instance, its steps along the last dimension.
+        num_streams = data.batch_size[:-1].numel()
         data = data.view(-1)
 
         num_trajs += data["next", "agents", "done"].sum().item()
@@ -218,148 +340,67 @@ def sac(cfg: Config):
         )
         num_success += int(data["next", "agents", "reward"].sum().item())
 
-        data["done"] = data["agents", "done"]
-
         current_frames = data.numel()
         collected_frames += current_frames
 
-        if cfg.envs.name in ["find_treasure", "hide_and_seek_1v1"]:
-            data.set(
-                ("next", "agents", "heuristic_feedback"),
-                heuristic.provide_feedback(data),
-            )
-
-        if cfg.heuristic_feedback:
-            data.set(
-                ("next", "agents", "feedback"),
-                data[("next", "agents", "heuristic_feedback")],
-            )
-        else:
-            data.set(
-                ("next", "agents", "feedback"),
-                torch.zeros_like(data[("next", "agents", "reward")]).to(device),
+        finished_episodes = episode_stats.update(
+            data["agents", "observation", "obs_1"][..., -1, 2],
+            reward=data["next", "agents", "reward"],
+            hf=data["agents", "observation", "obs_1"][..., -1, 0],
+        )
+        if finished_episodes:
+            avg_ep_r = episode_stats.mean("reward")
+            logger.log_scalar("avg_episode_reward", avg_ep_r, step=collected_frames)
+            local_logger.log(
+                x_axis="steps",
+                y_axis="avg_episode_reward",
+                x_value=collected_frames,
+                y_value=avg_ep_r,
+                log_time=True,
             )
 
-        for j in range(len(data)):
-            time_stamp = data[("next", "agents", "observation", "obs_1")][
-                j, ..., -1, 1
-            ].item()
-            traj_j = data["agents", "observation", "obs_1"][j, ..., -1, 2].int().item()
-            episode_reward[traj_j] += data["next", "agents", "reward"][j].item()
-
             if cfg.hf:
-                episode_reward_hf[traj_j] += data["agents", "observation", "obs_1"][
-                    j, ..., -1, 0
-                ].item()
-
-            if traj_j > last_traj:
-                r_list = [episode_reward[ep] for ep in episode_reward]
-                avg_ep_r = np.array(
-                    r_list[max(0, len(r_list) - cfg.log_smoothing - 1) : -1]
-                ).mean()
-                logger.log_scalar("avg_episode_reward", avg_ep_r, step=collected_frames)
-                local_logger.log(
-                    x_axis="steps",
-                    y_axis="avg_episode_reward",
-                    x_value=collected_frames,
-                    y_value=avg_ep_r,
-                    log_time=True,
+                avg_ep_r_hf = episode_stats.mean("hf")
+                logger.log_scalar(
+                    "avg_episode_reward_hf", avg_ep_r_hf, step=collected_frames
                 )
-
-                if cfg.hf:
-                    r_list_hf = [episode_reward_hf[ep] for ep in episode_reward_hf]
-                    avg_ep_r_hf = np.array(
-                        r_list_hf[max(0, len(r_list_hf) - cfg.log_smoothing - 1) : -1]
-                    ).mean()
-                    logger.log_scalar(
-                        "avg_episode_reward_hf", avg_ep_r_hf, step=collected_frames
-                    )
-                    local_logger.log(
-                        x_axis="steps",
-                        y_axis="avg_episode_reward_hf",
-                        x_value=collected_frames,
-                        y_value=avg_ep_r_hf,
-                        log_time=True,
-                    )
-
-                sr_list = [1 if episode_reward[ep] > 0 else 0 for ep in episode_reward]
-                avg_sr = np.array(
-                    sr_list[max(0, len(sr_list) - cfg.log_smoothing - 1) : -1]
-                ).mean()
-                logger.log_scalar("success_rate", avg_sr, step=collected_frames)
                 local_logger.log(
                     x_axis="steps",
-                    y_axis="success_rate",
+                    y_axis="avg_episode_reward_hf",
                     x_value=collected_frames,
-                    y_value=avg_sr,
+                    y_value=avg_ep_r_hf,
                     log_time=True,
                 )
-                last_traj = traj_j
 
-        local_logger.data["all_rewards"] = {
-            k: round(v, 4) for k, v in episode_reward.items()
-        }
-        data.set(
-            ("next", "agents", "reward"),
-            data[("next", "agents", "reward")] * cfg.envs.scale_reward
-            + cfg.envs.shift_reward,
-        )
-
-        data["time_stamp"] = torch.tensor([round(time_stamp, 4)] * data.numel())
-
-        data["agents", "observation", "obs_1"][
-            data["agents", "observation", "obs_1"] == -9
-        ] = 0
-        data["next", "agents", "observation", "obs_1"][
-            data["next", "agents", "observation", "obs_1"] == -9
-        ] = 0
-
-        if cfg.hf:
-            if cfg.envs.name in ["find_treasure", "hide_and_seek_1v1"]:
-                hf_values = data["agents", "observation", "obs_1"][..., -1, 0]
-                all_hf.extend(hf_values.squeeze(1).tolist())
-                all_heu.extend(
-                    data[("next", "agents", "heuristic_feedback")]
-                    .squeeze(1)
-                    .squeeze(1)
-                    .tolist()
-                )
-
-            if human_delay_buffer_td is not None:
-                data = torch.cat([human_delay_buffer_td, data], dim=0)
-
-            human_delay_td, human_delay_buffer_td = human_delay_transform(
-                data, ("agents", "observation", "obs_1"), cfg.envs.human_delay_steps
+            avg_sr = episode_stats.success_rate("reward")
+            logger.log_scalar("success_rate", avg_sr, step=collected_frames)
+            local_logger.log(
+                x_axis="steps",
+                y_axis="success_rate",
+                x_value=collected_frames,
+                y_value=avg_sr,
+                log_time=True,
             )
-
-            # grad_average_td = gradient_weighted_average_transform(
-            #     human_delay_td, ("agents", "observation", "obs_1"), 5
-            # )
-            grad_average_td = human_delay_td
-            il_feedback_td = grad_average_td
-            il_feedback_td = override_il_feedback(
-                grad_average_td,
-                ("agents", "observation", "obs_1"),
-                ("agents", "observation", "obs_1"),
-                1,
+            all_rewards.update(
+                {k: round(v["reward"], 4) for k, v in finished_episodes.items()}
             )
 
-            il_feedback_td.set(
-                ("next", "agents", "feedback"),
-                il_feedback_td.get(("agents", "observation", "obs_1"))[
-                    ..., -1, 0
-                ].unsqueeze(dim=-1),
-            )  # write human feedback to feedback field
-        else:
-            il_feedback_td = data
+        local_logger.data["all_rewards"] = all_rewards
+
+        preprocess.label(data)
+        time_stamp = data["time_stamp"][-1].item()
 
-        combined_rewards = combine_feedback_and_rewards(
-            il_feedback_td,
-            ("next", "agents", "feedback"),
-            ("next", "agents", "reward"),
-            cfg.envs.dense_reward_scale,
-        )  # add feedback to reward
+        if cfg.hf and preprocess.heuristic is not None:
+            hf_values = data["agents", "observation", "obs_1"][..., -1, 0]
+            all_hf.extend(hf_values.squeeze(1).tolist())
+            all_heu.extend(
+                data[("next", "agents", "heuristic_feedback")]
+                .squeeze(1)
+                .squeeze(1)
+                .tolist()
+            )
 
+        combined_rewards = preprocess.assign_feedback(data, num_streams)
 
         print(
             "Rewards:", combined_rewards.get(("next", "agents", "reward")).sum().item()
@@ -377,85 +418,25 @@ def sac(cfg: Config):
         )
         print("num_success: %d" % (num_success))
 
-        t1, t2 = [], []
         if collected_frames >= cfg.collector.init_random_frames:
-            (
-                total_losses,
-                actor_losses,
-                q_losses,
-                alpha_losses,
-                alphas,
-                entropies,
-            ) = ([], [], [], [], [], [])
-
-            for _ in range(
-                int(cfg.collector.frames_per_batch * (cfg.optimization.utd_ratio))
-            ):
-                tic = time()
-
-                if cfg.audio_feedback:
-                    stream.get_sample()
-
-                if cfg.use_expert:
-                    sampled_expert = (
-                        prb_e.sample(batch_size=cfg.batch_size // 2).clone().to(device)
-                    )
-                    sampled_new = (
-                        prb.sample(batch_size=cfg.batch_size // 2).clone().to(device)
-                    )
-                    sampled_tensordict = torch.cat([sampled_expert, sampled_new], dim=0)
-                else:
-                    sampled_tensordict = prb.sample().clone().to(device)
-
-                loss_td = loss_module(sampled_tensordict)
-
-                actor_loss = loss_td["loss_actor"]
-                q_loss = loss_td["loss_qvalue"]
-                alpha_loss = loss_td["loss_alpha"]
-
-                optimizer.zero_grad()
-                loss = actor_loss + q_loss + alpha_loss
-                loss.backward()
-                torch.nn.utils.clip_grad_norm_(
-                    model.parameters(), cfg.optimization.max_grad_norm
-                )
-                optimizer.step()
-
-                target_net_updater.step()
-                t1.append(time() - tic)
-                if (_ + 1) % 1 == 0:
-                    if cfg.use_expert:
-                        sampled_expert = sampled_tensordict[:cfg.batch_size//2]
-                        sampled_new = sampled_tensordict[cfg.batch_size//2:]
-                        prb_e.update_tensordict_priority(sampled_expert)
-                        prb.update_tensordict_priority(sampled_new)
-                    else:
-                        prb.update_tensordict_priority(sampled_tensordict)
-                t2.append(time() - tic)
-
-                total_losses.append(loss.item())
-                actor_losses.append(actor_loss.item())
-                q_losses.append(q_loss.item())
-                alpha_losses.append(alpha_loss.item())
-                alphas.append(loss_td["alpha"].item())
-                entropies.append(loss_td["entropy"].item())
+            if learner is not None:
+                learner.start()
+            else:
+                for _ in range(
+                    int(cfg.collector.frames_per_batch * (cfg.optimization.utd_ratio))
+                ):
+                    loss_history.append(**update())
 
         metrics = {
             "collected_frames": collected_frames,
             "collected_traj": num_trajs,
             "time": time_stamp,
         }
-        if loss is not None:
-            metrics.update(
-                {
-                    "total_loss": np.mean(total_losses),
-                    "actor_loss": np.mean(actor_losses),
-                    "q_loss": np.mean(q_losses),
-                    "alpha_loss": np.mean(alpha_losses),
-                    "alpha": np.mean(alphas),
-                    "entropy": np.mean(entropies),
-                }
-            )
+        if learner is not None:
+            metrics.update(learner.losses())
+        else:
+            metrics.update(loss_history.means())
+            loss_history.clear()
 
         for key, value in metrics.items():
             logger.log_scalar(key, value, step=collected_frames)
@@ -469,24 +450,27 @@ def sac(cfg: Config):
 
         local_logger.save_log()
 
-        torch.save(
-            model.state_dict(),
-            f"../Data/{cfg.sub_name}/{exp}/{run_name}/{str(i+1)}.pth",
-        )
+        with learner.paused() if learner is not None else nullcontext():
+            checkpoint_writer.save(
+                model.state_dict(),
+                f"../Data/{cfg.sub_name}/{exp}/{run_name}/{str(i+1)}.pth",
+            )
+            if (
+                cfg.hf
+                and cfg.checkpoint_interval > 0
+                and (i + 1) % cfg.checkpoint_interval == 0
+                and (i + 1) < cfg.train_batches
+            ):
+                checkpoint_training(i + 1)
         if (i + 1) >= cfg.train_batches:
+            if learner is not None:
+                learner.stop()
+            prb_sampler.shutdown()
+            if prb_e_sampler is not None:
+                prb_e_sampler.shutdown()
             if cfg.hf:
-                save_training(
-                    model,
-                    feedback_model,
-                    prb,
-                    episode_success,
-                    all_hf,
-                    all_heu,
-                    loss_module,
-                    f"{cfg.sub_name}/saved_training/{run_name}",
-                    i + 1,
-                    cfg.collector.frames_per_batch,
-                )
+                checkpoint_training(i + 1)
+            checkpoint_writer.close()
             collector.shutdown()
             return 0
 
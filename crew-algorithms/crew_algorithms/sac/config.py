@@ -12,6 +12,7 @@ class OptimizationConfig:
     max_grad_norm: float = 1.0
     alpha_init: float = 0.1
     target_entropy: float = -6.0
+    compile_mode: str = "none"
 
 
 @define(auto_attribs=True)
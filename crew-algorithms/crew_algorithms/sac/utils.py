@@ -1,7 +1,5 @@
-import math
 import os
 import pickle
-import re
 from datetime import datetime
 
 import torch
@@ -15,8 +13,18 @@ from crew_algorithms.sac.policy import (
 )
 from crew_algorithms.envs.channels import WrittenFeedbackChannel
 from crew_algorithms.envs.configs import EnvironmentConfig
+from crew_algorithms.utils.checkpoint import (
+    CheckpointWriter,
+    load_replay_buffer,
+    read_manifest,
+)
+from crew_algorithms.utils.frame_storage import FrameStackStorage
+from crew_algorithms.utils.offline_dataset import (
+    convert_offline_dataset,
+    is_offline_dataset,
+    load_offline_dataset,
+)
 from crew_algorithms.utils.rl_utils import make_base_env
-from PIL import Image
 from tensordict.nn import (
     InteractionType,
     TensorDictModule,
@@ -24,7 +32,6 @@ from tensordict.nn import (
 )
 from tensordict.nn.distributions import NormalParamExtractor
 from torch import nn, optim
-from torch.nn import functional as F
 from torchrl.data import (
     LazyMemmapStorage,
     TensorDictPrioritizedReplayBuffer,
@@ -45,7 +52,6 @@ from torchrl.envs.transforms.transforms import (
 from torchrl.modules import ProbabilisticActor, ValueOperator
 from torchrl.modules.distributions import TanhNormal
 from torchrl.objectives import SACLoss, SoftUpdate
-from torchvision import transforms
 from torchvision.utils import save_image
 
 
@@ -170,7 +176,7 @@ def make_agent_continuous(proof_env, cfg, device):
     actor = ProbabilisticActor(
         spec=proof_env.action_spec,
         in_keys=["loc", "scale"],
-        # out_keys=[proof_env.action_key],
+        out_keys=[proof_env.action_key],
         module=actor_module,
         distribution_class=dist_class,
         distribution_kwargs=dist_kwargs,
@@ -224,13 +230,23 @@ def make_data_buffer(cfg, run_name):
         max_capacity=cfg.buffer_size, alpha=0.7, beta=0.9, reduction="max"
     )
 
-    replay_buffer = TensorDictReplayBuffer(
-        pin_memory=False,
-        storage=LazyMemmapStorage(
+    if cfg.compact_frames:
+        storage = FrameStackStorage(
             cfg.buffer_size,
+            cfg.envs.num_channels,
+            cfg.envs.num_stacks,
             scratch_dir="../Data/Buffer/prb_%s" % run_name,
             device="cpu",
-        ),
+        )
+    else:
+        storage = LazyMemmapStorage(
+            cfg.buffer_size,
+            scratch_dir="../Data/Buffer/prb_%s" % run_name,
+            device="cpu",
+        )
+    replay_buffer = TensorDictReplayBuffer(
+        pin_memory=False,
+        storage=storage,
         batch_size=cfg.batch_size,
         sampler=p_sampler,
         priority_key=("agents", "priority_weight"),
@@ -247,7 +263,12 @@ def make_data_buffer(cfg, run_name):
             batch_size=cfg.batch_size,
             priority_key="rank_adjusted_td_error",
         )
-        replay_buffer_expert = load_prb(replay_buffer_expert)
+        if is_offline_dataset("../Data/Offline/Dataset"):
+            replay_buffer_expert = load_offline_dataset(
+                replay_buffer_expert, "../Data/Offline/Dataset"
+            )
+        else:
+            replay_buffer_expert = load_prb(replay_buffer_expert)
     else:
         replay_buffer_expert = None
 
@@ -351,70 +372,6 @@ def lr_scheduler(
     return optimizer_actor, optimizer_critic, phase
 
 
-def human_delay_transform(td, shift_key, N):
-    data = td.get(shift_key)
-    human_feedback = data[..., -1, 0]
-
-    human_feedback_0 = (
-        torch.ones((N, *human_feedback.shape[1:]), device=human_feedback.device) * 0
-    )
-
-    human_feedback = torch.cat([human_feedback, human_feedback_0], 0)
-    human_feedback = human_feedback[N:]
-
-    data[..., -1, 0] = human_feedback
-    td.set(shift_key, data)
-    # Return the tensors with valid data and the tensors with placeholder separately
-    return td[:-N], td[-N:]
-
-
-def gradient_weighted_average_transform(td, key, N, step_count_key="step_count"):
-    if td.batch_size[0] <= 1:
-        return td
-
-    data = td.get(key)
-    step_count = td[step_count_key].squeeze()
-    feedback = data[..., 0].squeeze()
-
-    coordinates = (step_count,)
-    try:
-        grads = torch.gradient(feedback, spacing=coordinates)[0]
-    except Exception as e:
-        print(step_count.shape)
-        print(step_count)
-        print(td)
-        raise e
-
-    total_padding = N - 1
-
-    front_padding = torch.zeros(math.floor(total_padding / 2), device=feedback.device)
-    back_padding = torch.zeros(math.ceil(total_padding / 2), device=feedback.device)
-
-    feedback = torch.cat([front_padding, feedback, back_padding], -1)
-    grads = torch.cat([front_padding, grads, back_padding], -1)
-
-    feedback = feedback.unfold(-1, N, 1)
-    grads = grads.unfold(-1, N, 1)
-
-    weighted_average = torch.sum(feedback * grads, dim=-1) / (grads.sum(dim=-1) + 1e-10)
-    data[..., 0] = torch.reshape(weighted_average, data[..., 0].shape)
-    td.set(key, data)
-    return td
-
-
-def override_il_feedback(td, il_enabled_key, feedback_key, il_feedback):
-    # https://arxiv.org/pdf/1905.06750.pdf
-    # https://arxiv.org/pdf/2108.04763.pdf
-    original_feedback = td.get(feedback_key)
-    feedback = original_feedback[..., -1, 0]
-
-    il_enabled = td.get(il_enabled_key)[..., -1, 3].bool()
-    feedback[il_enabled] = il_feedback
-    original_feedback[..., -1, 0] = feedback
-    td.set(feedback_key, original_feedback)
-    return td
-
-
 def audio_feedback(stream, time_stamp, action_key, reward_key, prb):
     if len(stream.buffer) < 128:
         return prb
@@ -426,11 +383,6 @@ def audio_feedback(stream, time_stamp, action_key, reward_key, prb):
     return prb
 
 
-def combine_feedback_and_rewards(td, feedback_key, reward_key, scale_feedback=1.0):
-    td[reward_key] = td[reward_key] + td.get(feedback_key) * scale_feedback
-    return td
-
-
 def get_time():
     now = datetime.now()
     return now.strftime("%m%d_%H%M")
@@ -440,124 +392,20 @@ def fill_prb(
     act_folder="../Data/Offline/Actions",
     obs_folder="../Data/Offline/Observations",
     ending_steps_path="../Data/Offline/ending_steps.pth",
+    out_dir="../Data/Offline/Dataset",
+    num_workers=None,
 ):
-    """Fill a replay buffer with offline data.
+    """Converts offline data into a dataset for the expert replay buffer.
     Args:
         act_folder: The folder containing the action data.
         obs_folder: The folder containing the observation data.
         ending_steps_path: A torch tensor array containing the ending step number of each episode.
+        out_dir: The directory of the converted dataset.
+        num_workers: The number of processes decoding the images.
     """
-
-    to_tensor = transforms.ToTensor()
-
-    def sorting_key(string):
-        numbers = re.findall(r"\d+", string)
-        return int(numbers[0]), int(numbers[1])
-
-    o_list = [f for f in os.listdir(obs_folder)]
-    o_list = sorted(o_list, key=sorting_key)
-
-    a_list = [f for f in os.listdir(act_folder)]
-    a_list = sorted(a_list, key=sorting_key)
-
-    ending_steps = torch.load(ending_steps_path)
-    traj_ID = 0
-
-    experiences = []
-
-    for i in range(len(o_list) - 1):
-        print("Processing %d/%d" % (i, len(o_list) - 1), end="\r")
-
-        o_i = o_list[i][3:-4]
-        a_i = a_list[i][3:-3]
-        assert o_i == a_i, "Not match: %s, %s" % (o_i, a_i)
-
-        obs_i = to_tensor(
-            Image.open(os.path.join(obs_folder, o_list[i])).convert("RGB")
-        ).unsqueeze(0)
-        act_i = torch.tensor(
-            torch.load(os.path.join(act_folder, a_list[i])), dtype=torch.int64
-        ).unsqueeze(0)
-        logits_i = torch.zeros((1, 4))
-        logits_i[0, int(act_i.item())] = 1
-
-        next_obs_i = to_tensor(
-            Image.open(os.path.join(obs_folder, o_list[i + 1])).convert("RGB")
-        ).unsqueeze(0)
-        next_act_i = torch.tensor(
-            torch.load(os.path.join(act_folder, a_list[i + 1])), dtype=torch.int64
-        ).unsqueeze(0)
-        next_logits_i = torch.zeros((1, 4))
-        next_logits_i[0, int(next_act_i.item())] = 1
-
-        reward = torch.tensor([[[0.000]]])
-        done = torch.tensor([[[False]]])
-
-        if i in ending_steps:
-            reward = torch.tensor([[[1.0]]])
-        if i - 1 in ending_steps:
-            continue
-        if i - 2 in ending_steps:
-            traj_ID += 1
-
-        data_dict = TensorDict(
-            {
-                "agents": TensorDict(
-                    {
-                        "action": act_i.unsqueeze(0),
-                        "done": torch.tensor([[[False]]]),
-                        "logits": logits_i.unsqueeze(1),
-                        "observation": TensorDict(
-                            {
-                                "obs_0": obs_i.unsqueeze(0),
-                                "obs_1": torch.zeros((1, 1, 15)),
-                            },
-                            batch_size=[1, 1],
-                            device="cuda",
-                        ),
-                    },
-                    batch_size=[1, 1],
-                    device="cuda",
-                ),
-                "collector": TensorDict(
-                    {"traj_ids": torch.tensor([traj_ID])}, batch_size=[1], device="cuda"
-                ),
-                "next": TensorDict(
-                    {
-                        "agents": TensorDict(
-                            {
-                                "done": done,
-                                "observation": TensorDict(
-                                    {
-                                        "obs_0": next_obs_i.unsqueeze(0),
-                                        "obs_1": torch.zeros((1, 1, 15)),
-                                    },
-                                    batch_size=[1, 1],
-                                    device="cuda",
-                                ),
-                                "reward": reward,
-                            },
-                            batch_size=[1, 1],
-                            device="cuda",
-                        ),
-                        "step_count": torch.zeros((1, 1, 1), dtype=torch.int64),
-                    },
-                    batch_size=[],
-                    device="cuda",
-                ),
-                "step_count": torch.zeros((1, 1, 1), dtype=torch.int64),
-                "time_stamp": -torch.ones((1)) * 100,
-                "is_expert": torch.tensor([False]),
-            },
-            batch_size=[1],
-            device="cuda",
-        )
-
-        experiences.append(data_dict)
-
-        if (i + 1) % 10000 == 0:
-            torch.save(experiences, "../Data/Offline/experiences_%d.pt" % i)
-            experiences = []
+    convert_offline_dataset(
+        act_folder, obs_folder, ending_steps_path, out_dir, num_workers
+    )
 
 
 def load_prb(prb, path="../Data/Offline/Replay_nodone", chunk_size=1024):
@@ -600,94 +448,6 @@ def visualize(data, i, num_channels, fpb, hf=False, continuous=True):
         )
 
 
-class heuristic_feedback:
-    """ A hardcoded heuristic feedback model for FindTreasure and 1v1 Hide and Seek. Provides positive feedback for moving closer to the treasure, negative feedback for moving away from the treasure, and positive feedback for exploring new areas.
-    Args:
-        template_path: The path to the template image of the treasure.
-        threshold: The threshold for the treasure detection.
-        batch_size: The batch size of the model.
-        device: The device to perform operations on.
-    """
-    def __init__(self, template_path, threshold, batch_size, device):
-        template = Image.open(template_path)
-        self.totens = transforms.ToTensor()
-        self.template = self.totens(template).unsqueeze(0).to(device) + 1e-6
-
-        torch._assert(len(self.template.shape) == 4, "Template should be 4D")
-        self.template_morm = ((self.template**2).sum() ** 0.5).repeat(
-            batch_size, 1, 1, 1
-        )
-        self.one_kernel = torch.ones_like(self.template, device=device)
-        self.threshold = threshold
-
-    def treasure_in_view(self, frame):
-        torch._assert(len(frame.shape) == 4, "Frame should be 4D")
-
-        frame = frame + 1e-6
-
-        brightness = F.conv2d(frame**2, self.one_kernel) ** 0.5
-        heat_map = F.conv2d(frame, self.template)
-        heat_map = heat_map / (brightness * self.template_morm)
-
-        out = (heat_map > self.threshold).sum(dim=(1, 2, 3)) > 0
-        return out
-
-    def moved_closer(self, td):
-        next_agent = td["next", "agents", "observation", "obs_1"][..., -1, 6:9]
-        next_treasure = td["next", "agents", "observation", "obs_1"][..., -1, 12:15]
-        next_agent[..., 1], next_treasure[..., 1] = 0, 0
-        next_distance = ((next_agent - next_treasure) ** 2).mean(dim=-1, keepdim=True)
-
-        current_agent = td["agents", "observation", "obs_1"][..., -1, 6:9]
-        current_treasure = td["agents", "observation", "obs_1"][..., -1, 12:15]
-        current_agent[..., 1], current_treasure[..., 1] = 0, 0
-        current_distance = ((current_agent - current_treasure) ** 2).mean(
-            dim=-1, keepdim=True
-        )
-
-        r_dis = (current_distance - next_distance) / 10
-        return r_dis.squeeze(-1).squeeze(-1)
-
-    def explored(self, f_current, f_next):
-        non_black_current = (f_current > 0).float().sum(dim=(1, 2, 3))
-        non_black_next = (f_next > 0).float().sum(dim=(1, 2, 3))
-        explored = (non_black_next - non_black_current - 300) / 1000
-        return explored
-
-    def treasure_appeared(self, f_current, f_next):
-        current_treasure = self.treasure_in_view(f_current)
-        next_treasure = self.treasure_in_view(f_next)
-        return (next_treasure & ~current_treasure).float() * 2 - 1
-
-    def get_treasure_in_view(self, f_current, f_next):
-        in_current = self.treasure_in_view(f_current)
-        in_next = self.treasure_in_view(f_next)
-        return in_current, in_next
-
-    def provide_feedback(self, td):
-        f_current = td.get(("agents", "observation", "obs_0")).squeeze(1)[:, -3:]
-        f_next = td.get(("next", "agents", "observation", "obs_0")).squeeze(1)[:, -3:]
-
-        treasure_in_view, treasure_in_next = self.get_treasure_in_view(
-            f_current, f_next
-        )
-        treasure_not_in_view = ~treasure_in_view
-
-        moved_closer = self.moved_closer(td)
-        explored = self.explored(f_current, f_next)
-
-        feedback = (
-            treasure_in_view.float() * moved_closer
-            + treasure_not_in_view.float() * explored
-            + (treasure_in_next.float() - treasure_in_view.float()) * 3
-        )
-
-        # feedback = torch.rand_like(feedback) * 2 - 1 # random feedback
-        feedback = feedback
-
-        return feedback.unsqueeze(-1).unsqueeze(-1)
-
-
 def save_training(
     model,
     feedback_model,
@@ -699,45 +459,65 @@ def save_training(
     run_name,
     iter,
     fpb,
+    checkpoint_writer=None,
 ):
-    os.makedirs("../Data/Saved_Training/%s" % run_name, exist_ok=True)
-    meta = {"fpb": fpb, "sr": episode_success}
-    with open("../Data/Saved_Training/%s/meta.pkl" % run_name, "wb") as f:
-        pickle.dump(meta, f)
+    """Saves training status for continual training
+
+    With a `checkpoint_writer`, the files are written in the background and
+    only the replay buffer segments changed since its previous checkpoint of
+    the run are saved again.
+    """
+    writer = checkpoint_writer if checkpoint_writer is not None else CheckpointWriter()
+    pickles = {}
     if len(all_hf) > 0:
-        with open("../Data/Saved_Training/%s/hf_values.pkl" % run_name, "wb") as f:
-            pickle.dump(all_hf, f)
+        pickles["hf_values.pkl"] = all_hf
     if len(all_heu) > 0:
-        with open("../Data/Saved_Training/%s/heuristic_values.pkl" % run_name, "wb") as f:
-            pickle.dump(all_heu, f)
-
-    torch.save(
-        model.state_dict(), "../Data/Saved_Training/%s/weights_Iter_%d.pth" % (run_name, iter)
-    )
-    torch.save(
-        feedback_model.state_dict(),
-        "../Data/Saved_Training/%s/feedback_model_Iter_%d.pth" % (run_name, iter),
-    )
-    torch.save(
-        loss_module.state_dict(),
-        "../Data/Saved_Training/%s/loss_module_Iter_%d.pth" % (run_name, iter),
+        pickles["heuristic_values.pkl"] = all_heu
+    writer.save_training(
+        "../Data/Saved_Training/%s" % run_name,
+        iter,
+        {
+            "weights": model.state_dict(),
+            "feedback_model": feedback_model.state_dict(),
+            "loss_module": loss_module.state_dict(),
+        },
+        meta={"fpb": fpb, "sr": episode_success},
+        pickles=pickles,
+        replay_buffer=prb,
     )
-    prb.dumps("../Data/Saved_Training/%s/prb.pkl" % run_name)
+    if checkpoint_writer is None:
+        writer.close()
 
 
 def load_training(model, prb, loss_module, run_name, global_start_time, iter, device):
-    model.load_state_dict(
-        torch.load("../Data/Saved_Training/%s/weights_Iter_%d.pth" % (run_name, iter))
-    )
-    loss_module.load_state_dict(
-        torch.load("../Data/Saved_Training/%s/loss_module_Iter_%d.pth" % (run_name, iter))
-    )
-    prb.loads("../Data/Saved_Training/%s/prb.pkl" % run_name)
-
-    with open("../Data/Saved_Training/%s/meta.pkl" % run_name, "rb") as f:
-        meta = pickle.load(f)
-        episode_success = meta["sr"]
-        fpb = meta["fpb"]
+    directory = "../Data/Saved_Training/%s" % run_name
+    manifest = read_manifest(directory)
+    if manifest is not None:
+        """Resume from the last complete checkpoint"""
+        files = manifest["files"]
+        model.load_state_dict(torch.load(os.path.join(directory, files["weights"])))
+        loss_module.load_state_dict(
+            torch.load(os.path.join(directory, files["loss_module"]))
+        )
+        load_replay_buffer(prb, directory, manifest)
+        meta = manifest["meta"]
+        iter = manifest["iteration"]
+    else:
+        model.load_state_dict(
+            torch.load(
+                "../Data/Saved_Training/%s/weights_Iter_%d.pth" % (run_name, iter)
+            )
+        )
+        loss_module.load_state_dict(
+            torch.load(
+                "../Data/Saved_Training/%s/loss_module_Iter_%d.pth" % (run_name, iter)
+            )
+        )
+        prb.loads("../Data/Saved_Training/%s/prb.pkl" % run_name)
+        with open("../Data/Saved_Training/%s/meta.pkl" % run_name, "rb") as f:
+            meta = pickle.load(f)
+    episode_success = meta["sr"]
+    fpb = meta["fpb"]
     collected_frames = iter * fpb
     time_stamp = collected_frames / 2
     # prb.update_priority(index=torch.arange(len(prb)), priority=torch.ones(len(prb)) * 0.25)
@@ -0,0 +1,218 @@
+import torch
+from crew_algorithms.envs.configs import EnvironmentConfig
+from crew_algorithms.utils.feedback_providers import make_feedback_provider
+from crew_algorithms.utils.feedback_service import FeedbackModelService
+from crew_algorithms.utils.transforms import (
+    FeedbackCreditTransform,
+    HistoryWindowTransform,
+)
+from tensordict import TensorDictBase
+
+__all__ = [
+    "BatchPreprocessor",
+    "combine_feedback_and_rewards",
+    "override_il_feedback",
+]
+
+
+def combine_feedback_and_rewards(td, feedback_key, reward_key, scale_feedback=1.0):
+    td[reward_key] = td[reward_key] + td.get(feedback_key) * scale_feedback
+    return td
+
+
+def override_il_feedback(td, il_enabled_key, feedback_key, il_feedback):
+    """Sets feedback value of human controlled steps to il_feedback"""
+    # https://arxiv.org/pdf/1905.06750.pdf
+    # https://arxiv.org/pdf/2108.04763.pdf
+    original_feedback = td.get(feedback_key)
+    feedback = original_feedback[..., -1, 0]
+
+    il_enabled = td.get(il_enabled_key)[..., -1, 3].bool()
+    feedback[il_enabled] = il_feedback
+    original_feedback[..., -1, 0] = feedback
+    td.set(feedback_key, original_feedback)
+    return td
+
+
+class BatchPreprocessor:
+    """Turns a collected batch into the transitions stored in the replay buffer.
+
+    This is the per-batch step shared by the DDPG and SAC training loops and by
+    the trainer benchmark:
+
+    1. The heuristic feedback of the environment, if any, is computed, and
+       used as feedback with `heuristic_feedback`.
+    2. The reward is scaled and shifted, every transition is stamped with the
+       time of the batch, and the -9 placeholders of the vector observations
+       are zeroed.
+    3. With `human_feedback`, the human feedback is assigned to the delayed
+       steps it was given for, human controlled steps get a feedback of 1,
+       and the result is used as feedback.
+    4. The feedback is added to the reward.
+    5. With `history`, the past frames, actions and feedbacks are added for
+       the feedback model.
+    6. Once `learned_feedback` is set, its prediction is added to the reward.
+
+    Steps 1 and 2 are `label`, which writes to the collected batch itself, so
+    that the training loops can log its feedback before `assign_feedback`
+    overrides the human controlled steps.
+
+    A batch holds the steps of one or more streams, e.g. the instances of a
+    `UnityVecEnv` or the environments of a collector, each collected along the
+    last batch dimension. Steps 3 and 5 carry every stream over to its next
+    batch on their own, so the streams must come in the same order in every
+    batch.
+
+    Examples:
+        >>> preprocess = BatchPreprocessor(cfg.envs, device, human_feedback=True)
+        >>> for data in collector:
+        ...     prb.extend(preprocess(data).cpu())
+
+    Args:
+        env_cfg: The environment configuration.
+        device: The device the feedback is computed on.
+        heuristic_feedback: Whether the heuristic feedback is used as feedback.
+        human_feedback: Whether the human feedback is used as feedback.
+        credit_window: Steps human feedback is spread over by gradient-weighted
+            averaging, 0 to disable.
+        history: Whether to add the history used by the feedback model.
+    """
+
+    def __init__(
+        self,
+        env_cfg: EnvironmentConfig,
+        device: torch.device,
+        heuristic_feedback: bool = False,
+        human_feedback: bool = False,
+        credit_window: int = 0,
+        history: bool = False,
+    ):
+        self.env_cfg = env_cfg
+        self.device = device
+        self.heuristic_feedback = heuristic_feedback
+        self.human_feedback = human_feedback
+        self.history = history
+        self.heuristic = make_feedback_provider(env_cfg, device)
+        self.credit_window = credit_window
+        self._feedback_credit = []
+        self._history_window = []
+        self.learned_feedback: FeedbackModelService | None = None
+        """The learned feedback model, once it is deployed."""
+
+    def label(self, data: TensorDictBase) -> None:
+        """Adds the feedback, reward and time stamp of a collected batch in place."""
+        data["done"] = data["agents", "done"]
+        reward = data["next", "agents", "reward"]
+
+        if self.heuristic is not None:
+            data.set(("next", "agents", "heuristic_feedback"), self.heuristic(data))
+        if self.heuristic_feedback:
+            feedback = data["next", "agents", "heuristic_feedback"]
+        else:
+            feedback = torch.zeros_like(reward).to(self.device)
+        data.set(("next", "agents", "feedback"), feedback)
+
+        data.set(
+            ("next", "agents", "reward"),
+            reward * self.env_cfg.scale_reward + self.env_cfg.shift_reward,
+        )
+        time_stamp = data["next", "agents", "observation", "obs_1"][-1, ..., -1, 1]
+        data["time_stamp"] = torch.tensor([round(time_stamp.item(), 4)] * data.numel())
+
+        for key in [
+            ("agents", "observation", "obs_1"),
+            ("next", "agents", "observation", "obs_1"),
+        ]:
+            obs_1 = data[key]
+            obs_1[obs_1 == -9] = 0
+
+    def _stream_transforms(self, stream: int):
+        while len(self._feedback_credit) <= stream:
+            self._feedback_credit.append(
+                FeedbackCreditTransform(
+                    self.env_cfg.human_delay_steps, self.credit_window
+                )
+            )
+            self._history_window.append(
+                HistoryWindowTransform(history_len=6, obs_channels=3)
+            )
+        return self._feedback_credit[stream], self._history_window[stream]
+
+    def _assign_stream_feedback(
+        self, data: TensorDictBase, stream: int
+    ) -> TensorDictBase:
+        feedback_credit, history_window = self._stream_transforms(stream)
+        if self.human_feedback:
+            data = override_il_feedback(
+                feedback_credit(data),
+                ("agents", "observation", "obs_1"),
+                ("agents", "observation", "obs_1"),
+                1,
+            )
+            # Writes the human feedback to the feedback field.
+            data.set(
+                ("next", "agents", "feedback"),
+                data["agents", "observation", "obs_1"][..., -1, 0].unsqueeze(dim=-1),
+            )
+
+        data = combine_feedback_and_rewards(
+            data,
+            ("next", "agents", "feedback"),
+            ("next", "agents", "reward"),
+            self.env_cfg.dense_reward_scale,
+        )
+
+        if self.history:
+            data = history_window(data)
+        return data
+
+    def assign_feedback(
+        self, data: TensorDictBase, num_streams: int = 1
+    ) -> TensorDictBase:
+        """Adds the feedback of a labelled batch to its reward.
+
+        Args:
+            data: The batch, labelled with `label`, with the consecutive steps
+                of its streams one stream after the other.
+            num_streams: The number of streams in the batch.
+
+        Returns:
+            The transitions to store in the replay buffer.
+        """
+        if num_streams == 1:
+            data = self._assign_stream_feedback(data, 0)
+        else:
+            data = torch.cat(
+                [
+                    self._assign_stream_feedback(stream_data, stream)
+                    for stream, stream_data in enumerate(
+                        data.split(len(data) // num_streams)
+                    )
+                ]
+            )
+
+        if self.learned_feedback is not None:
+            learned_feedback = self.learned_feedback.predict(data)
+            print("Providing Learned Feedback:", learned_feedback.sum())
+            reward = data["next", "agents", "reward"]
+            data.set(
+                ("next", "agents", "reward"),
+                reward
+                + learned_feedback.to(reward.device) * self.env_cfg.dense_reward_scale,
+            )
+        return data
+
+    def __call__(self, data: TensorDictBase) -> TensorDictBase:
+        """Preprocesses a collected batch, see `label` and `assign_feedback`.
+
+        Args:
+            data: The batch, with the streams along its leading dimensions and
+                the consecutive steps of each along the last one.
+
+        Returns:
+            The transitions to store in the replay buffer.
+        """
+        num_streams = data.batch_size[:-1].numel()
+        data = data.reshape(-1)
+        self.label(data)
+        return self.assign_feedback(data, num_streams)
@@ -0,0 +1,343 @@
+import copy
+import json
+import os
+import pickle
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable
+
+import torch
+from torch.utils._pytree import tree_map
+from torchrl.data.replay_buffers import ReplayBuffer
+from torchrl.data.replay_buffers.samplers import PrioritizedSampler
+
+__all__ = ["CheckpointWriter", "load_replay_buffer", "read_manifest"]
+
+MANIFEST = "manifest.json"
+
+
+def _snapshot(obj: Any) -> Any:
+    """Copies the tensors of a (nested) state dict to the CPU."""
+    return tree_map(
+        lambda x: x.detach().to("cpu", copy=True) if isinstance(x, torch.Tensor) else x,
+        obj,
+    )
+
+
+def _atomic_write(path: Path, write: Callable[[Path], None]) -> None:
+    """Writes a file through a temporary file, so that it is never left partial."""
+    tmp = path.with_name(path.name + ".tmp")
+    write(tmp)
+    with open(tmp, "rb+") as f:
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _write_pickle(obj: Any) -> Callable[[Path], None]:
+    def write(path):
+        with open(path, "wb") as f:
+            pickle.dump(obj, f)
+
+    return write
+
+
+def _write_tensors(obj: Any) -> Callable[[Path], None]:
+    return lambda path: torch.save(obj, path)
+
+
+def _write_json(obj: Any) -> Callable[[Path], None]:
+    def write(path):
+        with open(path, "w") as f:
+            json.dump(obj, f)
+
+    return write
+
+
+class _SegmentTracker:
+    """Records which segments of a storage were written to.
+
+    Attached to the storage of a replay buffer, it is notified of every write
+    through `mark_update`, like the samplers of the buffer.
+    """
+
+    def __init__(self, segment_size: int):
+        self.segment_size = segment_size
+        self.dirty = set()
+        self.directory = None
+
+    def mark_update(self, index) -> None:
+        if isinstance(index, slice):
+            index = torch.arange(index.start or 0, index.stop, index.step or 1)
+        index = torch.as_tensor(index).reshape(-1)
+        self.dirty.update((index // self.segment_size).unique().tolist())
+
+
+class CheckpointWriter:
+    """Writes checkpoints in a background thread.
+
+    Saving used to block the training loop until the state dicts and the whole
+    replay buffer were on disk. The writer copies the state dicts to the CPU
+    and the changed replay buffer segments, which is fast, and returns while a
+    background thread writes them.
+
+    Training checkpoints written with `save_training` are incremental. The
+    storage of the replay buffer is split into segments of `segment_size`
+    frames, and only the segments written to since the previous checkpoint in
+    the same directory are saved again. A checkpoint is only complete once its
+    `manifest.json` is written. The manifest lists the files of the
+    checkpoint and is atomically replaced as the very last step, so a crash
+    while saving leaves the previous checkpoint loadable.
+
+    Examples:
+        >>> writer = CheckpointWriter()
+        >>> writer.save(model.state_dict(), "1.pth")
+        >>> state_dicts = {"weights": model.state_dict()}
+        >>> writer.save_training("run", 1, state_dicts, replay_buffer=prb)
+        >>> writer.close()
+
+    Args:
+        segment_size: The number of frames in a replay buffer segment.
+        max_pending: The number of checkpoints written concurrently with
+            training before `save` waits for the oldest one.
+    """
+
+    def __init__(self, segment_size: int = 256, max_pending: int = 2):
+        self.segment_size = segment_size
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="checkpoint"
+        )
+        self._pending = []
+        self._trackers = {}
+
+    def _submit(self, fn: Callable, *args) -> Future:
+        # Surfaces the errors of finished writes and bounds the pending copies.
+        while self._pending and (
+            self._pending[0].done() or len(self._pending) >= self.max_pending
+        ):
+            self._pending.pop(0).result()
+        future = self._executor.submit(fn, *args)
+        self._pending.append(future)
+        return future
+
+    def save(self, obj: Any, path: str | os.PathLike) -> Future:
+        """Saves an object with `torch.save` in the background.
+
+        Args:
+            obj: The object to save, e.g. a state dict. Its tensors are copied
+                before returning.
+            path: The file to save to.
+
+        Returns:
+            A future completed once the file is written.
+        """
+        path = Path(path)
+        return self._submit(_atomic_write, path, _write_tensors(_snapshot(obj)))
+
+    def _tracker(self, replay_buffer: ReplayBuffer) -> _SegmentTracker:
+        tracker = self._trackers.get(id(replay_buffer))
+        if tracker is None:
+            tracker = _SegmentTracker(self.segment_size)
+            replay_buffer._storage.attach(tracker)
+            self._trackers[id(replay_buffer)] = tracker
+        return tracker
+
+    def save_training(
+        self,
+        directory: str | os.PathLike,
+        iteration: int,
+        state_dicts: dict[str, dict],
+        meta: dict | None = None,
+        pickles: dict[str, Any] | None = None,
+        replay_buffer: ReplayBuffer | None = None,
+    ) -> Future:
+        """Saves a resumable training checkpoint in the background.
+
+        Args:
+            directory: The directory of the checkpoint.
+            iteration: The training iteration, used in the state dict file
+                names.
+            state_dicts: The state dicts to save, saved as
+                `{name}_Iter_{iteration}.pth`.
+            meta: JSON serializable training metadata, stored in the manifest
+                and in `meta.pkl`.
+            pickles: Additional objects pickled under their file name.
+            replay_buffer: The replay buffer to save incrementally.
+
+        Returns:
+            A future completed once the manifest is written.
+        """
+        directory = Path(directory)
+        state_dicts = {name: _snapshot(sd) for name, sd in state_dicts.items()}
+        # The training loop keeps appending to the metadata lists.
+        meta = copy.deepcopy(meta or {})
+        pickles = copy.deepcopy(pickles or {})
+        replay = None
+        if replay_buffer is not None:
+            replay = self._snapshot_replay_buffer(directory, replay_buffer)
+        return self._submit(
+            self._write_training,
+            directory,
+            iteration,
+            state_dicts,
+            meta,
+            pickles,
+            replay,
+        )
+
+    def _snapshot_replay_buffer(self, directory, replay_buffer) -> dict:
+        # Copies everything the checkpoint needs from the buffer before
+        # returning, so that the background thread only writes files while
+        # the training loop keeps extending the buffer.
+        storage = replay_buffer._storage
+        tracker = self._tracker(replay_buffer)
+        with replay_buffer._replay_lock:
+            length = len(storage)
+            writer_state = replay_buffer._writer.state_dict()
+            incremental = tracker.directory == directory
+            if incremental:
+                dirty = tracker.dirty
+            else:
+                dirty = set(range(-(-length // self.segment_size)))
+            tracker.dirty = set()
+            tracker.directory = directory
+            segments = {}
+            for segment in sorted(dirty):
+                start = segment * self.segment_size
+                stop = min(start + self.segment_size, length)
+                if start < stop:
+                    segments[segment] = storage._storage[start:stop].clone()
+        return {
+            "len": length,
+            "writer": writer_state,
+            "incremental": incremental,
+            "segments": segments,
+            "sampler": _sampler_state(replay_buffer._sampler, length),
+        }
+
+    def _write_training(
+        self, directory, iteration, state_dicts, meta, pickles, replay
+    ) -> None:
+        directory.mkdir(parents=True, exist_ok=True)
+        previous = read_manifest(directory) or {}
+        manifest = {"iteration": iteration, "meta": meta, "files": {}}
+
+        for name, state_dict in state_dicts.items():
+            file = f"{name}_Iter_{iteration}.pth"
+            _atomic_write(directory / file, _write_tensors(state_dict))
+            manifest["files"][name] = file
+        _atomic_write(directory / "meta.pkl", _write_pickle(meta))
+        for file, obj in pickles.items():
+            _atomic_write(directory / file, _write_pickle(obj))
+
+        stale = []
+        if replay is not None:
+            manifest["replay_buffer"], stale = self._write_replay_buffer(
+                directory, iteration, replay, previous
+            )
+
+        _atomic_write(directory / MANIFEST, _write_json(manifest))
+        for file in stale:
+            (directory / file).unlink(missing_ok=True)
+
+    def _write_replay_buffer(self, directory, iteration, replay, previous):
+        previous = previous.get("replay_buffer", {})
+        previous_files = list(previous.get("segments", {}).values())
+        if "sampler" in previous:
+            previous_files.append(previous["sampler"])
+        segments = {}
+        if replay["incremental"]:
+            segments = dict(previous.get("segments", {}))
+
+        (directory / "prb").mkdir(exist_ok=True)
+        for segment, data in replay["segments"].items():
+            file = f"prb/segment_{segment}_{iteration}.pt"
+            _atomic_write(directory / file, _write_tensors(data))
+            segments[str(segment)] = file
+
+        sampler_file = f"prb/sampler_{iteration}.pt"
+        _atomic_write(directory / sampler_file, _write_tensors(replay["sampler"]))
+        referenced = {sampler_file, *segments.values()}
+        stale = [file for file in previous_files if file not in referenced]
+
+        return (
+            {
+                "len": replay["len"],
+                "segment_size": self.segment_size,
+                "segments": segments,
+                "sampler": sampler_file,
+                "writer": replay["writer"],
+            },
+            stale,
+        )
+
+    def wait(self) -> None:
+        """Waits for the pending checkpoints and raises their errors, if any."""
+        while self._pending:
+            self._pending.pop(0).result()
+
+    def close(self) -> None:
+        """Waits for the pending checkpoints and stops the background thread."""
+        self.wait()
+        self._executor.shutdown(wait=True)
+
+
+def _sampler_state(sampler, length: int) -> dict:
+    if isinstance(sampler, PrioritizedSampler):
+        # Outside of the replay lock: every read of a tree is a single call,
+        # and only the first `length` rows were ever written.
+        index = torch.arange(length)
+        return {
+            "_max_priority": sampler._max_priority,
+            "_sum_tree": torch.as_tensor(sampler._sum_tree[index]),
+            "_min_tree": torch.as_tensor(sampler._min_tree[index]),
+        }
+    return _snapshot(sampler.state_dict())
+
+
+def _load_sampler_state(sampler, state: dict) -> None:
+    if isinstance(sampler, PrioritizedSampler):
+        sampler._max_priority = state["_max_priority"]
+        index = torch.arange(len(state["_sum_tree"]))
+        sampler._sum_tree[index] = state["_sum_tree"]
+        sampler._min_tree[index] = state["_min_tree"]
+    else:
+        sampler.load_state_dict(state)
+
+
+def read_manifest(directory: str | os.PathLike) -> dict | None:
+    """Reads the manifest of the last complete checkpoint in a directory.
+
+    Returns:
+        The manifest, or None if no checkpoint was completed in the directory.
+    """
+    path = Path(directory) / MANIFEST
+    if not path.exists():
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def load_replay_buffer(
+    replay_buffer: ReplayBuffer, directory: str | os.PathLike, manifest: dict
+) -> None:
+    """Loads the replay buffer of a checkpoint written by `CheckpointWriter`.
+
+    Args:
+        replay_buffer: The replay buffer to load into, built like the saved one.
+        directory: The directory of the checkpoint.
+        manifest: The manifest of the checkpoint, see `read_manifest`.
+    """
+    directory = Path(directory)
+    state = manifest["replay_buffer"]
+    storage = replay_buffer._storage
+    for segment, file in sorted(state["segments"].items(), key=lambda x: int(x[0])):
+        data = torch.load(directory / file)
+        start = int(segment) * state["segment_size"]
+        # `set` skips the samplers, whose state is loaded below.
+        storage.set(torch.arange(start, start + len(data)), data)
+    storage._len = state["len"]
+    replay_buffer._writer.load_state_dict(state["writer"])
+    _load_sampler_state(
+        replay_buffer._sampler, torch.load(directory / state["sampler"])
+    )
@@ -0,0 +1,205 @@
+from collections import OrderedDict
+from typing import Callable, Iterator, Sequence
+
+import torch
+from tensordict.tensordict import TensorDictBase
+from torchrl.collectors.collectors import DataCollectorBase
+from torchrl.envs import EnvBase, TransformedEnv
+from torchrl.envs.utils import ExplorationType, set_exploration_type
+
+__all__ = ["PipelinedDataCollector"]
+
+
+def _step_async(env: EnvBase, tensordict: TensorDictBase) -> None:
+    """Starts a step on the Unity environment at the bottom of `env`.
+
+    Transforms are inverted here so that the actions reach the base environment
+    exactly as `TransformedEnv.step` would pass them. The step is then completed
+    by a regular `env.step` call, which finds the pending step and collects it.
+    """
+    if isinstance(env, TransformedEnv):
+        tensordict = env.transform.inv(tensordict.clone(False))
+        env = env.base_env
+    env.step_async(tensordict)
+
+
+class PipelinedDataCollector(DataCollectorBase):
+    """Collects data from several in-process Unity environments in a pipeline.
+
+    The environments are visited round-robin. After the policy has picked the
+    actions of one environment, its step is started with `step_async` and the
+    collector moves on to the next environment instead of waiting. The policy
+    forward pass of one environment therefore overlaps with the simulation of
+    the others, and each collected step costs roughly max(simulation, inference)
+    rather than their sum. Steps that are in flight when a batch is yielded keep
+    simulating while the batch is being trained on.
+
+    Every environment must wrap a `UnityWrapper` or `UnityVecEnv`, possibly
+    inside a `TransformedEnv`, and all of them must share the same batch size.
+    Every batch holds the same number of steps of each environment, so
+    `frames_per_batch` is rounded up to a multiple of the number of
+    environments times their batch size.
+
+    The policy runs in this process while the batch is collected, so its
+    weights must not be updated concurrently, e.g. by an `AsyncLearner`.
+
+    Args:
+        create_env_fn: One callable per environment, each returning the
+            environment to collect from. At least two are needed for the
+            simulation and the policy to overlap.
+        policy: The policy used to select actions.
+        frames_per_batch: The number of frames in each yielded batch.
+        total_frames: The total number of frames to collect, or -1 to collect
+            forever.
+        device: The device the collected data is stored on.
+        exploration_mode: The exploration mode to run the policy with.
+        init_random_frames: The number of initial frames collected with random
+            actions instead of the policy.
+    """
+
+    def __init__(
+        self,
+        create_env_fn: Sequence[Callable[[], EnvBase]],
+        policy: Callable[[TensorDictBase], TensorDictBase],
+        *,
+        frames_per_batch: int,
+        total_frames: int = -1,
+        device: str | torch.device | None = None,
+        exploration_mode: str = "random",
+        init_random_frames: int | None = None,
+    ):
+        self.envs = [env_fn() for env_fn in create_env_fn]
+        batch_sizes = {env.batch_size for env in self.envs}
+        if len(batch_sizes) != 1:
+            raise ValueError(
+                f"All environments must share the same batch size, got {batch_sizes}."
+            )
+        self.policy = policy
+        self.frames_per_batch = frames_per_batch
+        self.total_frames = total_frames
+        self.storing_device = torch.device(device) if device is not None else None
+        self.exploration_type = ExplorationType.from_str(exploration_mode)
+        self.init_random_frames = init_random_frames
+        self.get_weights_fn = None
+        self.policy_weights = None
+
+        self._frames = 0
+        self._iter = -1
+        self._traj_count = 0
+        self._shuttles = None
+
+    def _new_traj_ids(self, env: EnvBase, mask: torch.Tensor | None = None):
+        num_new = env.batch_size.numel() if mask is None else int(mask.sum())
+        traj_ids = torch.arange(
+            self._traj_count, self._traj_count + num_new, device=env.device
+        )
+        self._traj_count += num_new
+        return traj_ids
+
+    def _start_env(self, env: EnvBase) -> TensorDictBase:
+        shuttle = env.reset()
+        shuttle.set(
+            ("collector", "traj_ids"),
+            self._new_traj_ids(env).reshape(env.batch_size),
+        )
+        return shuttle
+
+    def _act(self, env: EnvBase, shuttle: TensorDictBase) -> TensorDictBase:
+        if (
+            self.init_random_frames is not None
+            and self._frames < self.init_random_frames
+        ):
+            return env.rand_action(shuttle)
+        return self.policy(shuttle)
+
+    def _end_of_traj(self, env: EnvBase, tensordict: TensorDictBase) -> torch.Tensor:
+        ends = []
+        for key in env.done_keys:
+            key = key if isinstance(key, tuple) else (key,)
+            done = tensordict.get(("next", *key))
+            ends.append(done.reshape(*env.batch_size, -1).any(-1))
+        return torch.stack(ends, dim=0).any(0)
+
+    def _collect_step(self, index: int) -> TensorDictBase:
+        """Completes the pending step of one environment and starts its next one."""
+        env = self.envs[index]
+        shuttle = self._shuttles[index]
+        tensordict, next_shuttle = env.step_and_maybe_reset(shuttle)
+
+        traj_ids = shuttle.get(("collector", "traj_ids")).clone()
+        end_of_traj = self._end_of_traj(env, tensordict)
+        if end_of_traj.any():
+            traj_ids[end_of_traj] = self._new_traj_ids(env, end_of_traj)
+        next_shuttle.set(("collector", "traj_ids"), traj_ids)
+
+        next_shuttle = self._act(env, next_shuttle)
+        _step_async(env, next_shuttle)
+        self._shuttles[index] = next_shuttle
+        return tensordict
+
+    @torch.no_grad()
+    def rollout(self) -> TensorDictBase:
+        """Collects a single batch of `frames_per_batch` frames.
+
+        Returns:
+            The collected frames, of batch size `[num_envs, *env.batch_size, T]`
+            like those of a torchrl collector: one row per environment, with its
+            consecutive steps along the last dimension.
+        """
+        with set_exploration_type(self.exploration_type):
+            if self._shuttles is None:
+                self._shuttles = []
+                for env in self.envs:
+                    shuttle = self._act(env, self._start_env(env))
+                    _step_async(env, shuttle)
+                    self._shuttles.append(shuttle)
+
+            frames_per_step = len(self.envs) * self.envs[0].batch_size.numel()
+            num_steps = -(-self.frames_per_batch // frames_per_step)
+            tensordicts = [[] for _ in self.envs]
+            for _ in range(num_steps):
+                for index, env_tensordicts in enumerate(tensordicts):
+                    tensordict = self._collect_step(index)
+                    if self.storing_device is not None:
+                        tensordict = tensordict.to(self.storing_device)
+                    env_tensordicts.append(tensordict)
+                    self._frames += tensordict.numel()
+        time_dim = len(self.envs[0].batch_size)
+        return torch.stack(
+            [torch.stack(steps, dim=time_dim) for steps in tensordicts], dim=0
+        ).contiguous()
+
+    def iterator(self) -> Iterator[TensorDictBase]:
+        total_frames = self.total_frames
+        while total_frames < 0 or self._frames < total_frames:
+            self._iter += 1
+            yield self.rollout()
+
+    def update_policy_weights_(
+        self, policy_weights: TensorDictBase | None = None
+    ) -> None:
+        # The policy runs in this process and shares the trained weights.
+        pass
+
+    def set_seed(self, seed: int, static_seed: bool = False) -> int:
+        for env in self.envs:
+            env.set_seed(seed, static_seed=static_seed)
+        return seed
+
+    def state_dict(self) -> OrderedDict:
+        return OrderedDict(frames=self._frames, iter=self._iter)
+
+    def load_state_dict(self, state_dict: OrderedDict) -> None:
+        self._frames = state_dict["frames"]
+        self._iter = state_dict["iter"]
+
+    def shutdown(self) -> None:
+        for env in self.envs:
+            if not env.is_closed:
+                env.close()
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}(num_envs={len(self.envs)}, "
+            f"frames_per_batch={self.frames_per_batch})"
+        )
@@ -0,0 +1,130 @@
+from contextvars import ContextVar
+from typing import Iterator
+
+import torch
+import torch._dynamo
+from torch import nn
+
+__all__ = ["EmbeddingCache", "encode"]
+
+_active_cache: ContextVar["EmbeddingCache | None"] = ContextVar(
+    "active_embedding_cache", default=None
+)
+
+
+def encode(encoder: nn.Module, obs: torch.Tensor) -> torch.Tensor:
+    """Encodes a batch of observations, through the active cache if any.
+
+    The policy networks call this instead of `encoder(obs)`, so that the
+    networks of a loss share the embeddings of the batch it is called on.
+
+    Args:
+        encoder: The encoder, with the parameters of the calling network.
+        obs: The observations.
+
+    Returns:
+        The embeddings.
+    """
+    cache = _active_cache.get()
+    if cache is None:
+        return encoder(obs)
+    return cache(encoder, obs)
+
+
+def _weights(encoder: nn.Module) -> Iterator[torch.Tensor]:
+    for module in encoder.modules():
+        yield from module._parameters.values()
+        # The functional losses set detached parameters as plain attributes.
+        for value in vars(module).values():
+            if isinstance(value, torch.Tensor):
+                yield value
+
+
+class EmbeddingCache:
+    """Shares the embeddings of a batch between the networks of a loss.
+
+    The actor, the critic and the feedback model share one encoder, yet each
+    of their calls encodes the observations again. The DDPG loss encodes the
+    observations of a batch three times, twice with the online parameters and
+    once with their detached copy, and the next observations twice, with the
+    detached online parameters and with the target parameters.
+
+    While the cache is active, `encode` keys every embedding on the memory,
+    shape and version of the observations and on the memory and version of
+    the parameters of the encoder. A call with the same parameters, or with
+    their detached copy, reuses the embedding, detached when no gradient is
+    needed. The embedding of the online networks is part of both of their
+    graphs, so its gradient is the sum of the gradients of the two losses, as
+    before. With `encode_next_once`, a call that needs no gradient also reuses
+    an embedding of the same observations computed with other parameters, so
+    the target networks use the embedding of the online encoder and the next
+    observations are encoded once.
+
+    The cache is emptied when it is exited, after every update. Calls under
+    `vmap`, like the Q-value ensemble of SAC, and under `torch.compile` are
+    not cached. A reused embedding shares the random shift of the `Encoder`
+    and its batch norm statistics are updated once.
+
+    Examples:
+        >>> embedding_cache = EmbeddingCache(encode_next_once=True)
+        >>> with embedding_cache:
+        ...     loss_td = loss_module(sampled_tensordict)
+
+    Args:
+        encode_next_once: Whether the calls without gradient reuse the
+            embeddings computed with other parameters.
+    """
+
+    def __init__(self, encode_next_once: bool = False):
+        self.encode_next_once = encode_next_once
+        self._entries = {}
+        self._token = None
+
+    def __enter__(self) -> "EmbeddingCache":
+        self._token = _active_cache.set(self)
+        return self
+
+    def __exit__(self, *exc) -> None:
+        _active_cache.reset(self._token)
+        self._token = None
+        self.clear()
+
+    def clear(self) -> None:
+        """Drops the cached embeddings."""
+        self._entries.clear()
+
+    def __call__(self, encoder: nn.Module, obs: torch.Tensor) -> torch.Tensor:
+        weights = list(_weights(encoder))
+        if torch._dynamo.is_compiling() or any(
+            torch._C._functorch.is_functorch_wrapped_tensor(tensor)
+            for tensor in (obs, *weights)
+        ):
+            return encoder(obs)
+
+        obs_key = (
+            obs.data_ptr(),
+            obs._version,
+            obs.shape,
+            obs.stride(),
+            obs.dtype,
+            obs.device,
+        )
+        weights_key = (
+            encoder.training,
+            tuple(sorted((w.data_ptr(), w._version) for w in weights)),
+        )
+        requires_grad = torch.is_grad_enabled() and (
+            obs.requires_grad or any(w.requires_grad for w in weights)
+        )
+        # The observations are kept with their embeddings so that their memory,
+        # and thus the key, is not reused by another tensor.
+        entries = self._entries.setdefault(obs_key, (obs, []))[1]
+        for key, embedding in entries:
+            if key == weights_key and (embedding.requires_grad or not requires_grad):
+                return embedding if requires_grad else embedding.detach()
+        if entries and self.encode_next_once and not requires_grad:
+            return entries[0][1].detach()
+
+        embedding = encoder(obs)
+        entries.append((weights_key, embedding))
+        return embedding
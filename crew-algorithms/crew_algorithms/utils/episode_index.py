@@ -0,0 +1,144 @@
+from typing import Iterable
+
+import torch
+from sortedcontainers import SortedList
+from torchrl.data.replay_buffers import ReplayBuffer
+
+__all__ = ["EpisodeIndex"]
+
+
+class EpisodeIndex:
+    """Indexes the rows of a replay buffer by trajectory id and time stamp.
+
+    Finding the samples of a trajectory or of a time window used to mean
+    reading the whole column from the storage and comparing every row. The
+    index is attached to the storage of the buffer and, like its samplers, is
+    notified of every write, at which point it reads the trajectory id and the
+    time stamp of the written rows only. It keeps the rows of every trajectory
+    in write order and the rows sorted by time stamp, so the rows of a set of
+    trajectories are found in time proportional to their number, and those of a
+    time window in logarithmic time plus their number. Overwritten rows are
+    removed from their previous trajectory and time.
+
+    The index is updated by the thread extending the buffer and should be
+    queried from that thread.
+
+    Examples:
+        >>> index = EpisodeIndex(prb)
+        >>> prb.extend(data)
+        >>> recent = prb[index.rows_between(time_stamp - 3)]
+        >>> held_out = index.rows([t for t in index.trajectories() if t % 5 == 4])
+
+    Args:
+        replay_buffer: The replay buffer to index.
+        traj_key: The key of the trajectory ids.
+        time_key: The key of the time stamps.
+    """
+
+    def __init__(
+        self,
+        replay_buffer: ReplayBuffer,
+        traj_key: tuple[str, ...] = ("collector", "traj_ids"),
+        time_key: str | tuple[str, ...] = "time_stamp",
+    ):
+        self._storage = replay_buffer._storage
+        self.traj_key = traj_key
+        self.time_key = time_key
+        self._row_traj = {}
+        self._row_time = {}
+        self._trajs = {}
+        self._times = SortedList()
+        self._storage.attach(self)
+
+    def _column(self, key, index: torch.Tensor) -> list | None:
+        if not self._storage.initialized:
+            return None
+        stored = self._storage._storage
+        # Tensordict replay buffers store the data under "_data".
+        if "_data" in stored.keys():
+            stored = stored.get("_data")
+        column = stored.get(key, None)
+        if column is None:
+            return None
+        return column[index].reshape(len(index), -1)[:, 0].tolist()
+
+    def mark_update(self, index) -> None:
+        if isinstance(index, slice):
+            index = torch.arange(index.start or 0, index.stop, index.step or 1)
+        index = torch.as_tensor(index).reshape(-1)
+        rows = index.tolist()
+        traj_ids = self._column(self.traj_key, index) or [None] * len(rows)
+        times = self._column(self.time_key, index) or [None] * len(rows)
+        for row, traj_id, time in zip(rows, traj_ids, times):
+            self._remove(row)
+            if traj_id is not None:
+                self._row_traj[row] = traj_id
+                # Dictionaries keep the rows in write order.
+                self._trajs.setdefault(traj_id, {})[row] = None
+            if time is not None:
+                self._row_time[row] = time
+                self._times.add((time, row))
+
+    def _remove(self, row: int) -> None:
+        traj_id = self._row_traj.pop(row, None)
+        if traj_id is not None:
+            rows = self._trajs[traj_id]
+            del rows[row]
+            if not rows:
+                del self._trajs[traj_id]
+        time = self._row_time.pop(row, None)
+        if time is not None:
+            self._times.remove((time, row))
+
+    def rebuild(self) -> None:
+        """Indexes the whole storage again, e.g. after loading it from disk."""
+        self._row_traj.clear()
+        self._row_time.clear()
+        self._trajs.clear()
+        self._times.clear()
+        if not len(self._storage):
+            return
+        rows = torch.arange(len(self._storage))
+        times = self._column(self.time_key, rows)
+        if times is not None:
+            # Restores the write order of the rows, which wraps around.
+            rows = rows[torch.tensor(times).argsort(stable=True)]
+        self.mark_update(rows)
+
+    def trajectories(self) -> list:
+        """Returns the ids of the trajectories in the buffer."""
+        return list(self._trajs)
+
+    def rows(self, traj_ids) -> torch.Tensor:
+        """Returns the rows of one or several trajectories.
+
+        Args:
+            traj_ids: A trajectory id or an iterable of trajectory ids.
+
+        Returns:
+            The rows of every trajectory in write order, one trajectory after
+            the other.
+        """
+        if not isinstance(traj_ids, Iterable):
+            traj_ids = [traj_ids]
+        rows = []
+        for traj_id in traj_ids:
+            rows.extend(self._trajs.get(traj_id, ()))
+        return torch.tensor(rows, dtype=torch.long)
+
+    def rows_between(
+        self, start: float | None = None, stop: float | None = None
+    ) -> torch.Tensor:
+        """Returns the rows with a time stamp in `[start, stop)`, sorted by time.
+
+        Args:
+            start: The earliest time stamp, or None for no lower bound.
+            stop: The time stamp after the window, or None for no upper bound.
+        """
+        minimum = None if start is None else (start, -1)
+        maximum = None if stop is None else (stop, -1)
+        items = self._times.irange(minimum, maximum, inclusive=(True, False))
+        return torch.tensor([row for _, row in items], dtype=torch.long)
+
+    def __len__(self) -> int:
+        return max(len(self._row_traj), len(self._row_time))
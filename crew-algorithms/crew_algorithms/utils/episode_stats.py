@@ -0,0 +1,102 @@
+import torch
+
+__all__ = ["EpisodeStatistics"]
+
+
+class EpisodeStatistics:
+    """Accumulates per-episode sums and smooths them over recent episodes.
+
+    The values of a batch are summed per trajectory id with a single scatter-add,
+    so updating costs one device synchronization per batch rather than one per
+    frame. An episode is finished once a frame with a larger trajectory id has
+    been seen, at which point its sums move into a fixed-size ring of the last
+    `window` finished episodes, so the smoothed values take constant time no
+    matter how long the run is.
+
+    Examples:
+        >>> stats = EpisodeStatistics(["reward", "feedback"], window=100)
+        >>> finished = stats.update(traj_ids, reward=rewards, feedback=feedbacks)
+        >>> if finished:
+        ...     logger.log_scalar("avg_episode_reward", stats.mean("reward"))
+
+    Args:
+        names: The names of the values summed over an episode.
+        window: The number of finished episodes the statistics are smoothed over.
+    """
+
+    def __init__(self, names: list[str], window: int = 100):
+        self.names = list(names)
+        self.window = window
+        self._index = {name: i for i, name in enumerate(self.names)}
+        self._ring = torch.zeros(window, len(self.names), dtype=torch.float64)
+        self._num_finished = 0
+        self._open = {}
+        self._latest_id = None
+
+    def update(
+        self, traj_ids: torch.Tensor, **values: torch.Tensor
+    ) -> dict[int, dict[str, float]]:
+        """Adds the values of a batch of frames to their episodes.
+
+        Args:
+            traj_ids: The trajectory id of every frame.
+            **values: For every name, the value of every frame, with the same
+                number of elements as `traj_ids`.
+
+        Returns:
+            The sums of the episodes finished by this batch, keyed on their
+            trajectory id.
+        """
+        traj_ids = traj_ids.reshape(-1).long()
+        stacked = torch.stack(
+            [values[name].reshape(-1).to(torch.float64) for name in self.names],
+            dim=-1,
+        )
+        ids, inverse = torch.unique(traj_ids, return_inverse=True)
+        sums = torch.zeros(
+            len(ids), len(self.names), dtype=torch.float64, device=stacked.device
+        ).index_add_(0, inverse, stacked)
+        # A single transfer for the whole batch.
+        ids, sums = ids.tolist(), sums.cpu()
+
+        for traj_id, episode_sums in zip(ids, sums):
+            if traj_id in self._open:
+                self._open[traj_id] += episode_sums
+            else:
+                self._open[traj_id] = episode_sums
+        if self._latest_id is None or ids[-1] > self._latest_id:
+            self._latest_id = ids[-1]
+
+        finished_ids = sorted(i for i in self._open if i < self._latest_id)
+        if not finished_ids:
+            return {}
+        finished = torch.stack([self._open.pop(i) for i in finished_ids])
+        recent = finished[-self.window :]
+        self._num_finished += len(finished)
+        slots = (
+            torch.arange(self._num_finished - len(recent), self._num_finished)
+            % self.window
+        )
+        self._ring[slots] = recent
+        return {
+            traj_id: dict(zip(self.names, episode_sums.tolist()))
+            for traj_id, episode_sums in zip(finished_ids, finished)
+        }
+
+    @property
+    def num_finished(self) -> int:
+        """The number of episodes finished so far."""
+        return self._num_finished
+
+    def _recent(self, name: str) -> torch.Tensor:
+        return self._ring[: min(self._num_finished, self.window), self._index[name]]
+
+    def mean(self, name: str) -> float:
+        """The mean sum of `name` over the recent finished episodes."""
+        recent = self._recent(name)
+        return recent.mean().item() if len(recent) else float("nan")
+
+    def success_rate(self, name: str = "reward") -> float:
+        """The fraction of the recent finished episodes with a positive `name`."""
+        recent = self._recent(name)
+        return (recent > 0).double().mean().item() if len(recent) else float("nan")
@@ -0,0 +1,278 @@
+from typing import Callable, Sequence
+
+import torch
+from crew_algorithms.envs.configs import EnvironmentConfig
+from crew_algorithms.utils.template_matching import TemplateMatcher
+from PIL import Image
+from tensordict import TensorDictBase
+from torchvision import transforms
+
+__all__ = [
+    "FEEDBACK_PROVIDERS",
+    "BowlingFeedback",
+    "FeedbackProvider",
+    "TreasureFeedback",
+    "WildfireFeedback",
+    "make_feedback_provider",
+    "register_feedback_provider",
+]
+
+FEEDBACK_PROVIDERS: dict[str, type["FeedbackProvider"]] = {}
+"""The feedback provider of every environment, keyed on its name."""
+
+
+def register_feedback_provider(
+    *names: str,
+) -> Callable[[type["FeedbackProvider"]], type["FeedbackProvider"]]:
+    """Registers a feedback provider for the environments with the given names.
+
+    Examples:
+        >>> @register_feedback_provider("tetris")
+        ... class TetrisFeedback(FeedbackProvider):
+        ...     in_keys = [("agents", "observation", "obs_1")]
+        ...
+        ...     def forward(self, td):
+        ...         ...
+
+    Args:
+        names: The `EnvironmentConfig.name` of every environment the provider
+            gives feedback for.
+    """
+
+    def register(cls: type["FeedbackProvider"]) -> type["FeedbackProvider"]:
+        for name in names:
+            if name in FEEDBACK_PROVIDERS:
+                raise ValueError(f"A feedback provider for {name} already exists.")
+            FEEDBACK_PROVIDERS[name] = cls
+        return cls
+
+    return register
+
+
+def make_feedback_provider(
+    env_cfg: EnvironmentConfig, device: torch.device, **kwargs
+) -> "FeedbackProvider | None":
+    """Makes the heuristic feedback provider of an environment.
+
+    Args:
+        env_cfg: The environment configuration.
+        device: The device the feedback is computed on.
+        kwargs: Passed to the provider.
+
+    Returns:
+        The provider, or None if no provider is registered for the environment.
+    """
+    cls = FEEDBACK_PROVIDERS.get(env_cfg.name)
+    if cls is None:
+        return None
+    return cls(env_cfg, device, **kwargs)
+
+
+class FeedbackProvider:
+    """A hardcoded heuristic that gives synthetic feedback on collected transitions.
+
+    A provider declares the entries of a batch of transitions it reads in
+    `in_keys`. Only those are moved to `device`, where `forward` computes the
+    feedback of the whole batch at once with tensor operations.
+
+    Args:
+        env_cfg: The environment configuration.
+        device: The device the feedback is computed on.
+    """
+
+    in_keys: Sequence[str | tuple[str, ...]] = ()
+
+    def __init__(self, env_cfg: EnvironmentConfig, device: torch.device):
+        self.env_cfg = env_cfg
+        self.device = device
+
+    def forward(self, td: TensorDictBase) -> torch.Tensor:
+        """Returns the feedback of a batch holding the `in_keys` only."""
+        raise NotImplementedError
+
+    def __call__(self, td: TensorDictBase) -> torch.Tensor:
+        """Returns the feedback of a batch of transitions.
+
+        Args:
+            td: The transitions, e.g. a batch of collected data.
+
+        Returns:
+            The feedback, shaped like the reward of every agent.
+        """
+        return self.forward(td.select(*self.in_keys).to(self.device))
+
+
+@register_feedback_provider("find_treasure", "hide_and_seek_1v1")
+class TreasureFeedback(FeedbackProvider):
+    """The heuristic feedback of FindTreasure and 1v1 Hide and Seek.
+
+    Provides positive feedback for moving closer to the treasure, negative
+    feedback for moving away from the treasure, and positive feedback for
+    exploring new areas. The treasure, or the hider, is in view when its
+    template matches the newest frame.
+
+    Args:
+        env_cfg: The environment configuration.
+        device: The device the feedback is computed on.
+        threshold: The threshold for the treasure detection.
+        scales: The scales the treasure template is matched at.
+    """
+
+    in_keys = [
+        ("agents", "observation", "obs_0"),
+        ("agents", "observation", "obs_1"),
+        ("next", "agents", "observation", "obs_0"),
+        ("next", "agents", "observation", "obs_1"),
+    ]
+    agent_dims = slice(6, 9)
+    """The position of the player in the vector observation."""
+    treasure_dims = slice(12, 15)
+    """The position of the treasure in the vector observation."""
+
+    def __init__(
+        self,
+        env_cfg: EnvironmentConfig,
+        device: torch.device,
+        threshold: float = 0.95,
+        scales: Sequence[float] = (1.0,),
+    ):
+        super().__init__(env_cfg, device)
+        template = transforms.ToTensor()(Image.open(env_cfg.target_img))
+        self.template = template.unsqueeze(0).to(device)
+        self.matcher = TemplateMatcher(self.template, threshold, scales)
+        self.threshold = threshold
+
+    def distance(self, obs_1: torch.Tensor) -> torch.Tensor:
+        """Returns the squared distance of the player to the treasure.
+
+        The height is ignored. The distance has the shape of the batch and of
+        the agents, e.g. `[N, 1]`.
+        """
+        offset = (
+            obs_1[..., -1, self.agent_dims] - obs_1[..., -1, self.treasure_dims]
+        ) ** 2
+        offset[..., 1] = 0
+        return offset.mean(dim=-1)
+
+    def moved_closer(self, td: TensorDictBase) -> torch.Tensor:
+        current_distance = self.distance(td["agents", "observation", "obs_1"])
+        next_distance = self.distance(td["next", "agents", "observation", "obs_1"])
+        # Drops the single agent, like the frames of `forward`.
+        return ((current_distance - next_distance) / 10).squeeze(-1)
+
+    def explored(self, f_current: torch.Tensor, f_next: torch.Tensor) -> torch.Tensor:
+        non_black_current = (f_current > 0).float().sum(dim=(1, 2, 3))
+        non_black_next = (f_next > 0).float().sum(dim=(1, 2, 3))
+        return (non_black_next - non_black_current - 300) / 1000
+
+    def forward(self, td: TensorDictBase) -> torch.Tensor:
+        num_channels = self.env_cfg.num_channels
+        f_current = td["agents", "observation", "obs_0"].squeeze(1)[:, -num_channels:]
+        f_next = td["next", "agents", "observation", "obs_0"].squeeze(1)[
+            :, -num_channels:
+        ]
+
+        # Shares the matches of the frames that are both a next and a current frame.
+        treasure_in_view, treasure_in_next = self.matcher.match_transitions(
+            f_current, f_next
+        )
+
+        feedback = (
+            treasure_in_view.float() * self.moved_closer(td)
+            + (~treasure_in_view).float() * self.explored(f_current, f_next)
+            + (treasure_in_next.float() - treasure_in_view.float()) * 3
+        )
+        return feedback.unsqueeze(-1).unsqueeze(-1)
+
+
+@register_feedback_provider("bowling")
+class BowlingFeedback(FeedbackProvider):
+    """The heuristic feedback of Bowling.
+
+    The vector observation holds the position of the ball, followed by whether
+    every pin is standing and its position. Provides positive feedback for
+    knocking pins down, and for moving the ball closer to the pins still
+    standing, and negative feedback for moving it away from them.
+
+    Args:
+        env_cfg: The environment configuration.
+        device: The device the feedback is computed on.
+        pin_scale: The feedback for every pin knocked down.
+    """
+
+    in_keys = [
+        ("agents", "observation", "obs_1"),
+        ("next", "agents", "observation", "obs_1"),
+    ]
+
+    def __init__(
+        self, env_cfg: EnvironmentConfig, device: torch.device, pin_scale: float = 0.3
+    ):
+        super().__init__(env_cfg, device)
+        self.pin_scale = pin_scale
+
+    def state(self, obs_1: torch.Tensor) -> tuple[torch.Tensor, torch.Tensor]:
+        """Splits the newest state into the ball and the pins.
+
+        Returns:
+            The position of the ball and the `[standing, x, y]` of every pin.
+        """
+        state = obs_1[
+            ..., -1, self.env_cfg.state_start_dim : self.env_cfg.state_end_dim
+        ]
+        return state[..., :2], state[..., 2:].unflatten(-1, (-1, 3))
+
+    def forward(self, td: TensorDictBase) -> torch.Tensor:
+        ball, pins = self.state(td["agents", "observation", "obs_1"])
+        next_ball, next_pins = self.state(td["next", "agents", "observation", "obs_1"])
+
+        # The distance of the ball to the pins standing before the step.
+        standing = pins[..., 0]
+        count = standing.sum(dim=-1, keepdim=True).clamp_min(1)
+        target = (pins[..., 1:] * standing.unsqueeze(-1)).sum(dim=-2) / count
+        current_distance = (ball - target).pow(2).mean(dim=-1, keepdim=True)
+        next_distance = (next_ball - target).pow(2).mean(dim=-1, keepdim=True)
+        moved_closer = (current_distance - next_distance) / 10
+        moved_closer = moved_closer * (standing.sum(dim=-1, keepdim=True) > 0)
+
+        knocked_down = (
+            (standing - next_pins[..., 0]).clamp_min(0).sum(dim=-1, keepdim=True)
+        )
+        return moved_closer + knocked_down * self.pin_scale
+
+
+@register_feedback_provider("wildfire")
+class WildfireFeedback(FeedbackProvider):
+    """The heuristic feedback of Wildfire.
+
+    The first row of the observation holds the game data, whose fourth entry
+    is the score of the team. Every agent gets the increase of the score as
+    feedback.
+
+    Args:
+        env_cfg: The environment configuration.
+        device: The device the feedback is computed on.
+        score_scale: The feedback for every point scored.
+    """
+
+    in_keys = [
+        ("agents", "observation", "obs_0"),
+        ("next", "agents", "observation", "obs_0"),
+    ]
+    score_dim = 3
+    """The score in the game data."""
+
+    def __init__(
+        self,
+        env_cfg: EnvironmentConfig,
+        device: torch.device,
+        score_scale: float = 1.0,
+    ):
+        super().__init__(env_cfg, device)
+        self.score_scale = score_scale
+
+    def forward(self, td: TensorDictBase) -> torch.Tensor:
+        obs = td["agents", "observation", "obs_0"]
+        next_obs = td["next", "agents", "observation", "obs_0"]
+        scored = next_obs[..., 0, self.score_dim] - obs[..., 0, self.score_dim]
+        return (scored * self.score_scale)[..., None, None].expand(*obs.shape[:-1], 1)
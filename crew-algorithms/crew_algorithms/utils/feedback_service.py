@@ -0,0 +1,201 @@
+import copy
+
+import torch
+from crew_algorithms.auto_encoder.model import Encoder
+from tensordict import TensorDictBase
+from tensordict.utils import NestedKey
+from torch import nn
+from torchrl.data.replay_buffers import ReplayBuffer
+
+__all__ = ["FeedbackModelService"]
+
+
+class FeedbackModelService:
+    """Trains and runs a learned feedback model on embeddings of a frozen encoder.
+
+    The feedback model is a network with an `encoder`, shared with the critic,
+    and an `mlp` head on the embeddings of the observation and the action. The
+    service takes a frozen copy of the encoder, so that the updates of the
+    critic neither change the inputs of a trained head nor go through the
+    feedback loss, and only trains the head.
+
+    The embeddings of the rows of the replay buffer are computed once, a chunk
+    at a time, and cached along with the action and the feedback of every row.
+    Like the samplers of the buffer, the service is attached to its storage and
+    drops the rows that are overwritten. The head is then trained on large
+    batches of cached rows without reading the observations or running the
+    encoder again. `predict` scores a batch of transitions, e.g. the batch of
+    a collector, in one pass of the encoder.
+
+    Examples:
+        >>> service = FeedbackModelService(feedback_model, prb, device)
+        >>> train_rows = service.cache_rows(episode_index.rows(train_trajs))
+        >>> loss = service.train(train_rows)
+        >>> data["next", "agents", "reward"] += service.predict(data)
+
+    Args:
+        model: The feedback model, with `encoder`, `mlp` and `num_channels`
+            attributes like a `ContinuousQValueNet`.
+        replay_buffer: The replay buffer the feedback model is trained on.
+        device: The device the model runs on.
+        lr: The learning rate of the head.
+        batch_size: The number of rows of every training step.
+        chunk_size: The number of rows read from the buffer and encoded at once.
+        obs_key: The observation the feedback is predicted from.
+        action_key: The action the feedback is predicted from.
+        feedback_key: The feedback to predict.
+    """
+
+    def __init__(
+        self,
+        model: nn.Module,
+        replay_buffer: ReplayBuffer,
+        device: torch.device,
+        lr: float = 1e-4,
+        batch_size: int = 256,
+        chunk_size: int = 128,
+        obs_key: NestedKey = ("next", "agents", "observation", "obs_0"),
+        action_key: NestedKey = ("agents", "action"),
+        feedback_key: NestedKey = ("next", "agents", "feedback"),
+    ):
+        self.model = model
+        self.replay_buffer = replay_buffer
+        self.device = device
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+        self.obs_key = obs_key
+        self.action_key = action_key
+        self.feedback_key = feedback_key
+        self.optimizer = torch.optim.Adam(model.mlp.parameters(), lr=lr)
+
+        self._storage = replay_buffer._storage
+        self._features = None
+        self._feedback = None
+        self._cached = torch.zeros(self._storage.max_size, dtype=torch.bool)
+        self.refresh_encoder()
+        self._storage.attach(self)
+
+    def refresh_encoder(self) -> None:
+        """Takes a new frozen copy of the shared encoder and empties the cache."""
+        self.encoder = copy.deepcopy(self.model.encoder).eval().requires_grad_(False)
+        self._cached.zero_()
+
+    def mark_update(self, index) -> None:
+        if isinstance(index, slice):
+            index = torch.arange(index.start or 0, index.stop, index.step or 1)
+        self._cached[torch.as_tensor(index).reshape(-1)] = False
+
+    @torch.no_grad()
+    def _encode(self, obs: torch.Tensor) -> torch.Tensor:
+        bs = obs.shape[0]
+        if len(obs.shape) == 5:
+            obs = obs.squeeze(1)
+        num_channels = self.model.num_channels
+        if num_channels is not None:
+            obs = obs.reshape(-1, num_channels, obs.shape[-2], obs.shape[-1])
+        if isinstance(self.encoder, Encoder):
+            # Skips the random shift of the training batches of the encoder.
+            embeddings = self.encoder.fc(self.encoder.cnn(obs))
+        else:
+            embeddings = self.encoder(obs)
+        return embeddings.flatten(1).view(bs, -1)
+
+    def features(self, td: TensorDictBase) -> torch.Tensor:
+        """Returns the input of the head for a batch of transitions.
+
+        Args:
+            td: The transitions.
+
+        Returns:
+            The embedding of the observation of every transition followed by
+            its action, of shape `[B, D]`.
+        """
+        chunks = []
+        for start in range(0, len(td), self.chunk_size):
+            chunk = td[start : start + self.chunk_size]
+            obs = chunk.get(self.obs_key).to(self.device)
+            action = chunk.get(self.action_key).to(self.device)
+            chunks.append(
+                torch.cat([self._encode(obs), action.reshape(len(chunk), -1)], -1)
+            )
+        return torch.cat(chunks)
+
+    def predict(self, td: TensorDictBase) -> torch.Tensor:
+        """Predicts the feedback of a batch of transitions.
+
+        Args:
+            td: The transitions, e.g. a batch of a collector.
+
+        Returns:
+            The feedback, of shape `[B, 1, 1]`.
+        """
+        with torch.inference_mode():
+            return self.model.mlp(self.features(td)).unsqueeze(1)
+
+    def cache_rows(
+        self, rows: torch.Tensor, feedback_only: bool = True
+    ) -> torch.Tensor:
+        """Caches the features and the feedback of rows of the replay buffer.
+
+        Args:
+            rows: The rows.
+            feedback_only: Whether to only keep the rows with nonzero feedback.
+
+        Returns:
+            The rows that are cached, e.g. to train or validate on.
+        """
+        rows = torch.as_tensor(rows, dtype=torch.long).reshape(-1)
+        missing = rows[~self._cached[rows]].unique()
+        for start in range(0, len(missing), self.chunk_size):
+            chunk = missing[start : start + self.chunk_size]
+            td = self.replay_buffer[chunk]
+            features = self.features(td)
+            feedback = td.get(self.feedback_key).to(self.device)
+            if self._features is None:
+                self._features = features.new_zeros(
+                    self._storage.max_size, features.shape[-1]
+                )
+                self._feedback = feedback.new_zeros(
+                    self._storage.max_size, *feedback.shape[1:]
+                )
+            self._features[chunk.to(self.device)] = features
+            self._feedback[chunk.to(self.device)] = feedback
+            self._cached[chunk] = True
+        if feedback_only and self._feedback is not None:
+            nonzero = self._feedback[rows.to(self.device)].reshape(len(rows), -1)
+            rows = rows[(nonzero != 0).any(dim=-1).cpu()]
+        return rows
+
+    def _loss(self, rows: torch.Tensor) -> torch.Tensor:
+        rows = rows.to(self.device)
+        predicted = self.model.mlp(self._features[rows]).unsqueeze(1)
+        return (predicted - self._feedback[rows]).pow(2).mean()
+
+    def train(self, rows: torch.Tensor, num_steps: int = 20) -> float:
+        """Trains the head on random batches of cached rows.
+
+        Args:
+            rows: The rows, as returned by `cache_rows`.
+            num_steps: The number of gradient steps.
+
+        Returns:
+            The mean training loss.
+        """
+        total = 0.0
+        for _ in range(num_steps):
+            batch = rows[torch.randint(len(rows), (self.batch_size,))]
+            loss = self._loss(batch)
+            self.optimizer.zero_grad()
+            loss.backward()
+            self.optimizer.step()
+            total += loss.item()
+        return total / num_steps
+
+    @torch.no_grad()
+    def evaluate(self, rows: torch.Tensor) -> float:
+        """Returns the mean squared error of the head on cached rows."""
+        total = 0.0
+        for start in range(0, len(rows), self.batch_size):
+            batch = rows[start : start + self.batch_size]
+            total += self._loss(batch).item() * len(batch)
+        return total / max(len(rows), 1)
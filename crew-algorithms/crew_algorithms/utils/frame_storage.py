@@ -0,0 +1,206 @@
+from collections import OrderedDict
+from warnings import warn
+
+import torch
+from tensordict import TensorDict, TensorDictBase, is_tensor_collection
+from torchrl.data import LazyMemmapStorage
+
+__all__ = ["FrameStackStorage"]
+
+
+def _to_uint8(pixels: torch.Tensor) -> torch.Tensor:
+    return pixels.mul(255).round_().clamp_(0, 255).to(torch.uint8)
+
+
+def _to_float(pixels: torch.Tensor) -> torch.Tensor:
+    return pixels.to(torch.float32).div_(255)
+
+
+class FrameStackStorage(LazyMemmapStorage):
+    """A memory-mapped storage that keeps image frames once, as uint8.
+
+    The image observations of the trainers are float stacks of the last
+    `num_stacks` frames, concatenated along dim -3 by `CatFrames`, and the
+    same frames are stored again, shifted by one step, under "next". This
+    storage keeps the pixels as uint8 and rebuilds both stacks when the
+    buffer is sampled:
+
+    * With `link_frames`, every row only stores the newest frame of its
+      observation and of its next observation. The older frames of a stack
+      are read from the rows of the previous steps of the same trajectory,
+      which each row links to. This takes 12 times less space than the two
+      float stacks with 3 stacks of 3 channels. The rows of a trajectory must
+      be written in order, as the off-policy trainers do. When the previous
+      steps of a row were not written, or were already overwritten, as for
+      the oldest rows of the buffer, the stack is padded with the oldest frame
+      that could be linked, like at the start of an episode.
+    * Without `link_frames`, every row stores its observation stack and the
+      newest frame of its next observation, which is exact in any write order.
+
+    Pixels are rounded to multiples of 1/255, which is how they were captured.
+    Other entries are stored unchanged.
+
+    Args:
+        max_size: The number of rows of the storage.
+        num_channels: The number of channels of a single frame.
+        num_stacks: The number of frames in an observation.
+        obs_key: The key of the image observations.
+        traj_key: The key of the trajectory ids, used to link the rows of a
+            trajectory.
+        link_frames: Whether to read the older frames of a stack from the
+            previous rows of the trajectory.
+        scratch_dir: The directory of the memory-mapped files.
+        device: The device of the sampled data.
+    """
+
+    _max_tracked_trajs = 256
+
+    def __init__(
+        self,
+        max_size: int,
+        num_channels: int = 3,
+        num_stacks: int = 3,
+        obs_key: tuple[str, ...] = ("agents", "observation", "obs_0"),
+        traj_key: tuple[str, ...] = ("collector", "traj_ids"),
+        link_frames: bool = True,
+        scratch_dir=None,
+        device: str = "cpu",
+    ):
+        super().__init__(max_size, scratch_dir=scratch_dir, device=device)
+        self.num_channels = num_channels
+        self.num_stacks = num_stacks
+        self.obs_key = obs_key
+        self.traj_key = traj_key
+        self.link_frames = link_frames and num_stacks > 1
+        self._last = OrderedDict()
+        self._next_uid = None
+        self._warned = False
+
+    @staticmethod
+    def _root(data: TensorDictBase) -> tuple[str, ...]:
+        # Tensordict replay buffers store the data under "_data".
+        return ("_data",) if "_data" in data.keys() else ()
+
+    def _stored_frames(self) -> TensorDictBase:
+        return self._storage.get(self._root(self._storage) + ("_frames",))
+
+    def set(self, cursor, data):
+        if not is_tensor_collection(data):
+            return super().set(cursor, data)
+        root = self._root(data)
+        if root + self.obs_key not in data.keys(include_nested=True):
+            return super().set(cursor, data)
+        if isinstance(cursor, int):
+            cursor, data = torch.tensor([cursor]), data.unsqueeze(0)
+        cursor = torch.as_tensor(cursor).reshape(-1)
+
+        c = self.num_channels
+        obs = _to_uint8(data.get(root + self.obs_key))
+        frames = {}
+        next_obs = data.get(root + ("next",) + self.obs_key, None)
+        if next_obs is not None:
+            frames["next_frame"] = _to_uint8(next_obs[..., -c:, :, :])
+        if self.link_frames:
+            frames["frame"] = obs[..., -c:, :, :]
+            frames["uid"], frames["prev"], frames["prev_uid"] = self._link(
+                cursor, obs, data.get(root + self.traj_key, None)
+            )
+        else:
+            frames["obs"] = obs
+
+        compact = data.exclude(root + self.obs_key, root + ("next",) + self.obs_key)
+        compact.set(root + ("_frames",), TensorDict(frames, batch_size=cursor.shape))
+        return super().set(cursor, compact)
+
+    def _link(
+        self, cursor: torch.Tensor, obs: torch.Tensor, traj_ids: torch.Tensor | None
+    ) -> tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        """Links every row to the row of the previous step of its trajectory."""
+        if self._next_uid is None:
+            # Keeps the ids unique after loading a saved storage.
+            self._next_uid = 0
+            if self.initialized and self._len > 0:
+                uids = self._stored_frames().get("uid")[: self._len]
+                self._next_uid = int(uids.max()) + 1
+        num_rows = len(cursor)
+        uid = torch.arange(self._next_uid, self._next_uid + num_rows)
+        self._next_uid += num_rows
+        prev = torch.full((num_rows,), -1, dtype=torch.long)
+        prev_uid = torch.full((num_rows,), -1, dtype=torch.long)
+        if traj_ids is None:
+            traj_ids = [None] * num_rows
+        else:
+            traj_ids = traj_ids.reshape(num_rows, -1)[:, 0].tolist()
+
+        c = self.num_channels
+        unlinked = 0
+        for i, traj_id in enumerate(traj_ids):
+            last = self._last.pop(traj_id, None)
+            if last is not None and torch.equal(
+                obs[i, ..., -2 * c : -c, :, :], last[2]
+            ):
+                prev[i], prev_uid[i] = last[0], last[1]
+            elif not (obs[i, ..., :-c, :, :] == obs[i, ..., c:, :, :]).all():
+                # Neither linked nor padded like the start of an episode.
+                unlinked += 1
+            self._last[traj_id] = (int(cursor[i]), int(uid[i]), obs[i, ..., -c:, :, :])
+        while len(self._last) > self._max_tracked_trajs:
+            self._last.popitem(last=False)
+
+        if unlinked and not self._warned:
+            warn(
+                f"{unlinked} rows could not be linked to the previous step of their "
+                "trajectory, their frame stacks are padded when sampled. Write the "
+                "steps of each trajectory in order or set link_frames=False."
+            )
+            self._warned = True
+        return uid, prev, prev_uid
+
+    def get(self, index):
+        if isinstance(index, int):
+            return self.get(torch.tensor([index]))[0]
+        if isinstance(index, slice):
+            index = torch.arange(self._len)[index]
+        out = super().get(index)
+        root = self._root(out)
+        if root + ("_frames",) not in out.keys(include_nested=True):
+            return out
+        index = torch.as_tensor(index).reshape(-1)
+        frames = out.get(root + ("_frames",))
+        out = out.exclude(root + ("_frames",))
+
+        if self.link_frames:
+            obs = self._stack(index)
+        else:
+            obs = frames.get("obs")
+        out.set(root + self.obs_key, _to_float(obs))
+        if "next_frame" in frames.keys():
+            next_obs = torch.cat(
+                [obs[..., self.num_channels :, :, :], frames.get("next_frame")], dim=-3
+            )
+            out.set(root + ("next",) + self.obs_key, _to_float(next_obs))
+        return out
+
+    def _stack(self, index: torch.Tensor) -> torch.Tensor:
+        """Rebuilds the observation stacks of rows from their linked frames."""
+        stored = self._stored_frames()
+        prev, uid, prev_uid = (
+            stored.get("prev"),
+            stored.get("uid"),
+            stored.get("prev_uid"),
+        )
+        rows = [index]
+        current, linked = index, torch.ones_like(index, dtype=torch.bool)
+        for _ in range(self.num_stacks - 1):
+            previous = prev[current]
+            linked = linked & (previous >= 0)
+            previous = torch.where(linked, previous, current)
+            # The previous row may have been overwritten since.
+            linked = linked & (uid[previous] == prev_uid[current])
+            current = torch.where(linked, previous, current)
+            rows.append(current)
+
+        # Reads every distinct frame once.
+        unique, inverse = torch.unique(torch.stack(rows), return_inverse=True)
+        frames = stored.get("frame")[unique]
+        return torch.cat([frames[i] for i in reversed(inverse)], dim=-3)
@@ -0,0 +1,193 @@
+from contextlib import contextmanager
+from threading import Event, Lock, Thread
+from typing import Callable, Iterator
+
+import torch
+from tensordict.nn import TensorDictModule, TensorDictModuleBase
+from torchrl.objectives import LossModule
+
+__all__ = ["AsyncLearner", "LossHistory", "compile_loss_networks"]
+
+
+class LossHistory:
+    """Averages the losses of the updates of a batch on the device.
+
+    Reading a loss with `.item()` waits for the device to finish the update, and
+    the trainers read several losses after every update. The history instead
+    keeps running sums on the device and copies every mean back at once.
+
+    Examples:
+        >>> history = LossHistory()
+        >>> for _ in range(num_updates):
+        ...     ...
+        ...     history.append(total_loss=loss, actor_loss=actor_loss)
+        >>> metrics.update(history.means())
+    """
+
+    def __init__(self):
+        self._sums = {}
+        self._counts = {}
+
+    def append(self, **values: torch.Tensor) -> None:
+        """Adds the scalar losses of one update."""
+        for key, value in values.items():
+            value = value.detach()
+            if key in self._sums:
+                self._sums[key] += value
+                self._counts[key] += 1
+            else:
+                self._sums[key] = value.clone().float()
+                self._counts[key] = 1
+
+    def means(self) -> dict[str, float]:
+        """Returns the mean of every loss, with a single device synchronization."""
+        if not self._sums:
+            return {}
+        keys = list(self._sums)
+        means = torch.stack([self._sums[key] / self._counts[key] for key in keys])
+        return dict(zip(keys, means.tolist()))
+
+    def clear(self) -> None:
+        """Forgets the losses appended so far."""
+        self._sums.clear()
+        self._counts.clear()
+
+    def __len__(self) -> int:
+        return max(self._counts.values(), default=0)
+
+
+def compile_loss_networks(loss_module: LossModule, mode: str = "default") -> None:
+    """Compiles the networks called by a loss module with `torch.compile`.
+
+    TorchRL losses call their networks with parameters swapped in from
+    tensordicts, e.g. the online and the target parameters, so the whole update
+    cannot be captured as one graph. Instead, the plain modules wrapped by every
+    `TensorDictModule` of the loss are compiled in place. The parameter sets are
+    few and fixed, so each is compiled once and reused. With
+    `mode="reduce-overhead"`, the compiled networks are replayed as CUDA graphs,
+    which suits the fixed shape batches sampled from the replay buffer.
+
+    Args:
+        loss_module: The loss module whose networks are compiled.
+        mode: The `torch.compile` mode.
+    """
+    for name in ["actor_network", "value_network", "qvalue_network"]:
+        network = loss_module.__dict__.get(name)
+        if network is None:
+            continue
+        for module in network.modules():
+            if isinstance(module, TensorDictModule) and not isinstance(
+                module.module, TensorDictModuleBase
+            ):
+                module.module.compile(mode=mode)
+
+
+class AsyncLearner:
+    """Runs the gradient updates of an off-policy trainer in a background thread.
+
+    The training scripts alternate between collecting a batch and running the
+    updates for it. While the learner is busy, no new frames are stored, and
+    with a collector in another process the human subject keeps playing
+    against policy weights that are as old as the last batch. The learner
+    instead updates continuously from the replay buffer while the main thread
+    only ingests the collected frames, so its throughput no longer depends on
+    the real-time rate of the environment. Every `broadcast_interval` updates,
+    `broadcast_fn` pushes the new weights to the actors, e.g. with
+    `collector.update_policy_weights_`.
+
+    Sampling, extending and updating the priorities of a `ReplayBuffer` are
+    guarded by its own lock, so the buffer can be shared with the ingesting
+    thread as is. Collection already happens in separate processes or in
+    simulation, and PyTorch releases the GIL in its kernels, so a thread is
+    enough to overlap the two. Code that reads the trained parameters as a
+    whole, e.g. to save a checkpoint, should run within `paused`.
+
+    Examples:
+        >>> learner = AsyncLearner(update, collector.update_policy_weights_)
+        >>> for data in collector:
+        ...     prb.extend(data)
+        ...     learner.start()
+        ...     with learner.paused():
+        ...         torch.save(model.state_dict(), path)
+        >>> learner.stop()
+
+    Args:
+        update_fn: Runs one update and returns its scalar losses by name.
+        broadcast_fn: Sends the current weights to the actors.
+        broadcast_interval: The number of updates between broadcasts.
+    """
+
+    def __init__(
+        self,
+        update_fn: Callable[[], dict[str, torch.Tensor]],
+        broadcast_fn: Callable[[], None] | None = None,
+        broadcast_interval: int = 100,
+    ):
+        self.update_fn = update_fn
+        self.broadcast_fn = broadcast_fn
+        self.broadcast_interval = broadcast_interval
+        self.num_updates = 0
+        self._history = LossHistory()
+        self._lock = Lock()
+        self._resume = Event()
+        self._resume.set()
+        self._stop = Event()
+        self._thread = None
+        self._error = None
+
+    def _run(self) -> None:
+        try:
+            while True:
+                # Lets a waiting `paused` take the lock between two updates.
+                self._resume.wait()
+                if self._stop.is_set():
+                    break
+                with self._lock:
+                    losses = self.update_fn()
+                    self._history.append(**losses)
+                    self.num_updates += 1
+                    if (
+                        self.broadcast_fn is not None
+                        and self.num_updates % self.broadcast_interval == 0
+                    ):
+                        self.broadcast_fn()
+        except BaseException as error:
+            self._error = error
+
+    def _check(self) -> None:
+        if self._error is not None:
+            raise RuntimeError("The learner thread failed.") from self._error
+
+    def start(self) -> None:
+        """Starts the learner thread, if it is not running yet."""
+        self._check()
+        if self._thread is None:
+            self._thread = Thread(target=self._run, name="learner", daemon=True)
+            self._thread.start()
+
+    @contextmanager
+    def paused(self) -> Iterator[None]:
+        """Holds the learner between two updates for the duration of the block."""
+        self._check()
+        self._resume.clear()
+        try:
+            with self._lock:
+                yield
+        finally:
+            self._resume.set()
+
+    def losses(self) -> dict[str, float]:
+        """Returns the mean losses of the updates since the last call."""
+        with self.paused():
+            means = self._history.means()
+            self._history.clear()
+        return means
+
+    def stop(self) -> None:
+        """Stops the learner thread after its current update."""
+        self._stop.set()
+        self._resume.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._check()
@@ -0,0 +1,210 @@
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import torch
+from PIL import Image
+from tensordict import MemoryMappedTensor, TensorDict
+from torchrl.data.replay_buffers import ReplayBuffer
+
+__all__ = ["convert_offline_dataset", "is_offline_dataset", "load_offline_dataset"]
+
+METADATA = "dataset.json"
+
+
+def _sorting_key(string: str) -> tuple[int, int]:
+    numbers = re.findall(r"\d+", string)
+    return int(numbers[0]), int(numbers[1])
+
+
+def _decode_image(path: str) -> np.ndarray:
+    return np.asarray(Image.open(path).convert("RGB"))
+
+
+def _load_action(path: str) -> np.ndarray:
+    return np.asarray(torch.load(path), dtype=np.int64)
+
+
+def _column(directory: Path, name: str, metadata: dict) -> MemoryMappedTensor:
+    column = metadata["columns"][name]
+    return MemoryMappedTensor.from_filename(
+        directory / f"{name}.memmap", getattr(torch, column["dtype"]), column["shape"]
+    )
+
+
+def _agents(obs_0: torch.Tensor, **entries: torch.Tensor) -> TensorDict:
+    """Makes the agent entries of a chunk of transitions from uint8 frames."""
+    n = len(obs_0)
+    observation = TensorDict(
+        {
+            "obs_0": obs_0.float().div_(255).unsqueeze(1),
+            "obs_1": torch.zeros(n, 1, 15),
+        },
+        batch_size=[n, 1],
+    )
+    done = torch.zeros(n, 1, 1, dtype=torch.bool)
+    return TensorDict(
+        {"done": done, "observation": observation, **entries}, batch_size=[n, 1]
+    )
+
+
+def is_offline_dataset(directory: str | os.PathLike) -> bool:
+    """Returns whether `directory` holds a dataset of `convert_offline_dataset`."""
+    return (Path(directory) / METADATA).exists()
+
+
+def convert_offline_dataset(
+    act_folder: str | os.PathLike,
+    obs_folder: str | os.PathLike,
+    ending_steps_path: str | os.PathLike,
+    out_dir: str | os.PathLike,
+    num_workers: int | None = None,
+    num_actions: int = 4,
+) -> None:
+    """Converts recorded images and actions into a columnar memory-mapped dataset.
+
+    The recordings hold one PNG and one action file per step. The images are
+    decoded and the actions loaded by a pool of `num_workers` processes, and
+    written once, as uint8, to a memory-mapped column of frames. The
+    transitions between consecutive steps are listed in a second set of
+    columns: the frame of every transition, its reward and its trajectory id.
+    They follow `ending_steps`: the last step of an episode is rewarded, the
+    step after it has no transition, and the trajectory id changes on the
+    next one.
+
+    The dataset is a directory with one `.memmap` file per column and a
+    `dataset.json` listing their shapes and the episode ends. It is loaded
+    with `load_offline_dataset`.
+
+    Args:
+        act_folder: The folder of the action files.
+        obs_folder: The folder of the observation images.
+        ending_steps_path: A saved tensor of the last step of every episode.
+        out_dir: The directory to write the dataset to.
+        num_workers: The number of decoding processes. Defaults to the number
+            of CPUs.
+        num_actions: The number of discrete actions, used for the logits.
+    """
+    obs_files = sorted(os.listdir(obs_folder), key=_sorting_key)
+    act_files = sorted(os.listdir(act_folder), key=_sorting_key)
+    for obs_file, act_file in zip(obs_files, act_files):
+        assert obs_file[3:-4] == act_file[3:-3], "Not match: %s, %s" % (
+            obs_file,
+            act_file,
+        )
+    num_frames = min(len(obs_files), len(act_files))
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    num_workers = num_workers or os.cpu_count()
+    obs_paths = [os.path.join(obs_folder, f) for f in obs_files[:num_frames]]
+    act_paths = [os.path.join(act_folder, f) for f in act_files[:num_frames]]
+    chunksize = max(1, num_frames // (4 * num_workers))
+    with ProcessPoolExecutor(num_workers) as executor:
+        actions = torch.from_numpy(
+            np.stack(list(executor.map(_load_action, act_paths, chunksize=chunksize)))
+        )
+        frames = None
+        images = executor.map(_decode_image, obs_paths, chunksize=chunksize)
+        for i, image in enumerate(images):
+            if frames is None:
+                height, width, channels = image.shape
+                frames = MemoryMappedTensor.empty(
+                    (num_frames, channels, height, width),
+                    dtype=torch.uint8,
+                    filename=out_dir / "frames.memmap",
+                )
+            frames[i] = torch.from_numpy(image).permute(2, 0, 1)
+            print("Decoding %d/%d" % (i + 1, num_frames), end="\r")
+
+    ending_steps = torch.as_tensor(torch.load(ending_steps_path)).reshape(-1).long()
+    steps = torch.arange(num_frames - 1)
+    skipped = torch.isin(steps - 1, ending_steps)
+    new_traj = torch.isin(steps - 2, ending_steps) & ~skipped
+    columns = {
+        "frames": frames,
+        "actions": actions,
+        "frame": steps[~skipped],
+        "reward": torch.isin(steps, ending_steps)[~skipped].float(),
+        "traj_ids": new_traj.cumsum(0)[~skipped],
+    }
+    for name in ["actions", "frame", "reward", "traj_ids"]:
+        MemoryMappedTensor.from_tensor(
+            columns[name], filename=out_dir / f"{name}.memmap"
+        )
+
+    metadata = {
+        "num_actions": num_actions,
+        "ending_steps": ending_steps.tolist(),
+        "columns": {
+            name: {"dtype": str(column.dtype).split(".")[-1], "shape": column.shape}
+            for name, column in columns.items()
+        },
+    }
+    with open(out_dir / METADATA, "w") as f:
+        json.dump(metadata, f)
+
+
+def load_offline_dataset(
+    replay_buffer: ReplayBuffer, directory: str | os.PathLike, chunk_size: int = 4096
+) -> ReplayBuffer:
+    """Loads a dataset written by `convert_offline_dataset` into a replay buffer.
+
+    The transitions are built and written a chunk at a time with batched
+    indexing of the memory-mapped columns. They have the layout of the
+    collected data, with the frames as float observations and the next
+    observation read from the following frame.
+
+    Args:
+        replay_buffer: The replay buffer to extend.
+        directory: The directory of the dataset.
+        chunk_size: The number of transitions written at once.
+
+    Returns:
+        The replay buffer.
+    """
+    directory = Path(directory)
+    with open(directory / METADATA) as f:
+        metadata = json.load(f)
+    frames = _column(directory, "frames", metadata)
+    actions = _column(directory, "actions", metadata)
+    frame = _column(directory, "frame", metadata)
+    reward = _column(directory, "reward", metadata)
+    traj_ids = _column(directory, "traj_ids", metadata)
+
+    for start in range(0, len(frame), chunk_size):
+        stop = min(start + chunk_size, len(frame))
+        index = frame[start:stop].clone()
+        n = len(index)
+        action = actions[index].clone()
+        logits = torch.nn.functional.one_hot(
+            action.reshape(n, -1)[:, 0], metadata["num_actions"]
+        )
+        step_count = torch.zeros(n, 1, 1, dtype=torch.int64)
+        data = TensorDict(
+            {
+                "agents": _agents(
+                    frames[index],
+                    action=action.unsqueeze(1),
+                    logits=logits.float().unsqueeze(1),
+                ),
+                "collector": {"traj_ids": traj_ids[start:stop].clone()},
+                "next": {
+                    "agents": _agents(
+                        frames[index + 1],
+                        reward=reward[start:stop].clone().reshape(n, 1, 1),
+                    ),
+                    "step_count": step_count,
+                },
+                "step_count": step_count,
+                "time_stamp": torch.full((n,), -100.0),
+                "is_expert": torch.zeros(n, dtype=torch.bool),
+            },
+            batch_size=[n],
+        )
+        replay_buffer.extend(data)
+        print("Loading Expert Experiences: %d/%d" % (start + n, len(frame)), end="\r")
+    return replay_buffer
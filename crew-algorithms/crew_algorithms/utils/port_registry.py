@@ -0,0 +1,164 @@
+import json
+import os
+import socket
+import tempfile
+from contextlib import closing, contextmanager
+
+if os.name == "nt":
+    import ctypes
+    import msvcrt
+else:
+    import fcntl
+
+__all__ = ["PortRegistry", "port_registry"]
+
+
+def _pid_alive(pid: int) -> bool:
+    """Checks whether a process with the given pid is still running."""
+    if os.name == "nt":
+        # os.kill would terminate the process on Windows.
+        process_query_limited_information = 0x1000
+        still_active = 259
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(process_query_limited_information, False, pid)
+        if not handle:
+            return False
+        exit_code = ctypes.c_ulong()
+        kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code))
+        kernel32.CloseHandle(handle)
+        return exit_code.value == still_active
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _port_is_free(port: int) -> bool:
+    with closing(socket.socket(socket.AF_INET, socket.SOCK_STREAM)) as s:
+        try:
+            s.bind(("localhost", port))
+        except OSError:
+            return False
+        return True
+
+
+class PortRegistry:
+    """Hands out non-overlapping port ranges to Unity environments on one host.
+
+    `find_free_port` lets the OS pick a port and closes the socket straight
+    away, so environments launched at the same time, e.g. by the workers of a
+    `MultiaSyncDataCollector`, can be handed the same port before either
+    binds it. The registry instead records every reservation, together with the
+    pid of its owner, in a JSON file shared by all processes on the host and
+    guarded by a file lock. Ports are scanned upward from `start_port`, so
+    launches are packed densely and deterministically, and reservations whose
+    owner has exited are reclaimed.
+
+    Examples:
+        >>> port = port_registry.reserve()
+        >>> env = UnityEnvironment(file_name, base_port=port)
+        >>> ...
+        >>> port_registry.release(port)
+
+    Args:
+        path: The file holding the reservations.
+        start_port: The first port handed out.
+        end_port: The port past the last one handed out.
+    """
+
+    def __init__(
+        self,
+        path: str | None = None,
+        start_port: int = 5005,
+        end_port: int = 65535,
+    ):
+        if path is None:
+            path = os.path.join(tempfile.gettempdir(), "crew_unity_ports.json")
+        self.path = path
+        self.lock_path = f"{path}.lock"
+        self.start_port = start_port
+        self.end_port = end_port
+
+    @contextmanager
+    def _locked(self):
+        with open(self.lock_path, "a+b") as lock_file:
+            if os.name == "nt":
+                lock_file.seek(0)
+                while True:
+                    try:
+                        msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                        break
+                    except OSError:
+                        # LK_LOCK gives up after 10 seconds, keep waiting.
+                        continue
+                try:
+                    yield
+                finally:
+                    lock_file.seek(0)
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _read(self) -> dict[int, int]:
+        try:
+            with open(self.path) as f:
+                reservations = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+        return {int(port): pid for port, pid in reservations.items() if _pid_alive(pid)}
+
+    def _write(self, reservations: dict[int, int]) -> None:
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({str(port): pid for port, pid in reservations.items()}, f)
+        os.replace(tmp_path, self.path)
+
+    def reserve(self, num_ports: int = 1) -> int:
+        """Reserves `num_ports` consecutive free ports.
+
+        Args:
+            num_ports: The size of the range, e.g. the number of workers that
+                will be launched from the same `base_port`.
+
+        Returns:
+            The first port of the reserved range.
+        """
+        with self._locked():
+            reservations = self._read()
+            port = self.start_port
+            while port + num_ports <= self.end_port:
+                ports = range(port, port + num_ports)
+                taken = [p for p in ports if p in reservations or not _port_is_free(p)]
+                if not taken:
+                    pid = os.getpid()
+                    reservations.update({p: pid for p in ports})
+                    self._write(reservations)
+                    return port
+                port = taken[-1] + 1
+        raise RuntimeError(
+            f"No {num_ports} consecutive free ports between {self.start_port} "
+            f"and {self.end_port}."
+        )
+
+    def release(self, port: int, num_ports: int = 1) -> None:
+        """Releases a range previously returned by `reserve`.
+
+        Args:
+            port: The first port of the range.
+            num_ports: The size of the range.
+        """
+        with self._locked():
+            reservations = self._read()
+            for p in range(port, port + num_ports):
+                reservations.pop(p, None)
+            self._write(reservations)
+
+
+port_registry = PortRegistry()
@@ -0,0 +1,116 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+from tensordict import TensorDictBase
+from torchrl.data.replay_buffers import ReplayBuffer
+
+__all__ = ["ReplayBufferPrefetcher"]
+
+
+class ReplayBufferPrefetcher:
+    """Samples batches of a replay buffer ahead of the updates that use them.
+
+    Every gradient step of the off-policy trainers used to sample from a
+    `LazyMemmapStorage` and copy the batch to the device synchronously, so the
+    learner waited on the memmap reads and the host to device copy. The
+    prefetcher keeps `num_prefetch` batches sampled by a background thread and,
+    on CUDA, pinned and copied on a side stream, so that `sample` usually
+    returns a batch that is already on the device.
+
+    Priorities are read and written under the lock of the replay buffer, so
+    `replay_buffer.update_tensordict_priority` can be called on the returned
+    batches as before. The sampled indices stay valid, but a prefetched batch
+    was drawn with the priorities from before the last `num_prefetch` updates.
+    With `num_prefetch=0` every batch is sampled synchronously, as without the
+    prefetcher.
+
+    Examples:
+        >>> sampler = ReplayBufferPrefetcher(prb, device, num_prefetch=2)
+        >>> for _ in range(num_updates):
+        ...     sample = sampler.sample()
+        ...     loss_td = loss_module(sample)
+        ...     ...
+        ...     prb.update_tensordict_priority(sample)
+
+    Args:
+        replay_buffer: The replay buffer to sample from.
+        device: The device the batches are used on.
+        num_prefetch: The number of batches sampled ahead.
+        batch_size: The size of the batches. Defaults to the batch size of the
+            replay buffer.
+        pin_memory: Whether batches are pinned before being copied to a CUDA
+            device.
+    """
+
+    def __init__(
+        self,
+        replay_buffer: ReplayBuffer,
+        device: torch.device | str,
+        num_prefetch: int = 2,
+        batch_size: int | None = None,
+        pin_memory: bool = True,
+    ):
+        self.replay_buffer = replay_buffer
+        self.device = torch.device(device)
+        self.num_prefetch = num_prefetch
+        self.batch_size = batch_size
+        self._cuda = self.device.type == "cuda"
+        self.pin_memory = pin_memory and self._cuda
+        self._queue = deque()
+        self._executor = None
+        self._stream = None
+        if num_prefetch > 0:
+            # A single worker keeps the batches in order and the copies on one
+            # stream.
+            self._executor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="prb_prefetch"
+            )
+            if self._cuda:
+                self._stream = torch.cuda.Stream(self.device)
+
+    def _fetch(self) -> tuple[TensorDictBase, torch.cuda.Event | None]:
+        sample = self.replay_buffer.sample(self.batch_size)
+        if self._stream is None:
+            return sample.clone().to(self.device), None
+        # Pinning copies the batch out of the storage, so no clone is needed.
+        sample = sample.pin_memory() if self.pin_memory else sample.clone()
+        with torch.cuda.stream(self._stream):
+            sample = sample.to(self.device, non_blocking=self.pin_memory)
+            event = torch.cuda.Event()
+            event.record(self._stream)
+        return sample, event
+
+    def sample(self) -> TensorDictBase:
+        """Returns the next batch, on the device.
+
+        Returns:
+            The sampled batch, including the "index" entry used to update the
+            priorities.
+        """
+        if self._executor is None:
+            return self._fetch()[0]
+        while len(self._queue) <= self.num_prefetch:
+            self._queue.append(self._executor.submit(self._fetch))
+        sample, event = self._queue.popleft().result()
+        if event is not None:
+            stream = torch.cuda.current_stream(self.device)
+            stream.wait_event(event)
+            # The batch was allocated on the side stream but is used here.
+            for tensor in sample.values(include_nested=True, leaves_only=True):
+                tensor.record_stream(stream)
+        return sample
+
+    def clear(self) -> None:
+        """Drops the prefetched batches, e.g. after the buffer was emptied."""
+        while self._queue:
+            future = self._queue.popleft()
+            if not future.cancel():
+                future.exception()
+
+    def shutdown(self) -> None:
+        """Drops the prefetched batches and stops the background thread."""
+        self.clear()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
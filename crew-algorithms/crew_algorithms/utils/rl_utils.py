@@ -1,13 +1,16 @@
 import os
 import platform
+from functools import partial
 
 import torch
 import torchvision.transforms.functional as F
 import wandb
 from crew_algorithms.envs.channels import ToggleTimestepChannel, WrittenFeedbackChannel
 from crew_algorithms.envs.configs import EnvironmentConfig
-from crew_algorithms.envs.unity import UnityEnv
-from crew_algorithms.utils.common_utils import find_free_port
+from crew_algorithms.envs.mock import MockUnityEnvironment, make_mock_behaviors
+from crew_algorithms.envs.unity import UnityEnv, UnityWrapper
+from crew_algorithms.envs.unity_vec import UnityVecEnv
+from crew_algorithms.utils.collectors import PipelinedDataCollector
 from mlagents_envs.side_channel.engine_configuration_channel import (
     EngineConfigurationChannel,
 )
@@ -33,12 +36,16 @@ def make_base_env(
         env_cfg: The environment configuration.
         device: The device to perform environment operations on.
         toggle_timestep_channel: A Unity side channel that can be used
-            to play/pause games.
+            to play/pause games. With several instances, it toggles all of them.
         written_feedback_channel: A Unity side channel that can be used
-            to share written feedback at the end of each episode.
+            to share written feedback at the end of each episode. With several
+            instances, it receives the feedback of all of them.
 
     Returns:
-        A `UnityEnv` object that can be used to interact with the environment.
+        A `UnityEnv` object that can be used to interact with the environment,
+        or a `UnityVecEnv` stacking ``env_cfg.num_instances`` of them. With
+        ``env_cfg.mock`` the environments run on a `MockUnityEnvironment`
+        instead of a Unity build.
     """
     # env_cfg.unity_server_build_path = env_cfg.unity_server_build_path_linux
     # env_cfg.unity_server_build_path = env_cfg.unity_server_build_path_osx
@@ -85,6 +92,7 @@ def make_base_env(
 
     if hasattr(env_cfg, "map_size"):
         map_args = ["-MapSize", f"{env_cfg.map_size}"]
+    seed_args = []
     if hasattr(env_cfg, "seed"):
         seed_args = ["-Seed", f"{env_cfg.seed}"]
 
@@ -127,60 +135,87 @@ def make_base_env(
 
         ]
 
-    channel_args = []
-    side_channels = []
-    if toggle_timestep_channel:
-        side_channels.append(toggle_timestep_channel)
-        channel_args += [
-            "-ToggleTimestepChannelID",
-            str(toggle_timestep_channel.channel_id),
-        ]
-    if written_feedback_channel:
-        side_channels.append(written_feedback_channel)
-        channel_args += [
-            "-WrittenFeedbackChannelID",
-            str(written_feedback_channel.channel_id),
-        ]
-
-    engine_configuration_channel = EngineConfigurationChannel()
-    side_channels.append(engine_configuration_channel)
-
-    if env_cfg.time_scale > 1.0:
-        engine_configuration_channel.set_configuration_parameters(
-            width=100,
-            height=100,
-            quality_level=10,
-            time_scale=env_cfg.time_scale,
-            target_frame_rate=50,
-        )  # , capture_frame_rate=5)
     os.makedirs(str(env_cfg.log_folder_path), exist_ok=True)
 
-    base_env = UnityEnv(
-        str(env_cfg.unity_server_build_path),
-        seed=env_cfg.seed,
-        no_graphics=env_cfg.no_graphics,
-        side_channels=side_channels,
-        additional_args=[
-            *channel_args,
-            *num_player_args,
-            *seed_args,
-            *feedback_args,
-            *maze_args,
-            *cam_size_arg,
-            *log_trajectory_arg,
-            *game_args,
-            *map_args,
-            *algorithm_args,
-            *render_folder_path_args,
-            *timestamp_args,
-            *level_args,
-        ],
-        log_folder=str(env_cfg.log_folder_path),
-        base_port=find_free_port(),
-        timeout_wait=60 * 60 * 24,
-        device=device,
-        frame_skip=1,
-    )
+    def make_unity_env(instance_id: int = 0) -> UnityEnv:
+        # Every instance needs its own channels: queued messages are consumed by
+        # whichever environment steps first. The other instances get replicas
+        # of the channels of the caller, which forward to them.
+        channel_args = []
+        side_channels = []
+        if toggle_timestep_channel:
+            channel = toggle_timestep_channel
+            if instance_id > 0:
+                channel = toggle_timestep_channel.replicate()
+            side_channels.append(channel)
+            channel_args += ["-ToggleTimestepChannelID", str(channel.channel_id)]
+        if written_feedback_channel:
+            channel = written_feedback_channel
+            if instance_id > 0:
+                channel = written_feedback_channel.replicate()
+            side_channels.append(channel)
+            channel_args += ["-WrittenFeedbackChannelID", str(channel.channel_id)]
+        engine_configuration_channel = EngineConfigurationChannel()
+        if env_cfg.time_scale > 1.0:
+            engine_configuration_channel.set_configuration_parameters(
+                width=100,
+                height=100,
+                quality_level=10,
+                time_scale=env_cfg.time_scale,
+                target_frame_rate=50,
+            )  # , capture_frame_rate=5)
+        instance_seed = env_cfg.seed + instance_id
+        instance_seed_args = ["-Seed", f"{instance_seed}"] if seed_args else []
+        if env_cfg.mock:
+            return UnityWrapper(
+                MockUnityEnvironment(
+                    make_mock_behaviors(env_cfg),
+                    episode_length=env_cfg.mock_episode_length,
+                    step_time=env_cfg.mock_step_time,
+                    seed=instance_seed,
+                ),
+                device=device,
+                batched_decode=env_cfg.batched_decode,
+                batched_actions=env_cfg.batched_actions,
+                buffered=env_cfg.buffered,
+            )
+
+        return UnityEnv(
+            str(env_cfg.unity_server_build_path),
+            seed=instance_seed,
+            no_graphics=env_cfg.no_graphics,
+            side_channels=[*side_channels, engine_configuration_channel],
+            additional_args=[
+                *channel_args,
+                *num_player_args,
+                *instance_seed_args,
+                *feedback_args,
+                *maze_args,
+                *cam_size_arg,
+                *log_trajectory_arg,
+                *game_args,
+                *map_args,
+                *algorithm_args,
+                *render_folder_path_args,
+                *timestamp_args,
+                *level_args,
+            ],
+            log_folder=str(env_cfg.log_folder_path),
+            timeout_wait=60 * 60 * 24,
+            device=device,
+            frame_skip=1,
+            batched_decode=env_cfg.batched_decode,
+            batched_actions=env_cfg.batched_actions,
+            buffered=env_cfg.buffered,
+            reuse_env=env_cfg.reuse_env,
+        )
+
+    if env_cfg.num_instances > 1:
+        return UnityVecEnv(
+            [partial(make_unity_env, i) for i in range(env_cfg.num_instances)],
+            device=device,
+        )
+    base_env = make_unity_env()
     return base_env
 
 
@@ -220,7 +255,15 @@ def unsqueeze_images_from_channel_dimension(
     return tensor.unflatten(dim, (num_images, env_cfg.num_channels))
 
 
-def make_collector(cfg, env: EnvBase, policy, device: str, num_envs: int = 1):
+def make_collector(
+    cfg,
+    env: EnvBase,
+    policy,
+    device: str,
+    num_envs: int = 1,
+    pipelined: bool = False,
+    in_process: bool = False,
+):
     """Makes a collector to collect samples from the environment.
 
 
@@ -228,6 +271,13 @@ def make_collector(cfg, env: EnvBase, policy, device: str, num_envs: int = 1):
         cfg: The collector configuration.
         env: The environment to collect data from.
         device: The device to run the collector on.
+        num_envs: The number of environments to collect from.
+        pipelined: Whether to step the environments in-process with a
+            `PipelinedDataCollector`, overlapping the policy with the simulation.
+        in_process: Whether to build the environments in this process rather
+            than in collector workers, e.g. so that they can be returned to the
+            Unity environment pool when the collector shuts down. Only one
+            environment is supported unless `pipelined` is set.
 
     Returns:
         A collector to collect data samples.
@@ -262,7 +312,33 @@ def make_collector(cfg, env: EnvBase, policy, device: str, num_envs: int = 1):
     # env = lambda: make_env(cfg.envs, None, device)
     ms = MultiStep(gamma=0.99, n_steps=20)
 
-    if num_envs == 1:
+    if in_process and num_envs > 1 and not pipelined:
+        raise ValueError(
+            "In-process collection from several environments needs pipelined=True."
+        )
+
+    if pipelined:
+        collector = PipelinedDataCollector(
+            [env] * num_envs,
+            policy,
+            frames_per_batch=cfg.frames_per_batch,
+            total_frames=cfg.total_frames,
+            device=device,
+            exploration_mode=cfg.exploration_mode,
+            init_random_frames=cfg.init_random_frames,
+        )
+    elif in_process:
+        collector = SyncDataCollector(
+            env,
+            policy,
+            frames_per_batch=cfg.frames_per_batch,
+            total_frames=cfg.total_frames,
+            device=device,
+            split_trajs=False,
+            exploration_mode=cfg.exploration_mode,
+            reset_at_each_iter=False,
+        )
+    elif num_envs == 1:
         collector = aSyncDataCollector(
             env,
             policy,
@@ -0,0 +1,346 @@
+import json
+import os
+from pathlib import Path
+from typing import Any, Sequence
+
+import torch
+from crew_algorithms.utils.checkpoint import read_manifest
+from tensordict import TensorDictBase
+from torchrl.data import LazyMemmapStorage, TensorDictReplayBuffer
+from torchrl.data.replay_buffers.samplers import Sampler
+from torchrl.data.replay_buffers.storages import Storage
+from torchrl.data.replay_buffers.writers import Writer
+
+__all__ = [
+    "ShardedStorage",
+    "ShardedWriter",
+    "StratifiedSampler",
+    "make_sharded_buffer",
+    "pool_checkpoints",
+]
+
+
+class ShardedStorage(Storage):
+    """A storage split into memory-mapped shards spread over several directories.
+
+    A `LazyMemmapStorage` keeps all of its data in one directory, so a buffer
+    pooled over the runs of many subjects is bound by a single disk. This
+    storage instead holds `num_shards` storages of `shard_size` rows each, the
+    k-th of which is memory-mapped in `scratch_dirs[k % len(scratch_dirs)]`,
+    e.g. one directory per mount point. Shard k holds the rows
+    `[k * shard_size, (k + 1) * shard_size)` of the storage, so a replay
+    buffer indexes it like any other storage. Use it with a `ShardedWriter`,
+    which writes every row to its shard, and a `StratifiedSampler`, which
+    only samples the rows written so far.
+
+    Args:
+        shard_size: The number of rows of a shard.
+        scratch_dirs: The directories the shards are spread over.
+        num_shards: The number of shards, one per directory by default.
+        device: The device of the sampled data.
+    """
+
+    def __init__(
+        self,
+        shard_size: int,
+        scratch_dirs: Sequence[str | os.PathLike],
+        num_shards: int | None = None,
+        device: str = "cpu",
+    ):
+        num_shards = num_shards or len(scratch_dirs)
+        super().__init__(shard_size * num_shards)
+        self.shard_size = shard_size
+        self.num_shards = num_shards
+        self.shards = [
+            LazyMemmapStorage(
+                shard_size,
+                scratch_dir=os.path.join(
+                    scratch_dirs[k % len(scratch_dirs)], "shard_%d" % k
+                ),
+                device=device,
+            )
+            for k in range(num_shards)
+        ]
+
+    def shard_lengths(self) -> torch.Tensor:
+        """Returns the number of rows written to every shard."""
+        return torch.tensor([len(shard) for shard in self.shards])
+
+    def valid_indices(self) -> torch.Tensor:
+        """Returns the rows written so far, shard after shard."""
+        return torch.cat(
+            [
+                torch.arange(len(shard)) + k * self.shard_size
+                for k, shard in enumerate(self.shards)
+            ]
+        )
+
+    def _split(self, index: torch.Tensor):
+        """Yields the positions and local rows of the index in every shard."""
+        shard_ids = index // self.shard_size
+        for k in shard_ids.unique().tolist():
+            positions = (shard_ids == k).nonzero().squeeze(-1)
+            yield k, positions, index[positions] - k * self.shard_size
+
+    def set(self, cursor, data):
+        if isinstance(cursor, int):
+            k, local = divmod(cursor, self.shard_size)
+            return self.shards[k].set(local, data)
+        cursor = torch.as_tensor(cursor).reshape(-1)
+        for k, positions, local in self._split(cursor):
+            self.shards[k].set(local, data[positions])
+
+    def get(self, index):
+        if isinstance(index, int):
+            k, local = divmod(index, self.shard_size)
+            return self.shards[k].get(local)
+        if isinstance(index, slice):
+            index = self.valid_indices()[index]
+        index = torch.as_tensor(index).reshape(-1)
+        parts = list(self._split(index))
+        if len(parts) == 1:
+            k, _, local = parts[0]
+            return self.shards[k].get(local)
+        data = torch.cat([self.shards[k].get(local) for k, _, local in parts])
+        positions = torch.cat([positions for _, positions, _ in parts])
+        # Restores the order of the index.
+        return data[positions.argsort()]
+
+    def __len__(self):
+        return sum(len(shard) for shard in self.shards)
+
+    def state_dict(self) -> dict[str, Any]:
+        return {"shards": [shard.state_dict() for shard in self.shards]}
+
+    def load_state_dict(self, state_dict: dict[str, Any]) -> None:
+        for shard, shard_state in zip(self.shards, state_dict["shards"]):
+            shard.load_state_dict(shard_state)
+
+    def dumps(self, path):
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        written = [k for k, shard in enumerate(self.shards) if shard.initialized]
+        for k in written:
+            self.shards[k].dumps(path / ("shard_%d" % k))
+        with open(path / "shards.json", "w") as f:
+            json.dump({"shard_size": self.shard_size, "written": written}, f)
+
+    def loads(self, path):
+        path = Path(path)
+        with open(path / "shards.json") as f:
+            metadata = json.load(f)
+        for k in metadata["written"]:
+            self.shards[k].loads(path / ("shard_%d" % k))
+
+    def _empty(self):
+        for shard in self.shards:
+            shard._empty()
+
+
+class ShardedWriter(Writer):
+    """Writes every row of a `ShardedStorage` to its shard, round robin within it.
+
+    The shard of a row is read from its `shard_key` entry, e.g. the index of
+    its subject, so that every subject or run of a study is kept in a shard of
+    its own. Batches without the entry are written to the shards in turn,
+    which spreads the data of a single run over the disks. When a shard is
+    full, its oldest rows are overwritten, like with a `RoundRobinWriter`.
+
+    Args:
+        shard_key: The key of the shard index of every row.
+    """
+
+    def __init__(self, shard_key: str | tuple[str, ...] = "shard_id"):
+        super().__init__()
+        self.shard_key = shard_key
+        self._cursors = None
+        self._next_shard = 0
+
+    @property
+    def cursors(self) -> list[int]:
+        if self._cursors is None:
+            self._cursors = [0] * self._storage.num_shards
+        return self._cursors
+
+    def _shard_ids(self, data: TensorDictBase) -> torch.Tensor:
+        # Tensordict replay buffers write the data under "_data".
+        root = ("_data",) if "_data" in data.keys() else ()
+        key = root + (
+            self.shard_key if isinstance(self.shard_key, tuple) else (self.shard_key,)
+        )
+        shard_ids = data.get(key, None)
+        if shard_ids is None:
+            shard_id = self._next_shard
+            self._next_shard = (shard_id + 1) % self._storage.num_shards
+            return torch.full(data.batch_size[:1], shard_id, dtype=torch.long)
+        shard_ids = shard_ids.reshape(*data.batch_size[:1], -1)[..., 0].long()
+        if ((shard_ids < 0) | (shard_ids >= self._storage.num_shards)).any():
+            raise ValueError(
+                f"Shard indices must be in [0, {self._storage.num_shards}), got "
+                f"{shard_ids.unique().tolist()}."
+            )
+        return shard_ids
+
+    def _reserve(self, shard_id: int, count: int) -> torch.Tensor:
+        cursor = self.cursors[shard_id]
+        shard_size = self._storage.shard_size
+        self.cursors[shard_id] = (cursor + count) % shard_size
+        return torch.arange(cursor, cursor + count) % shard_size + shard_id * shard_size
+
+    def add(self, data: Any) -> int:
+        shard_id = int(self._shard_ids(data.unsqueeze(0))[0])
+        index = int(self._reserve(shard_id, 1)[0])
+        data["index"] = index
+        self._storage[index] = data
+        return index
+
+    def extend(self, data: Sequence) -> torch.Tensor:
+        shard_ids = self._shard_ids(data)
+        index = torch.empty(len(data), dtype=torch.long)
+        for shard_id in shard_ids.unique().tolist():
+            mask = shard_ids == shard_id
+            index[mask] = self._reserve(shard_id, int(mask.sum()))
+        data["index"] = index
+        self._storage[index] = data
+        return index
+
+    def state_dict(self) -> dict[str, Any]:
+        return {"cursors": list(self.cursors), "next_shard": self._next_shard}
+
+    def load_state_dict(self, state_dict: dict[str, Any]) -> None:
+        self._cursors = list(state_dict["cursors"])
+        self._next_shard = state_dict["next_shard"]
+
+    def dumps(self, path):
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        with open(path / "metadata.json", "w") as f:
+            json.dump(self.state_dict(), f)
+
+    def loads(self, path):
+        with open(Path(path) / "metadata.json") as f:
+            self.load_state_dict(json.load(f))
+
+    def _empty(self):
+        self._cursors = None
+        self._next_shard = 0
+
+
+class StratifiedSampler(Sampler):
+    """Samples the shards of a `ShardedStorage` in fixed proportions.
+
+    Pooling the data of many subjects in one buffer and sampling it uniformly
+    lets the subjects who played longest dominate every batch. This sampler
+    splits every batch over the non-empty shards, equally or in proportion to
+    `weights`, and samples the written rows of each shard uniformly.
+
+    Args:
+        weights: The relative weight of every shard. Defaults to equal weights.
+    """
+
+    def __init__(self, weights: Sequence[float] | None = None):
+        self.weights = None if weights is None else torch.as_tensor(weights)
+
+    def sample(
+        self, storage: ShardedStorage, batch_size: int
+    ) -> tuple[torch.Tensor, dict]:
+        lengths = storage.shard_lengths()
+        weights = torch.ones(len(lengths)) if self.weights is None else self.weights
+        weights = torch.where(lengths > 0, weights.double(), 0)
+        if weights.sum() == 0:
+            raise RuntimeError("Cannot sample from an empty storage.")
+        # Splits the batch by largest remainders, so the sizes sum to batch_size.
+        expected = weights / weights.sum() * batch_size
+        counts = expected.floor().long()
+        remainder = batch_size - int(counts.sum())
+        counts[(expected - counts).argsort(descending=True)[:remainder]] += 1
+
+        index = torch.cat(
+            [
+                torch.randint(int(lengths[k]), (int(counts[k]),))
+                + k * storage.shard_size
+                for k in counts.nonzero().squeeze(-1).tolist()
+            ]
+        )
+        return index, {}
+
+    def _empty(self):
+        pass
+
+    def dumps(self, path):
+        ...
+
+    def loads(self, path):
+        ...
+
+    def state_dict(self) -> dict[str, Any]:
+        return {}
+
+    def load_state_dict(self, state_dict: dict[str, Any]) -> None:
+        return
+
+
+def _collate_id(data):
+    # The shards return batches that are already stacked.
+    return data
+
+
+def make_sharded_buffer(
+    scratch_dirs: Sequence[str | os.PathLike],
+    shard_size: int,
+    batch_size: int,
+    num_shards: int | None = None,
+    shard_key: str | tuple[str, ...] = "shard_id",
+    weights: Sequence[float] | None = None,
+) -> TensorDictReplayBuffer:
+    """Makes a replay buffer over a `ShardedStorage` with stratified sampling.
+
+    Examples:
+        >>> prb = make_sharded_buffer(["/mnt/a", "/mnt/b"], 15_000, 240, 24)
+        >>> data["shard_id"] = torch.full(data.shape, subject_index)
+        >>> prb.extend(data)
+        >>> batch = prb.sample()
+
+    Args:
+        scratch_dirs: The directories the shards are spread over.
+        shard_size: The number of rows of a shard.
+        batch_size: The batch size of the buffer.
+        num_shards: The number of shards, one per directory by default.
+        shard_key: The key of the shard index of every row.
+        weights: The relative sampling weight of every shard.
+
+    Returns:
+        A `TensorDictReplayBuffer`.
+    """
+    return TensorDictReplayBuffer(
+        pin_memory=False,
+        storage=ShardedStorage(shard_size, scratch_dirs, num_shards),
+        writer=ShardedWriter(shard_key),
+        sampler=StratifiedSampler(weights),
+        batch_size=batch_size,
+        collate_fn=_collate_id,
+    )
+
+
+def pool_checkpoints(
+    replay_buffer: TensorDictReplayBuffer,
+    directories: Sequence[str | os.PathLike],
+    shard_key: str = "shard_id",
+) -> None:
+    """Pools the replay buffers of saved training runs, one run per shard.
+
+    Args:
+        replay_buffer: A buffer made with `make_sharded_buffer`.
+        directories: The checkpoint directories of the runs, e.g. of every
+            subject of a study. The buffer of the k-th run goes to shard k.
+        shard_key: The key of the shard index of the buffer.
+    """
+    for k, directory in enumerate(directories):
+        manifest = read_manifest(directory)
+        if manifest is None or "replay_buffer" not in manifest:
+            raise FileNotFoundError(f"No saved replay buffer in {directory}.")
+        segments = manifest["replay_buffer"]["segments"]
+        for _, file in sorted(segments.items(), key=lambda x: int(x[0])):
+            data = torch.load(Path(directory) / file).get("_data")
+            data.set(shard_key, torch.full(data.batch_size[:1], k))
+            replay_buffer.extend(data)
@@ -0,0 +1,145 @@
+from typing import Sequence
+
+import torch
+from torch.nn import functional as F
+
+__all__ = ["TemplateMatcher"]
+
+
+class TemplateMatcher:
+    """Detects a template in batches of frames by normalized cross-correlation.
+
+    A frame matches when, at some position, the correlation of the template
+    with the window of the frame under it, divided by the norms of both, is
+    above `threshold`. Computing it with two `F.conv2d` calls per frame costs
+    a multiply-add per pixel of the template at every position. Instead, the
+    correlation is a product in the frequency domain, computed for all the
+    template `scales` at once, and the norms of the windows are read from an
+    integral image of the squared frame.
+
+    Consecutive transitions share frames: the next frame of a step is the
+    current frame of the step after it. `match_transitions` matches the next
+    frames only, and reuses their results for the current frames that are
+    equal to the next frame of the previous row, including across batches.
+
+    Examples:
+        >>> matcher = TemplateMatcher(template, threshold=0.95, scales=[1.0, 0.5])
+        >>> in_current, in_next = matcher.match_transitions(f_current, f_next)
+
+    Args:
+        template: The template, of shape `[C, h, w]` or `[1, C, h, w]`.
+        threshold: The correlation above which a frame matches.
+        scales: The scales the template is matched at.
+        eps: Added to the frames and the template, as the conv2d version did,
+            so that black windows have a nonzero norm.
+    """
+
+    def __init__(
+        self,
+        template: torch.Tensor,
+        threshold: float,
+        scales: Sequence[float] = (1.0,),
+        eps: float = 1e-6,
+    ):
+        template = template.reshape(-1, *template.shape[-3:])[0]
+        self.templates = [
+            F.interpolate(
+                template.unsqueeze(0),
+                scale_factor=scale,
+                mode="bilinear",
+                align_corners=False,
+            )[0]
+            if scale != 1.0
+            else template
+            for scale in scales
+        ]
+        self.threshold = threshold
+        self.eps = eps
+        self._spectrum = None
+        self._last_frame = None
+        self._last_match = None
+
+    def _template_spectrum(self, shape: torch.Size, device) -> torch.Tensor:
+        """Returns the conjugate spectra of the templates, padded to the frames."""
+        if self._spectrum is None or self._spectrum[0] != (shape, device):
+            padded = torch.zeros(len(self.templates), *shape, device=device)
+            norms = []
+            for k, template in enumerate(self.templates):
+                template = template.to(device) + self.eps
+                _, h, w = template.shape
+                padded[k, :, :h, :w] = template
+                norms.append(template.pow(2).sum().sqrt())
+            spectrum = torch.fft.rfft2(padded).conj()
+            self._spectrum = ((shape, device), spectrum, torch.stack(norms))
+        return self._spectrum[1], self._spectrum[2]
+
+    def match(self, frames: torch.Tensor) -> torch.Tensor:
+        """Returns whether the template is in every frame of a `[B, C, H, W]` batch."""
+        torch._assert(len(frames.shape) == 4, "Frame should be 4D")
+        if len(frames) == 0:
+            return torch.zeros(0, dtype=torch.bool, device=frames.device)
+        frames = frames.float() + self.eps
+        _, _, height, width = frames.shape
+        spectrum, norms = self._template_spectrum(frames.shape[1:], frames.device)
+
+        # Circular correlation, exact at the positions where the template fits.
+        correlation = torch.fft.irfft2(
+            (torch.fft.rfft2(frames).unsqueeze(1) * spectrum).sum(dim=2),
+            s=(height, width),
+        )
+        # Integral image of the squared frame, for the energy of every window.
+        integral = F.pad(
+            frames.double().pow(2).sum(dim=1).cumsum(dim=1).cumsum(dim=2), (1, 0, 1, 0)
+        )
+
+        matches = torch.zeros(len(frames), dtype=torch.bool, device=frames.device)
+        for k, template in enumerate(self.templates):
+            _, h, w = template.shape
+            if h > height or w > width:
+                continue
+            energy = (
+                integral[:, h:, w:]
+                - integral[:, :-h, w:]
+                - integral[:, h:, :-w]
+                + integral[:, :-h, :-w]
+            )
+            brightness = energy.clamp_min(0).sqrt().float()
+            heat_map = correlation[:, k, : height - h + 1, : width - w + 1] / (
+                brightness * norms[k]
+            )
+            matches |= (heat_map > self.threshold).flatten(1).any(dim=1)
+        return matches
+
+    def match_transitions(
+        self, f_current: torch.Tensor, f_next: torch.Tensor
+    ) -> tuple[torch.Tensor, torch.Tensor]:
+        """Matches the current and the next frames of a batch of transitions.
+
+        Args:
+            f_current: The current frames, of shape `[B, C, H, W]`.
+            f_next: The next frames, of the same shape.
+
+        Returns:
+            Whether the template is in the current and in the next frames.
+        """
+        in_next = self.match(f_next)
+        if len(f_next) == 0:
+            return in_next.clone(), in_next
+        # previous_frames[i] is the next frame of the row before row first + i.
+        previous_frames, previous_matches, first = f_next[:-1], in_next[:-1], 1
+        if self._last_frame is not None and self._last_frame.shape == f_next.shape[1:]:
+            previous_frames = torch.cat(
+                [self._last_frame.unsqueeze(0), previous_frames]
+            )
+            previous_matches = torch.cat([self._last_match, previous_matches])
+            first = 0
+        shared = torch.zeros(len(f_current), dtype=torch.bool, device=f_next.device)
+        shared[first:] = (f_current[first:] == previous_frames).flatten(1).all(dim=1)
+
+        in_current = torch.empty_like(in_next)
+        in_current[first:] = previous_matches
+        in_current[~shared] = self.match(f_current[~shared])
+
+        self._last_frame = f_next[-1].clone()
+        self._last_match = in_next[-1:].clone()
+        return in_current, in_next
@@ -1,7 +1,7 @@
 from typing import Sequence
 
 import torch
-from tensordict.tensordict import TensorDictBase
+from tensordict.tensordict import TensorDict, TensorDictBase
 from tensordict.utils import NestedKey
 from torchrl.data.tensor_specs import TensorSpec
 from torchrl.data.utils import DEVICE_TYPING
@@ -10,6 +10,7 @@ from torchrl.envs.transforms.transforms import (
     FlattenObservation,
     ObservationTransform,
     ToTensorImage,
+    Transform,
     _apply_to_composite,
 )
 
@@ -272,3 +273,242 @@ class AddCoordinates(ObservationTransform):
 
     def __repr__(self) -> str:
         return f"{self.__class__.__name__}(" f"d={float(self.d):4.4f}, "
+
+
+class HistoryWindowTransform(Transform):
+    """Gathers the recent history of every frame of a batch of transitions.
+
+    For every frame, stacks the last `obs_channels` channels of the current and
+    `history_len` previous observations along the channel dimension, together
+    with the `history_len` previous actions and feedbacks, and writes them to
+    the "obs", "actions" and "feedbacks" entries of `out_key`. This is the input
+    of the learned feedback model.
+
+    The windows are strided views built with `unfold` over the batch
+    concatenated to the tail of the previous one, so no Python loop runs over
+    the frames. Flattening the observation window is zero-copy whenever every
+    channel is kept and the observations are contiguous.
+
+    The transform works on batches of consecutive transitions along their first
+    dimension, such as the output of a collector viewed as 1D, rather than on
+    the single steps of an environment. The frames before the first batch are
+    padded with the first frame.
+
+    Args:
+        history_len: The number of previous steps in the history.
+        obs_channels: The number of trailing channels of every observation
+            that are kept, e.g. the latest frame of a `CatFrames` stack.
+        obs_key: The image observation, of shape [..., C, H, W].
+        action_key: The action, of shape [..., A].
+        feedback_key: The feedback, of shape [..., 1].
+        out_key: Where the history is written.
+    """
+
+    def __init__(
+        self,
+        history_len: int = 6,
+        obs_channels: int = 3,
+        obs_key: NestedKey = ("agents", "observation", "obs_0"),
+        action_key: NestedKey = ("agents", "action"),
+        feedback_key: NestedKey = ("next", "agents", "feedback"),
+        out_key: NestedKey = ("agents", "history"),
+    ):
+        super().__init__(
+            in_keys=[obs_key, action_key, feedback_key], out_keys=[out_key]
+        )
+        self.history_len = history_len
+        self.obs_channels = obs_channels
+        self._past = None
+
+    def reset_history(self) -> None:
+        """Forgets the tail of the previous batch, e.g. between runs."""
+        self._past = None
+
+    def _window(self, frames: torch.Tensor, size: int, num_frames: int):
+        # [T, ..., D] -> [num_frames, ..., D, size], a view with the window last.
+        windows = frames.unfold(0, size, 1)[:num_frames]
+        # -> [num_frames, ..., size, D], still a view.
+        return windows.movedim(-1, -2)
+
+    def _call(self, tensordict: TensorDictBase) -> TensorDictBase:
+        obs_key, action_key, feedback_key = self.in_keys
+        num_frames = tensordict.shape[0]
+        current = tensordict.select(*self.in_keys)
+        if self._past is None:
+            self._past = current[:1].expand(self.history_len).clone()
+        frames = torch.cat([self._past, current], dim=0)
+        self._past = frames[-self.history_len :].clone()
+
+        obs = frames.get(obs_key)[..., -self.obs_channels :, :, :]
+        # [T, ..., C, H, W] -> [N, ..., C, H, W, history_len + 1]
+        obs = obs.unfold(0, self.history_len + 1, 1)[:num_frames]
+        # -> [N, ..., (history_len + 1) * C, H, W], oldest frame first.
+        obs = obs.movedim(-1, -4).flatten(-4, -3)
+        actions = self._window(frames.get(action_key), self.history_len, num_frames)
+        feedbacks = self._window(frames.get(feedback_key), self.history_len, num_frames)
+
+        tensordict.set(
+            self.out_keys[0],
+            TensorDict(
+                {"obs": obs, "actions": actions, "feedbacks": feedbacks},
+                batch_size=tensordict.batch_size,
+            ),
+        )
+        return tensordict
+
+    forward = _call
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}("
+            f"history_len={self.history_len}, obs_channels={self.obs_channels})"
+        )
+
+
+class FeedbackCreditTransform(Transform):
+    """Assigns streamed human feedback to the transitions it was given for.
+
+    Humans react to an action a few steps after it is taken, so the feedback
+    in the observation of step `t + delay` is moved to step `t`. Optionally,
+    it is then spread over a window of `credit_window` steps, averaged with the
+    gradient of the feedback along the step count as weights.
+
+    The transform works on batches of consecutive transitions along their first
+    dimension, such as the output of a collector viewed as 1D, and keeps the
+    stream going across batches: the last transitions of a batch are held back
+    until the feedback they are given arrives with the next one. The batches
+    are written after the held back transitions into a preallocated buffer, and
+    only the feedback column is shifted and averaged, with the feedback of the
+    previous transitions kept as context, so no batch is concatenated or
+    padded. Every output holds as many transitions as the batch, except the
+    first ones, which are shorter by the number of held back transitions.
+
+    The output is a view of the buffer of the transform, valid until the next
+    call.
+
+    Examples:
+        >>> feedback_credit = FeedbackCreditTransform(delay=2)
+        >>> for data in collector:
+        ...     data = feedback_credit(data)
+        ...     prb.extend(data)
+
+    Args:
+        delay: The number of steps the feedback is shifted by.
+        credit_window: The number of steps the feedback is averaged over, or 0
+            for no averaging.
+        feedback_key: The vector observation whose `[..., -1, 0]` entry is the
+            feedback.
+        step_count_key: The step count the gradient of the feedback is
+            computed along.
+    """
+
+    def __init__(
+        self,
+        delay: int,
+        credit_window: int = 0,
+        feedback_key: NestedKey = ("agents", "observation", "obs_1"),
+        step_count_key: NestedKey = ("agents", "step_count"),
+    ):
+        in_keys = [feedback_key] + ([step_count_key] if credit_window else [])
+        super().__init__(in_keys=in_keys, out_keys=[feedback_key])
+        self.delay = delay
+        self.credit_window = credit_window
+        self.feedback_key = feedback_key
+        self.step_count_key = step_count_key
+        # Steps of the window before and after the step it is centered on.
+        self._before = (credit_window - 1) // 2 if credit_window else 0
+        self._after = credit_window // 2 if credit_window else 0
+        # The transitions held back until their feedback and, when averaging,
+        # that of their window and its gradient are known.
+        self.lag = delay + (self._after + 1 if credit_window else 0)
+        # The steps before the first held back one whose feedback is needed.
+        self.context = self._before + 1 if credit_window else 0
+        self.reset_stream()
+
+    def reset_stream(self) -> None:
+        """Drops the held back transitions, e.g. between runs."""
+        self._rows = None
+        self._end = 0
+        self._num_pending = 0
+        self._feedback = None
+        self._step_count = None
+
+    def _hold(self, tensordict: TensorDictBase) -> TensorDictBase:
+        """Writes a batch after the held back transitions and returns them all."""
+        pending, count = self._num_pending, self._num_pending + len(tensordict)
+        held = self._rows[self._end - pending : self._end] if pending else None
+        rows = self._rows
+        if (
+            rows is None
+            or len(rows) < count
+            or rows.device != tensordict.device
+            or set(rows.keys(True, True)) != set(tensordict.keys(True, True))
+        ):
+            capacity = self.lag + len(tensordict)
+            rows = self._rows = tensordict[:1].expand(capacity).clone()
+        if pending:
+            # The held back transitions may overlap their new place.
+            rows[:pending] = held.clone()
+        rows[pending:count] = tensordict
+        self._end = count
+        return rows[:count]
+
+    def _credit(
+        self, feedback: torch.Tensor, step_count: torch.Tensor, first: int, num: int
+    ) -> torch.Tensor:
+        """Averages the feedback of steps `[first, first + num)` over their windows."""
+        coordinates = step_count.reshape(len(step_count), -1)[:, 0].to(feedback.dtype)
+        grads = torch.gradient(feedback, spacing=(coordinates,), dim=0)[0]
+        start, stop = first - self._before, first + num + self._after
+        # Only the first steps of the stream lack the context of their window.
+        padding = max(0, -start)
+        feedback, grads = feedback[max(0, start) : stop], grads[max(0, start) : stop]
+        if padding:
+            zeros = feedback.new_zeros(padding, *feedback.shape[1:])
+            feedback, grads = torch.cat([zeros, feedback]), torch.cat([zeros, grads])
+        weighted = (feedback * grads).unfold(0, self.credit_window, 1).sum(dim=-1)
+        weights = grads.unfold(0, self.credit_window, 1).sum(dim=-1)
+        return weighted / (weights + 1e-10)
+
+    def _call(self, tensordict: TensorDictBase) -> TensorDictBase:
+        rows = self._hold(tensordict)
+        num_out = max(0, len(rows) - self.lag)
+
+        feedback = tensordict.get(self.feedback_key)[..., -1, 0].clone()
+        step_count = None
+        if self.credit_window:
+            step_count = tensordict.get(self.step_count_key).clone()
+        if self._feedback is not None:
+            feedback = torch.cat([self._feedback, feedback])
+            if step_count is not None:
+                step_count = torch.cat([self._step_count, step_count])
+        # The first step of the held back transitions in the feedback stream.
+        first = len(feedback) - len(rows)
+
+        # The feedback given for step t is that of step t + delay.
+        delayed = feedback[self.delay :]
+        out = rows[:num_out]
+        if num_out:
+            if self.credit_window:
+                assigned = self._credit(
+                    delayed, step_count[: len(delayed)], first, num_out
+                )
+            else:
+                assigned = delayed[first : first + num_out]
+            out.get(self.feedback_key)[..., -1, 0] = assigned
+
+        # Keeps the feedback of the held back steps and of the context before them.
+        keep = max(0, first + num_out - self.context)
+        self._feedback = feedback[keep:]
+        if step_count is not None:
+            self._step_count = step_count[keep:]
+        self._num_pending = len(rows) - num_out
+        return out
+
+    forward = _call
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}("
+            f"delay={self.delay}, credit_window={self.credit_window})"
+        )
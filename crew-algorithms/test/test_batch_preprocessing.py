@@ -0,0 +1,57 @@
+from pathlib import Path
+
+import torch
+from crew_algorithms.ddpg.utils import make_env
+from crew_algorithms.envs.configs import FindTreasureConfig
+from crew_algorithms.utils.batch_preprocessing import BatchPreprocessor
+from torchrl.collectors import SyncDataCollector
+
+ASSETS = Path(__file__).parents[1] / "assets"
+
+
+def test_instances_are_preprocessed_as_separate_streams():
+    env_cfg = FindTreasureConfig(
+        mock=True, num_instances=2, target_img=ASSETS / "treasure.png"
+    )
+    collector = SyncDataCollector(
+        lambda: make_env(env_cfg, None, False, "cpu"),
+        None,
+        frames_per_batch=16,
+        total_frames=48,
+        split_trajs=False,
+    )
+
+    def make_preprocessor():
+        return BatchPreprocessor(
+            env_cfg, "cpu", human_feedback=True, credit_window=3, history=True
+        )
+
+    preprocess = make_preprocessor()
+    instance_preprocessors = [make_preprocessor() for _ in range(2)]
+    torch.manual_seed(0)
+    try:
+        for data in collector:
+            assert data.batch_size == (2, 8)
+            # The human feedback, different for every step of every instance.
+            obs_1 = data["agents", "observation", "obs_1"]
+            obs_1[..., -1, 0] = torch.randn(obs_1.shape[:-2])
+
+            expected = torch.cat(
+                [
+                    instance_preprocess(data[instance].clone())
+                    for instance, instance_preprocess in enumerate(
+                        instance_preprocessors
+                    )
+                ]
+            )
+            transitions = preprocess(data.clone())
+
+            for key in [
+                ("next", "agents", "reward"),
+                ("next", "agents", "feedback"),
+                ("agents", "history", "feedbacks"),
+                ("agents", "history", "obs"),
+            ]:
+                torch.testing.assert_close(transitions[key], expected[key])
+    finally:
+        collector.shutdown()
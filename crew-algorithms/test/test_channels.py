@@ -0,0 +1,66 @@
+import uuid
+
+from crew_algorithms.envs.channels import ToggleTimestepChannel, WrittenFeedbackChannel
+from crew_algorithms.envs.channels.messages.written_feedback import (
+    WrittenFeedbackMessage,
+)
+from crew_algorithms.envs.configs import WildfireConfig
+from crew_algorithms.utils import rl_utils
+from mlagents_envs.side_channel import IncomingMessage, OutgoingMessage
+
+
+def test_toggles_are_sent_to_every_replica():
+    channel = ToggleTimestepChannel(uuid.uuid4())
+    replicas = [channel.replicate() for _ in range(2)]
+
+    channel.send_toogle_timestep()
+
+    assert len({c.channel_id for c in [channel, *replicas]}) == 3
+    for c in [channel, *replicas]:
+        assert len(c.message_queue) == 1
+
+
+def test_written_feedback_of_replicas_reaches_the_callback():
+    received = []
+    channel = WrittenFeedbackChannel(uuid.uuid4(), received.append)
+    replica = channel.replicate()
+    msg = OutgoingMessage()
+    msg.write_string('["WF", ["good job"]]')
+
+    replica.on_message_received(IncomingMessage(bytes(msg.buffer)))
+
+    assert received == [WrittenFeedbackMessage("good job")]
+
+
+def test_every_instance_gets_its_own_channels(monkeypatch, tmp_path):
+    launched = []
+    monkeypatch.setattr(
+        rl_utils, "UnityEnv", lambda *args, **kwargs: launched.append(kwargs)
+    )
+    monkeypatch.setattr(
+        rl_utils, "UnityVecEnv", lambda fns, device: [fn() for fn in fns]
+    )
+    toggle_channel = ToggleTimestepChannel(uuid.uuid4())
+    written_channel = WrittenFeedbackChannel(uuid.uuid4())
+
+    rl_utils.make_base_env(
+        WildfireConfig(num_instances=3, log_folder_path=tmp_path),
+        "cpu",
+        toggle_timestep_channel=toggle_channel,
+        written_feedback_channel=written_channel,
+    )
+
+    channel_ids = set()
+    for kwargs in launched:
+        args = kwargs["additional_args"]
+        ids = {
+            args[args.index("-ToggleTimestepChannelID") + 1],
+            args[args.index("-WrittenFeedbackChannelID") + 1],
+        }
+        registered = {str(channel.channel_id) for channel in kwargs["side_channels"]}
+        assert ids <= registered
+        channel_ids |= ids
+    assert len(launched) == 3
+    assert len(channel_ids) == 6
+    assert str(toggle_channel.channel_id) in channel_ids
+    assert str(written_channel.channel_id) in channel_ids
@@ -0,0 +1,74 @@
+import torch
+from crew_algorithms.utils.checkpoint import (
+    CheckpointWriter,
+    load_replay_buffer,
+    read_manifest,
+)
+from tensordict import TensorDict
+from torchrl.data import LazyTensorStorage, TensorDictReplayBuffer
+from torchrl.data.replay_buffers.samplers import PrioritizedSampler
+
+
+def make_buffer():
+    return TensorDictReplayBuffer(
+        storage=LazyTensorStorage(10),
+        sampler=PrioritizedSampler(max_capacity=10, alpha=0.7, beta=0.9),
+        batch_size=4,
+    )
+
+
+def frames(start, stop):
+    return TensorDict({"obs": torch.arange(start, stop).float()}, [stop - start])
+
+
+def priorities(prb):
+    index = torch.arange(len(prb))
+    sampler = prb._sampler
+    return torch.as_tensor(sampler._sum_tree[index]), sampler._max_priority
+
+
+def test_resume_from_an_incremental_checkpoint(tmp_path):
+    prb = make_buffer()
+    writer = CheckpointWriter(segment_size=2)
+    prb.extend(frames(0, 6))
+    prb.update_priority(torch.arange(6), torch.arange(1, 7).float())
+    writer.save_training(tmp_path, 1, {}, replay_buffer=prb)
+    # Wraps around the ring: rows 0-1 and 6-9 change, rows 2-5 do not.
+    prb.extend(frames(6, 12))
+    writer.save_training(tmp_path, 2, {}, meta={"step": 2}, replay_buffer=prb)
+    writer.close()
+
+    manifest = read_manifest(tmp_path)
+    assert manifest["iteration"] == 2
+    assert manifest["meta"] == {"step": 2}
+    assert manifest["replay_buffer"]["segments"] == {
+        "0": "prb/segment_0_2.pt",
+        "1": "prb/segment_1_1.pt",
+        "2": "prb/segment_2_1.pt",
+        "3": "prb/segment_3_2.pt",
+        "4": "prb/segment_4_2.pt",
+    }
+    assert not (tmp_path / "prb" / "segment_0_1.pt").exists()
+
+    resumed = make_buffer()
+    load_replay_buffer(resumed, tmp_path, manifest)
+    assert len(resumed) == 10
+    assert torch.equal(resumed[:]["obs"], prb[:]["obs"])
+    assert torch.allclose(priorities(resumed)[0], priorities(prb)[0])
+    assert priorities(resumed)[1] == priorities(prb)[1]
+    resumed.extend(frames(12, 13))
+    assert resumed[2]["obs"] == 12
+
+
+def test_checkpoint_is_not_affected_by_later_writes(tmp_path):
+    prb = make_buffer()
+    writer = CheckpointWriter(segment_size=4)
+    prb.extend(frames(0, 6))
+    writer.save_training(tmp_path, 1, {}, replay_buffer=prb)
+    prb.extend(frames(6, 12))
+    writer.close()
+
+    resumed = make_buffer()
+    load_replay_buffer(resumed, tmp_path, read_manifest(tmp_path))
+    assert len(resumed) == 6
+    assert torch.equal(resumed[:]["obs"], torch.arange(6).float())
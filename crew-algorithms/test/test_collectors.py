@@ -0,0 +1,46 @@
+import pytest
+import torch
+from crew_algorithms.ddpg.utils import make_env
+from crew_algorithms.envs.configs import FindTreasureConfig
+from crew_algorithms.utils.collectors import PipelinedDataCollector
+from crew_algorithms.utils.rl_utils import make_collector
+from omegaconf import OmegaConf
+
+
+def test_pipelined_collector_yields_one_stream_per_env():
+    env_cfg = FindTreasureConfig(mock=True, mock_episode_length=5)
+    collector = PipelinedDataCollector(
+        [lambda: make_env(env_cfg, None, False, "cpu")] * 2,
+        None,
+        frames_per_batch=15,
+        total_frames=48,
+        init_random_frames=48,
+    )
+    try:
+        batches = list(collector)
+    finally:
+        collector.shutdown()
+
+    # 15 frames are rounded up to 8 steps of each of the 2 environments.
+    assert [data.batch_size for data in batches] == [(2, 8)] * 3
+    data = torch.cat(batches, dim=-1)
+    traj_ids = data["collector", "traj_ids"]
+    step_count = data["agents", "step_count"].reshape(*data.batch_size)
+    same_traj = traj_ids[:, 1:] == traj_ids[:, :-1]
+    # Within an episode, the steps of an environment are consecutive.
+    assert (step_count[:, 1:] - step_count[:, :-1])[same_traj].eq(1).all()
+    assert (step_count[:, 1:][~same_traj] == 0).all()
+    assert not set(traj_ids[0].tolist()) & set(traj_ids[1].tolist())
+
+
+def test_in_process_collection_of_several_envs_is_pipelined_explicitly():
+    cfg = OmegaConf.create(
+        {
+            "frames_per_batch": 8,
+            "total_frames": 16,
+            "exploration_mode": "random",
+            "init_random_frames": 16,
+        }
+    )
+    with pytest.raises(ValueError):
+        make_collector(cfg, None, None, "cpu", num_envs=2, in_process=True)
@@ -0,0 +1,46 @@
+import torch
+from crew_algorithms.utils.episode_index import EpisodeIndex
+from tensordict import TensorDict
+from torchrl.data import LazyTensorStorage, TensorDictReplayBuffer
+
+
+def steps(traj_id, start, stop):
+    return TensorDict(
+        {
+            "collector": {"traj_ids": torch.full((stop - start,), traj_id)},
+            "time_stamp": torch.arange(start, stop).float(),
+        },
+        [stop - start],
+    )
+
+
+def check(index):
+    assert index.trajectories() == [0, 1]
+    assert index.rows(0).tolist() == [2, 3]
+    assert index.rows(1).tolist() == [4, 5, 0, 1]
+    assert index.rows([1, 0]).tolist() == [4, 5, 0, 1, 2, 3]
+    assert index.rows_between(3, 6).tolist() == [3, 4, 5]
+    assert index.rows_between(6).tolist() == [0, 1]
+    assert len(index) == 6
+
+
+def test_index_after_the_ring_wraps_around():
+    prb = TensorDictReplayBuffer(storage=LazyTensorStorage(6), batch_size=2)
+    index = EpisodeIndex(prb)
+    prb.extend(steps(0, 0, 4))
+    prb.extend(steps(1, 4, 8))
+
+    check(index)
+    # The overwritten rows of the first trajectory are no longer indexed.
+    assert index.rows_between(None, 2).tolist() == []
+
+
+def test_rebuild_restores_the_write_order():
+    prb = TensorDictReplayBuffer(storage=LazyTensorStorage(6), batch_size=2)
+    prb.extend(steps(0, 0, 4))
+    prb.extend(steps(1, 4, 8))
+
+    index = EpisodeIndex(prb)
+    assert len(index) == 0
+    index.rebuild()
+    check(index)
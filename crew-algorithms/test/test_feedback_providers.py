@@ -0,0 +1,104 @@
+from pathlib import Path
+
+import pytest
+import torch
+from crew_algorithms.ddpg.utils import make_env
+from crew_algorithms.envs.configs import (
+    BowlingConfig,
+    FindTreasureConfig,
+    HideAndSeek1V1Config,
+    WildfireConfig,
+)
+from crew_algorithms.utils.feedback_providers import (
+    BowlingFeedback,
+    WildfireFeedback,
+    make_feedback_provider,
+)
+from tensordict import TensorDict
+
+ASSETS = Path(__file__).parents[1] / "assets"
+
+
+@pytest.mark.parametrize(
+    "env_cfg",
+    [
+        FindTreasureConfig(mock=True, target_img=ASSETS / "treasure.png"),
+        HideAndSeek1V1Config(mock=True, target_img=ASSETS / "hider.png"),
+        BowlingConfig(mock=True),
+    ],
+    ids=lambda env_cfg: env_cfg.name,
+)
+def test_feedback_has_the_shape_of_the_reward(env_cfg):
+    env = make_env(env_cfg, None, False, "cpu")
+    try:
+        data = env.rollout(6)
+    finally:
+        env.close()
+    provider = make_feedback_provider(env_cfg, "cpu")
+
+    feedback = provider(data)
+
+    assert feedback.shape == data["next", "agents", "reward"].shape
+    data.set(("next", "agents", "heuristic_feedback"), feedback)
+
+
+def transitions(key, obs, next_obs):
+    return TensorDict(
+        {
+            "agents": {"observation": {key: obs}},
+            "next": {"agents": {"observation": {key: next_obs}}},
+        },
+        batch_size=obs.shape[:1],
+    )
+
+
+def bowling_obs(ball, standing):
+    """The Bowling vector observation of one agent, with 10 pins in a row."""
+    env_cfg = BowlingConfig()
+    obs_1 = torch.zeros(1, 1, 1, 36)
+    state = obs_1[..., env_cfg.state_start_dim : env_cfg.state_end_dim]
+    state[..., :2] = torch.tensor(ball)
+    pins = state[..., 2:].unflatten(-1, (10, 3))
+    pins[..., 0] = torch.tensor(standing, dtype=torch.float)
+    pins[..., 1] = torch.arange(10.0)
+    pins[..., 2] = 5.0
+    return obs_1
+
+
+def test_bowling_feedback_for_knocked_down_pins():
+    provider = BowlingFeedback(BowlingConfig(), "cpu", pin_scale=0.3)
+    standing = [1] * 10
+    data = transitions(
+        "obs_1",
+        bowling_obs([4.5, 0.0], standing),
+        bowling_obs([4.5, 0.0], [0] + standing[1:]),
+    )
+
+    torch.testing.assert_close(provider(data), torch.full((1, 1, 1), 0.3))
+
+
+def test_bowling_feedback_for_moving_the_ball_to_the_pins():
+    provider = BowlingFeedback(BowlingConfig(), "cpu")
+    standing = [1] * 10
+    # The pins standing are centered on (4.5, 5).
+    data = transitions(
+        "obs_1",
+        bowling_obs([4.5, 1.0], standing),
+        bowling_obs([4.5, 3.0], standing),
+    )
+
+    # The mean squared distance drops from 8 to 2.
+    torch.testing.assert_close(provider(data), torch.full((1, 1, 1), 0.6))
+
+
+def test_wildfire_feedback_gives_every_agent_the_score_increase():
+    provider = WildfireFeedback(WildfireConfig(), "cpu", score_scale=0.5)
+    obs_0 = torch.zeros(2, 3, 3728)
+    next_obs_0 = obs_0.clone()
+    obs_0[..., 0, WildfireFeedback.score_dim] = torch.tensor([1.0, 4.0])
+    next_obs_0[..., 0, WildfireFeedback.score_dim] = torch.tensor([3.0, 4.0])
+
+    feedback = provider(transitions("obs_0", obs_0, next_obs_0))
+
+    expected = torch.tensor([1.0, 0.0])[:, None, None].expand(2, 3, 1)
+    torch.testing.assert_close(feedback, expected)
@@ -0,0 +1,50 @@
+import torch
+from crew_algorithms.utils.frame_storage import FrameStackStorage
+from tensordict import TensorDict
+from torchrl.data import TensorDictReplayBuffer
+
+OBS_KEY = ("agents", "observation", "obs_0")
+
+
+def stack(steps):
+    """Stacks single channel 2x2 frames whose pixels are their step / 255."""
+    return torch.stack(
+        [
+            torch.cat([torch.full((1, 2, 2), max(s, 0) / 255) for s in step])
+            for step in steps
+        ]
+    )
+
+
+def steps(start, stop):
+    obs = [[t - 2, t - 1, t] for t in range(start, stop)]
+    next_obs = [[t - 1, t, t + 1] for t in range(start, stop)]
+    return TensorDict(
+        {
+            "agents": {"observation": {"obs_0": stack(obs)}},
+            "next": {"agents": {"observation": {"obs_0": stack(next_obs)}}},
+            "collector": {"traj_ids": torch.zeros(stop - start, dtype=torch.long)},
+            "step": torch.arange(start, stop),
+        },
+        [stop - start],
+    )
+
+
+def test_linked_frames_are_rebuilt_after_the_ring_wraps_around(tmp_path):
+    storage = FrameStackStorage(5, num_channels=1, num_stacks=3, scratch_dir=tmp_path)
+    prb = TensorDictReplayBuffer(storage=storage, batch_size=5)
+    for start in range(0, 8, 2):
+        prb.extend(steps(start, start + 2))
+
+    data = prb[:]
+    order = data["step"].argsort()
+    obs = data[OBS_KEY][order]
+    next_obs = data["next", *OBS_KEY][order]
+    assert data["step"][order].tolist() == [3, 4, 5, 6, 7]
+    # Steps 1 and 2 were overwritten, so the oldest frame left is repeated.
+    assert torch.equal(
+        obs, stack([[3, 3, 3], [3, 3, 4], [3, 4, 5], [4, 5, 6], [5, 6, 7]])
+    )
+    assert torch.equal(
+        next_obs, stack([[3, 3, 4], [3, 4, 5], [4, 5, 6], [5, 6, 7], [6, 7, 8]])
+    )
@@ -0,0 +1,76 @@
+from crew_algorithms.envs import unity
+from crew_algorithms.envs.configs import FindTreasureConfig
+from crew_algorithms.envs.mock import MockUnityEnvironment, make_mock_behaviors
+from crew_algorithms.envs.pool import UnityEnvPool
+
+
+class CountingEnv(MockUnityEnvironment):
+    def __init__(self):
+        self.resets = 0
+        self.closes = 0
+        super().__init__(make_mock_behaviors(FindTreasureConfig()))
+
+    def reset(self):
+        self.resets += 1
+        super().reset()
+
+    def close(self):
+        self.closes += 1
+        super().close()
+
+
+def test_pool_reuses_released_envs_per_key():
+    pool = UnityEnvPool()
+    env = pool.acquire("a", CountingEnv)
+    assert len(pool) == 0
+
+    pool.release("a", env)
+    assert len(pool) == 1
+    resets = env.resets
+    assert pool.acquire("b", CountingEnv) is not env
+    assert pool.acquire("a", CountingEnv) is env
+    assert env.resets == resets + 1
+    assert len(pool) == 0
+
+    pool.release("a", env)
+    pool.close_all()
+    assert len(pool) == 0
+    assert env.closes == 1
+    # Envs released after close_all are closed instead of kept.
+    other = CountingEnv()
+    pool.release("a", other)
+    assert len(pool) == 0
+    assert other.closes == 1
+
+
+def test_unity_env_hands_its_server_back_to_the_pool(monkeypatch):
+    pool = UnityEnvPool()
+    launched = []
+
+    def launch(*args, **kwargs):
+        launched.append(CountingEnv())
+        return launched[-1]
+
+    monkeypatch.setattr(unity, "unity_env_pool", pool)
+    monkeypatch.setattr(unity, "UnityEnvironment", launch)
+
+    env = unity.UnityEnv(reuse_env=True, device="cpu")
+    env.rollout(3)
+    env.close()
+    env.close()
+    assert len(launched) == 1
+    assert launched[0].closes == 0
+    assert len(pool) == 1
+
+    reused = unity.UnityEnv(reuse_env=True, device="cpu")
+    assert len(launched) == 1
+    assert reused.rollout(3).batch_size == (3,)
+    reused.close()
+
+    other = unity.UnityEnv(reuse_env=True, device="cpu", additional_args=["-x"])
+    assert len(launched) == 2
+    other.close()
+    assert len(pool) == 2
+
+    pool.close_all()
+    assert [env.closes for env in launched] == [1, 1]
@@ -0,0 +1,21 @@
+import pytest
+from crew_algorithms.envs.configs import FindTreasureConfig
+from crew_algorithms.envs.mock import MockUnityEnvironment, make_mock_behaviors
+from crew_algorithms.envs.unity import UnityWrapper
+
+
+def make_wrapper(**kwargs):
+    behaviors = make_mock_behaviors(FindTreasureConfig())
+    return UnityWrapper(MockUnityEnvironment(behaviors), device="cpu", **kwargs)
+
+
+@pytest.mark.parametrize("batched_decode", [False, True])
+def test_buffered_mode_falls_back_on_cpu_with_a_warning(batched_decode):
+    with pytest.warns(UserWarning, match="buffered mode requires a CUDA device"):
+        env = make_wrapper(buffered=True, batched_decode=batched_decode)
+    try:
+        assert not env._buffered
+        assert env._batched_decode == batched_decode
+        assert env.rollout(3).batch_size == (3,)
+    finally:
+        env.close()